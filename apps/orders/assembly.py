@@ -0,0 +1,104 @@
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.users import models as user_models
+
+from .models import Order, Cart, CartModifier
+from .pricing import price_order
+
+CartLine = namedtuple('CartLine', ['product_id', 'size_id', 'paid_count', 'free_count', 'modifier_ids'])
+
+
+class OrderAssemblyError(Exception):
+    pass
+
+
+def parse_cart_items(cart_items):
+    """
+    Normalize the raw `cart_items` payload into CartLine tuples.
+    """
+    lines = []
+    for cart_item in cart_items:
+        try:
+            product_id = int(cart_item['product'])
+            size_id = int(cart_item['size']) if cart_item.get('size') is not None else None
+            count = int(cart_item['count'])
+            free_count = int(cart_item.get('free_count') or 0)
+            modifier_ids = [int(modifier_id) for modifier_id in cart_item.get('modifiers') or []]
+        except (KeyError, TypeError, ValueError):
+            raise OrderAssemblyError('Invalid cart item: {}'.format(cart_item))
+        if count <= 0 or free_count < 0 or free_count > count:
+            raise OrderAssemblyError('Invalid count for product {}'.format(product_id))
+        lines.append(CartLine(product_id, size_id, count - free_count, free_count, modifier_ids))
+    return lines
+
+
+def redeem_free_items(customer, cafe, product_id, count):
+    """
+    Redeem `count` of the customer's oldest valid free items for this cafe in a single UPDATE.
+    The outer status filter is re-checked on every row the UPDATE locks, so an item redeemed by a
+    concurrent order is skipped and the shortfall is reported instead of being redeemed twice.
+    """
+    # Items past their expire time stay valid until the expiry task runs, they must not be redeemed meanwhile
+    candidates = user_models.FreeItem.objects.filter(owner=customer, root_cafe__owner_id=cafe.user_id,
+                                                     status=user_models.FreeItem.VALID).exclude(
+        expire_time__lte=timezone.now()).order_by('pk')
+    redeemed = user_models.FreeItem.objects.filter(
+        pk__in=candidates.values('pk')[:count], status=user_models.FreeItem.VALID
+    ).update(product_id=product_id, status=user_models.FreeItem.REDEEMED)
+    if redeemed < count:
+        raise OrderAssemblyError('Not enough free items for product {}'.format(product_id))
+
+
+def build_cart_rows(order, lines, line_prices):
+    """
+    Returns the Cart rows of an order and, for each of them, the (modifier_id, price) pairs of its modifiers.
+    Prices are snapshots of the menu at checkout; free rows keep a product price of 0.
+    """
+    carts = []
+    modifiers_by_cart = []
+    for line, (unit_price, modifier_prices) in zip(lines, line_prices):
+        for count, is_free in ((line.paid_count, False), (line.free_count, True)):
+            if count:
+                carts.append(Cart(order=order, product_id=line.product_id, size_id=line.size_id, count=count,
+                                  is_free=is_free, price=0 if is_free else unit_price))
+                modifiers_by_cart.append(list(zip(line.modifier_ids, modifier_prices)))
+    return carts, modifiers_by_cart
+
+
+def create_order(customer, cart_items, **order_data):
+    """
+    Price and create an order with all its cart and modifier rows in one transaction.
+    Raises OrderAssemblyError or PricingError and writes nothing if the cart is invalid or free items are short.
+    """
+    lines = parse_cart_items(cart_items)
+    cafe = order_data.get('cafe')
+    if cafe is None:
+        raise OrderAssemblyError('Orders must be placed in a cafe')
+    line_prices, totals = price_order(cafe, lines)
+    order_data.update(totals)
+
+    with transaction.atomic():
+        order = Order.objects.create(customer=customer, **order_data)
+        carts, modifiers_by_cart = build_cart_rows(order, lines, line_prices)
+        # PostgreSQL returns the new primary keys, so modifiers can point at the carts straight away
+        Cart.objects.bulk_create(carts)
+        CartModifier.objects.bulk_create([
+            CartModifier(cart=cart, order=order, product_id=cart.product_id, modifier_id=modifier_id,
+                         price=price, count=cart.count)
+            for cart, modifiers in zip(carts, modifiers_by_cart)
+            for modifier_id, price in modifiers
+        ])
+
+        for line in lines:
+            if line.free_count:
+                redeem_free_items(customer, cafe, line.product_id, line.free_count)
+
+        inviter = getattr(customer, 'inviter', None)
+        if inviter and inviter.given_free_item is False:
+            user_models.FreeItem.objects.create(owner_id=inviter.inviter_id)
+            inviter.given_free_item = True
+            inviter.save(update_fields=['given_free_item'])
+    return order
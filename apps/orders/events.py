@@ -0,0 +1,117 @@
+"""
+Order events for the cashier stream.
+
+Every event gets an id from one global Redis counter and is stored in a sorted set per cafe, scored by
+that id, so a client that reconnects with `since=<last id>` gets exactly the events it missed.
+A PUBLISH on the cafe channel wakes up long-polling requests waiting for that cafe.
+"""
+import json
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+ORDER_EVENTS_REDIS_URL = getattr(settings, 'ORDER_EVENTS_REDIS_URL', 'redis://localhost:6380/1')
+# Events kept per cafe; clients that fall further behind should reload the order list
+ORDER_EVENTS_PER_CAFE = 500
+ORDER_EVENTS_TTL = 60 * 60 * 24
+SEQUENCE_KEY = 'orders:events:seq'
+CAFE_EVENTS_KEY = 'orders:events:cafe:{}'
+
+CREATED = 'created'
+STATE_CHANGED = 'state_changed'
+
+# The id is taken and the event stored in one atomic step, so events enter the sorted sets in id order
+# and a reader can never see an id after skipping a smaller one that was still being written
+PUBLISH_SCRIPT = """
+local event_id = redis.call('INCR', KEYS[1])
+local event = cjson.decode(ARGV[1])
+event['id'] = event_id
+redis.call('ZADD', KEYS[2], event_id, cjson.encode(event))
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('PUBLISH', KEYS[2], event_id)
+return event_id
+"""
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_publish_script = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.StrictRedis.from_url(ORDER_EVENTS_REDIS_URL)
+    return _client
+
+
+def get_publish_script():
+    global _publish_script
+    if _publish_script is None:
+        _publish_script = get_client().register_script(PUBLISH_SCRIPT)
+    return _publish_script
+
+
+def get_cafe_events_key(cafe_id):
+    return CAFE_EVENTS_KEY.format(cafe_id)
+
+
+def publish_order_event(order, event_type):
+    """
+    Store and announce an order event. Failures are logged and swallowed: the order is already
+    committed and cashiers can still reload the order list.
+    """
+    if not order.cafe_id:
+        return None
+    key = get_cafe_events_key(order.cafe_id)
+    event = json.dumps({
+        'type': event_type,
+        'order_id': order.pk,
+        'cafe_id': order.cafe_id,
+        'state': order.state,
+    })
+    try:
+        event_id = get_publish_script()(keys=[SEQUENCE_KEY, key],
+                                        args=[event, ORDER_EVENTS_PER_CAFE, ORDER_EVENTS_TTL])
+    except redis.RedisError:
+        logger.exception('Order event for order %s was not published', order.pk)
+        return None
+    return event_id
+
+
+def get_last_event_id():
+    return int(get_client().get(SEQUENCE_KEY) or 0)
+
+
+def get_events(cafe_ids, since):
+    client = get_client()
+    pipeline = client.pipeline()
+    for cafe_id in cafe_ids:
+        pipeline.zrangebyscore(get_cafe_events_key(cafe_id), '({}'.format(since), '+inf')
+    events = [json.loads(event.decode()) for cafe_events in pipeline.execute() for event in cafe_events]
+    return sorted(events, key=lambda event: event['id'])
+
+
+def wait_for_events(cafe_ids, since, timeout):
+    """
+    Return the events of these cafes newer than `since`, waiting up to `timeout` seconds for one to arrive.
+    """
+    events = get_events(cafe_ids, since)
+    if events or not cafe_ids:
+        return events
+
+    pubsub = get_client().pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(*[get_cafe_events_key(cafe_id) for cafe_id in cafe_ids])
+        # Read again after subscribing, an event published in between would otherwise be missed
+        events = get_events(cafe_ids, since)
+        deadline = time.time() + timeout
+        while not events and time.time() < deadline:
+            if pubsub.get_message(timeout=max(deadline - time.time(), 0)):
+                events = get_events(cafe_ids, since)
+    finally:
+        pubsub.close()
+    return events
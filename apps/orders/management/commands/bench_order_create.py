@@ -0,0 +1,92 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.users import models as user_models
+from apps.products import models as product_models
+from apps.modifiers import models as modifier_models
+from apps.orders import models as order_models
+from apps.orders import assembly as order_assembly
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Count database round trips for creating a typical order. All created rows are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10)
+        parser.add_argument('--modifiers', type=int, default=2, help='Modifiers per cart line')
+        parser.add_argument('--free', type=int, default=1, help='Free items redeemed on the first line')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                customer, cafe, cart_items = self.create_catalog(options)
+                self.measure('per-row saves', lambda: self.create_row_by_row(customer, cafe, cart_items))
+                self.measure('bulk assembly, cold price cache',
+                             lambda: order_assembly.create_order(customer, cart_items, cafe=cafe))
+                self.measure('bulk assembly, warm price cache',
+                             lambda: order_assembly.create_order(customer, cart_items, cafe=cafe))
+                raise Rollback()
+        except Rollback:
+            self.stdout.write('Synthetic rows rolled back')
+
+    def create_catalog(self, options):
+        owner = user_models.User.objects.create_user(phone='bench000001', password=None,
+                                                     user_type=user_models.User.OWNER)
+        customer = user_models.User.objects.create_user(phone='bench000002', password=None)
+        root_cafe = user_models.CafeGeneralSettings.objects.create(owner=owner, cafe_name='Order benchmark')
+        category = user_models.Category.objects.create(name='Order benchmark')
+        cafe = user_models.Cafe.objects.create(user=owner, category=category, cafe_name='Order benchmark',
+                                               description='', call_center='0', tax_rate=0)
+        modifier_category = modifier_models.ModifierCategory.objects.create(title='Order benchmark', owner=owner)
+        modifiers = [modifier_models.Modifier.objects.create(title='Modifier {}'.format(index), price=1,
+                                                             owner=owner, category=modifier_category)
+                     for index in range(options['modifiers'])]
+        user_models.FreeItem.objects.bulk_create([user_models.FreeItem(owner=customer, root_cafe=root_cafe)
+                                                  for index in range(options['free'] * 3)])
+        cart_items = []
+        for index in range(options['lines']):
+            product = product_models.Product.objects.create(title='Product {}'.format(index), description='',
+                                                            owner=owner, price=10, modifier=modifier_category)
+            product_models.CafeMeals.objects.create(cafe=cafe, product=product)
+            cart_items.append({'product': product.pk, 'count': 2, 'free_count': options['free'] if not index else 0,
+                               'modifiers': [modifier.pk for modifier in modifiers]})
+        return customer, cafe, cart_items
+
+    @staticmethod
+    def create_row_by_row(customer, cafe, cart_items):
+        # The order creation path as it was before the assembly service, kept for comparison
+        order = order_models.Order.objects.create(customer=customer, cafe=cafe)
+        for cart_item in cart_items:
+            paid_count = cart_item['count'] - cart_item['free_count']
+            for count, is_free in ((paid_count, False), (cart_item['free_count'], True)):
+                if not count:
+                    continue
+                cart = order_models.Cart(order=order, count=count, is_free=is_free, product_id=cart_item['product'])
+                cart.save()
+                for modifier_id in cart_item['modifiers']:
+                    order_models.CartModifier(product_id=cart_item['product'], order=order, modifier_id=modifier_id,
+                                              cart=cart, count=count).save()
+                if is_free:
+                    free_items = user_models.FreeItem.objects.filter(
+                        owner=customer, root_cafe=cafe.user.settings, status=user_models.FreeItem.VALID
+                    ).order_by('pk')[0:count]
+                    user_models.FreeItem.objects.select_for_update().filter(
+                        pk__in=free_items.values_list('pk', flat=True)
+                    ).update(product_id=cart_item['product'], status=user_models.FreeItem.REDEEMED)
+        order.save()
+        return order
+
+    def measure(self, name, create):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            with transaction.atomic():
+                create()
+            elapsed = time.perf_counter() - started
+        self.stdout.write('{}: {} queries, {:.2f} ms'.format(name, len(context.captured_queries), elapsed * 1000))
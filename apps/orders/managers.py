@@ -0,0 +1,20 @@
+from django.apps import apps
+from django.db import models
+from django.db.models import Prefetch
+
+
+class OrderQuerySet(models.QuerySet):
+
+    def with_feed_data(self):
+        """
+        Load everything OrderSerializer reads: customer, cafe with its owner's settings for the logo,
+        cart lines with their products, and cart modifiers with their modifier categories.
+        The number of queries does not depend on the number of orders.
+        """
+        cart_model = apps.get_model('orders', 'Cart')
+        cart_modifier_model = apps.get_model('orders', 'CartModifier')
+        return self.select_related('customer', 'cafe__user__settings').prefetch_related(
+            Prefetch('cart_items', queryset=cart_model.objects.select_related('product').prefetch_related(
+                Prefetch('modifiers', queryset=cart_modifier_model.objects.select_related('modifier__category'))
+            ))
+        )
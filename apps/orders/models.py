@@ -1,13 +1,15 @@
 import uuid
 from django.db import models
 from django.db.models import Sum
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext as _
 from django.conf import settings
 
-from apps.products.models import Product, Cafe
+from apps.products.models import Product, Size, CafeMeals, Cafe
 from project import modules as project_modules
 from apps.modifiers import models as modifier_models
+from . import pricing
+from .managers import OrderQuerySet
 
 
 class Order(models.Model):
@@ -32,6 +34,8 @@ class Order(models.Model):
     pre_order = models.BooleanField(default=False)
     pre_order_date = models.DateTimeField(null=True, blank=True)
 
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return "Order - {}".format(self.pk)
 
@@ -71,7 +75,9 @@ class Cart(models.Model):
     count = models.IntegerField()
     order = models.ForeignKey(Order, blank=True, null=True, related_name='cart_items')
     is_free = models.BooleanField(default=False)
-    price = models.FloatField(default=0)
+    size = models.ForeignKey(Size, null=True, blank=True, on_delete=models.SET_NULL, related_name='cart_items')
+    # Unit price of the product or size when the order was placed
+    price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
     class Meta:
         verbose_name = _('Cart item')
@@ -90,7 +96,8 @@ class CartModifier(models.Model):
     product = models.ForeignKey(Product, related_name='product_modifier')
     order = models.ForeignKey(Order, blank=True, null=True, related_name='cart_order_items')
     modifier = models.ForeignKey(modifier_models.Modifier, blank=True, null=True, related_name='cart_modifier_items')
-    price = models.FloatField(default=0)
+    # Unit price of the modifier when the order was placed
+    price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     count = models.IntegerField()
 
     class Meta:
@@ -117,7 +124,39 @@ def transaction_saver(sender, instance, **kwargs):
         customer = order.customer
         total_count = order.cart_items.filter(is_free=False).aggregate(Sum('count'))
         count__sum = int(total_count['count__sum'])
-        project_modules.point_free_item_calculation(cafe=cafe, client=customer, count=count__sum)
+        project_modules.point_free_item_calculation(cafe=cafe, client=customer, count=count__sum, order=order)
 
 
 post_save.connect(receiver=transaction_saver, sender=Transaction)
+
+
+def product_price_change_handler(sender, instance, **kwargs):
+    pricing.invalidate_menu_prices(instance.cafes.values_list('cafe_id', flat=True))
+
+
+def size_price_change_handler(sender, instance, **kwargs):
+    pricing.invalidate_menu_prices(CafeMeals.objects.filter(product_id=instance.product_id)
+                                   .values_list('cafe_id', flat=True))
+
+
+def modifier_price_change_handler(sender, instance, **kwargs):
+    pricing.invalidate_menu_prices(Cafe.objects.filter(user_id=instance.owner_id).values_list('pk', flat=True))
+
+
+def cafe_meal_change_handler(sender, instance, **kwargs):
+    pricing.invalidate_menu_prices([instance.cafe_id])
+
+
+def cafe_change_handler(sender, instance, **kwargs):
+    pricing.invalidate_menu_prices([instance.pk])
+
+
+# Product rows are deleted with their CafeMeals rows, so deleting a product is covered by cafe_meal_change_handler
+post_save.connect(receiver=product_price_change_handler, sender=Product)
+post_save.connect(receiver=size_price_change_handler, sender=Size)
+post_delete.connect(receiver=size_price_change_handler, sender=Size)
+post_save.connect(receiver=modifier_price_change_handler, sender=modifier_models.Modifier)
+post_delete.connect(receiver=modifier_price_change_handler, sender=modifier_models.Modifier)
+post_save.connect(receiver=cafe_meal_change_handler, sender=CafeMeals)
+post_delete.connect(receiver=cafe_meal_change_handler, sender=CafeMeals)
+post_save.connect(receiver=cafe_change_handler, sender=Cafe)
@@ -0,0 +1,99 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.modifiers import models as modifier_models
+from apps.products import models as product_models
+
+CENT = Decimal('0.01')
+MENU_PRICES_CACHE_KEY = 'menu_prices:{}'
+MENU_PRICES_CACHE_TIMEOUT = 60 * 60
+
+
+class PricingError(Exception):
+    pass
+
+
+def get_menu_prices_cache_key(cafe_id):
+    return MENU_PRICES_CACHE_KEY.format(cafe_id)
+
+
+def load_menu_prices(cafe):
+    """
+    Read the prices of everything that can be ordered in a cafe, with one query per table.
+    """
+    products = dict(product_models.Product.objects.filter(cafes__cafe_id=cafe.pk, available=True)
+                    .values_list('pk', 'price').distinct())
+    size_rows = product_models.Size.objects.filter(product_id__in=list(products), available=True).values_list(
+        'pk', 'product_id', 'price')
+    sizes = {size_id: (product_id, price) for size_id, product_id, price in size_rows}
+    modifiers = dict(modifier_models.Modifier.objects.filter(owner_id=cafe.user_id, available=True)
+                     .values_list('pk', 'price'))
+    return {'products': products, 'sizes': sizes, 'modifiers': modifiers}
+
+
+def get_menu_prices(cafe):
+    key = get_menu_prices_cache_key(cafe.pk)
+    menu_prices = cache.get(key)
+    if menu_prices is None:
+        menu_prices = load_menu_prices(cafe)
+        cache.set(key, menu_prices, MENU_PRICES_CACHE_TIMEOUT)
+    return menu_prices
+
+
+def invalidate_menu_prices(cafe_ids):
+    # After commit, otherwise a checkout running meanwhile could cache the prices from before the change again
+    keys = [get_menu_prices_cache_key(cafe_id) for cafe_id in cafe_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def round_price(value):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_unit_prices(menu_prices, line):
+    """
+    Returns (product or size price, [modifier price per modifier_id]) for a cart line, or raises PricingError
+    if any part of it is not on the cafe's menu.
+    """
+    if line.product_id not in menu_prices['products']:
+        raise PricingError('Product {} is not available in this cafe'.format(line.product_id))
+    unit_price = menu_prices['products'][line.product_id]
+    if line.size_id is not None:
+        size_product_id, unit_price = menu_prices['sizes'].get(line.size_id, (None, None))
+        if size_product_id != line.product_id:
+            raise PricingError('Size {} is not available for product {}'.format(line.size_id, line.product_id))
+
+    modifier_prices = []
+    for modifier_id in line.modifier_ids:
+        if modifier_id not in menu_prices['modifiers']:
+            raise PricingError('Modifier {} is not available in this cafe'.format(modifier_id))
+        modifier_prices.append(menu_prices['modifiers'][modifier_id])
+    return unit_price, modifier_prices
+
+
+def price_order(cafe, lines):
+    """
+    Price cart lines against the cafe's menu. Free items cover the product or size price only,
+    modifiers on free lines are charged as usual.
+
+    Returns ([(unit price, modifier prices) per line], totals dict with
+    sub_total_price, tax_total and total_price as Decimal).
+    """
+    menu_prices = get_menu_prices(cafe)
+    line_prices = []
+    sub_total_price = Decimal('0')
+    for line in lines:
+        unit_price, modifier_prices = get_unit_prices(menu_prices, line)
+        line_prices.append((unit_price, modifier_prices))
+        sub_total_price += unit_price * line.paid_count
+        sub_total_price += sum(modifier_prices, Decimal('0')) * (line.paid_count + line.free_count)
+
+    sub_total_price = round_price(sub_total_price)
+    tax_total = round_price(sub_total_price * Decimal(cafe.tax_rate) / 100)
+    return line_prices, {
+        'sub_total_price': sub_total_price,
+        'tax_total': tax_total,
+        'total_price': sub_total_price + tax_total,
+    }
@@ -1,3 +1,161 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.users import models as user_models
+from apps.products import models as product_models
+from apps.modifiers import models as modifier_models
+from apps.orders import models as order_models
+from apps.orders import assembly
+from apps.orders import pricing
+from apps.orders.assembly import CartLine
+
+
+class MenuFixtureMixin(object):
+
+    def create_menu(self):
+        cache.clear()
+        self.owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                          user_type=user_models.User.OWNER)
+        self.root_cafe = user_models.CafeGeneralSettings.objects.create(owner=self.owner, cafe_name='Owner settings')
+        category = user_models.Category.objects.create(name='Coffee')
+        self.cafe = user_models.Cafe.objects.create(user=self.owner, cafe_name='Cafe', category=category,
+                                                    description='', call_center='1',
+                                                    status=user_models.Cafe.ACTIVE, tax_rate=Decimal('12.5'))
+        modifier_category = modifier_models.ModifierCategory.objects.create(title='Milk', owner=self.owner)
+        self.modifier = modifier_models.Modifier.objects.create(title='Oat milk', price=Decimal('0.45'),
+                                                                owner=self.owner, category=modifier_category)
+        self.product = product_models.Product.objects.create(title='Latte', description='', owner=self.owner,
+                                                             price=Decimal('3.00'), modifier=modifier_category)
+        self.size = product_models.Size.objects.create(title='Large', price=Decimal('3.80'), product=self.product)
+        product_models.CafeMeals.objects.create(cafe=self.cafe, product=self.product)
+
+
+class PricingTest(MenuFixtureMixin, TestCase):
+
+    def setUp(self):
+        self.create_menu()
+
+    def test_prices_sizes_modifiers_and_tax(self):
+        lines = [CartLine(self.product.pk, None, 2, 0, []),
+                 CartLine(self.product.pk, self.size.pk, 1, 0, [self.modifier.pk])]
+        line_prices, totals = pricing.price_order(self.cafe, lines)
+        self.assertEqual(line_prices, [(Decimal('3.00'), []), (Decimal('3.80'), [Decimal('0.45')])])
+        # 6.00 + 3.80 + 0.45 = 10.25, and 12.5% of it is 1.28125
+        self.assertEqual(totals, {'sub_total_price': Decimal('10.25'), 'tax_total': Decimal('1.28'),
+                                  'total_price': Decimal('11.53')})
+
+    def test_free_items_only_pay_for_modifiers(self):
+        lines = [CartLine(self.product.pk, None, 1, 2, [self.modifier.pk])]
+        line_prices, totals = pricing.price_order(self.cafe, lines)
+        self.assertEqual(totals['sub_total_price'], Decimal('3.00') + 3 * Decimal('0.45'))
+
+    def test_items_off_the_menu_are_rejected(self):
+        other_product = product_models.Product.objects.create(title='Tea', description='', owner=self.owner,
+                                                              price=Decimal('2.00'), modifier=self.product.modifier)
+        other_size = product_models.Size.objects.create(title='Small', price=Decimal('1.50'), product=other_product)
+        for line in (CartLine(other_product.pk, None, 1, 0, []),
+                     CartLine(self.product.pk, other_size.pk, 1, 0, []),
+                     CartLine(self.product.pk, None, 1, 0, [self.modifier.pk + 100])):
+            with self.assertRaises(pricing.PricingError):
+                pricing.price_order(self.cafe, [line])
+
+    def test_menu_prices_are_read_once(self):
+        lines = [CartLine(self.product.pk, self.size.pk, 1, 0, [self.modifier.pk])]
+        pricing.price_order(self.cafe, lines)
+        with self.assertNumQueries(0):
+            pricing.price_order(self.cafe, lines)
+
+
+class PricingInvalidationTest(MenuFixtureMixin, TransactionTestCase):
+
+    def setUp(self):
+        self.create_menu()
+
+    def test_price_changes_apply_after_commit(self):
+        lines = [CartLine(self.product.pk, None, 1, 0, [])]
+        pricing.price_order(self.cafe, lines)
+        self.product.price = Decimal('3.50')
+        self.product.save()
+        line_prices, totals = pricing.price_order(self.cafe, lines)
+        self.assertEqual(line_prices, [(Decimal('3.50'), [])])
+
+
+class OrderAssemblyTest(MenuFixtureMixin, TestCase):
+
+    def setUp(self):
+        self.create_menu()
+        self.customer = user_models.User.objects.create_user(phone='100000002', password='secret')
+
+    def create_free_items(self, count, **fields):
+        return [user_models.FreeItem.objects.create(owner=self.customer, root_cafe=self.root_cafe, **fields)
+                for _ in range(count)]
+
+    def assertNothingWritten(self):
+        self.assertFalse(order_models.Order.objects.exists())
+        self.assertFalse(order_models.Cart.objects.exists())
+        self.assertFalse(order_models.CartModifier.objects.exists())
+
+    def test_carts_and_modifiers_are_created_with_price_snapshots(self):
+        self.create_free_items(1)
+        order = assembly.create_order(self.customer, [
+            {'product': self.product.pk, 'count': 2, 'free_count': 1, 'modifiers': [self.modifier.pk]},
+            {'product': self.product.pk, 'size': self.size.pk, 'count': 1},
+        ], cafe=self.cafe)
+
+        carts = list(order.cart_items.order_by('pk').values_list('product_id', 'size_id', 'count', 'is_free', 'price'))
+        self.assertEqual(carts, [(self.product.pk, None, 1, False, Decimal('3.00')),
+                                 (self.product.pk, None, 1, True, Decimal('0.00')),
+                                 (self.product.pk, self.size.pk, 1, False, Decimal('3.80'))])
+        # Free rows keep their modifiers, which are charged as usual
+        modifiers = list(order_models.CartModifier.objects.filter(order=order).order_by('cart_id').values_list(
+            'cart__is_free', 'modifier_id', 'price', 'count'))
+        self.assertEqual(modifiers, [(False, self.modifier.pk, Decimal('0.45'), 1),
+                                     (True, self.modifier.pk, Decimal('0.45'), 1)])
+        self.assertEqual(order.sub_total_price, Decimal('3.00') + Decimal('3.80') + 2 * Decimal('0.45'))
+        self.assertEqual(user_models.FreeItem.objects.get().status, user_models.FreeItem.REDEEMED)
+
+    def test_rows_are_bulk_created(self):
+        pricing.get_menu_prices(self.cafe)
+        query_counts = []
+        for lines in (1, 10):
+            items = [{'product': self.product.pk, 'count': 1, 'modifiers': [self.modifier.pk]}] * lines
+            with CaptureQueriesContext(connection) as context:
+                assembly.create_order(self.customer, items, cafe=self.cafe)
+            query_counts.append(len(context.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(order_models.CartModifier.objects.count(), 11)
+
+    def test_invalid_line_writes_nothing(self):
+        with self.assertRaises(assembly.OrderAssemblyError):
+            assembly.create_order(self.customer, [{'product': self.product.pk, 'count': 1},
+                                                  {'product': self.product.pk, 'count': 'two'}], cafe=self.cafe)
+        with self.assertRaises(pricing.PricingError):
+            assembly.create_order(self.customer, [{'product': self.product.pk, 'count': 1},
+                                                  {'product': self.product.pk + 100, 'count': 1}], cafe=self.cafe)
+        self.assertNothingWritten()
+
+    def test_free_item_shortfall_rolls_back_the_order(self):
+        self.create_free_items(1)
+        with self.assertRaises(assembly.OrderAssemblyError):
+            assembly.create_order(self.customer, [{'product': self.product.pk, 'count': 2, 'free_count': 2,
+                                                   'modifiers': [self.modifier.pk]}], cafe=self.cafe)
+        self.assertNothingWritten()
+        self.assertEqual(user_models.FreeItem.objects.get().status, user_models.FreeItem.VALID)
+
+    def test_redeemed_and_overdue_items_are_not_counted(self):
+        # One item was taken by a concurrent order, the other is past its expire time but not expired yet
+        self.create_free_items(1, status=user_models.FreeItem.REDEEMED)
+        self.create_free_items(1, expire_time=timezone.now() - timezone.timedelta(minutes=1))
+        valid = self.create_free_items(1)[0]
+        with self.assertRaises(assembly.OrderAssemblyError):
+            with transaction.atomic():
+                assembly.redeem_free_items(self.customer, self.cafe, self.product.pk, 2)
+
+        assembly.redeem_free_items(self.customer, self.cafe, self.product.pk, 1)
+        valid.refresh_from_db()
+        self.assertEqual((valid.status, valid.product_id), (user_models.FreeItem.REDEEMED, self.product.pk))
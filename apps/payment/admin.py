@@ -17,5 +17,25 @@ class PaypalTransactionAdmin(admin.ModelAdmin):
         return obj.order.customer.get_full_name()
 
 
+class StripeCardInline(admin.TabularInline):
+    model = payment_models.StripeCard
+    extra = 0
+    readonly_fields = ['card_id', 'brand', 'last4', 'fingerprint', 'created_at']
+
+
+class StripeCustomerAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'customer_id', 'created_at']
+    search_fields = ['user__phone', 'customer_id']
+    inlines = [StripeCardInline]
+
+
+class PaymentIntentAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order', 'payer', 'gateway', 'amount', 'status', 'created_at', 'updated_at']
+    list_filter = ['gateway', 'status', 'created_at', ]
+    search_fields = ['idempotency_key', 'charge_id', 'payer__phone']
+
+
 admin.site.register(payment_models.StripeTransaction, StripeTransactionAdmin)
 admin.site.register(payment_models.PaypalTransaction, PaypalTransactionAdmin)
+admin.site.register(payment_models.StripeCustomer, StripeCustomerAdmin)
+admin.site.register(payment_models.PaymentIntent, PaymentIntentAdmin)
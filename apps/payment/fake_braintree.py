@@ -0,0 +1,63 @@
+"""
+An in-memory stand-in for BraintreeGateway, used with gateways.override_braintree_gateway in tests
+and benchmarks. It implements the calls the PayPal path makes and records them in `calls`.
+"""
+import itertools
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+import braintree
+
+
+class StubClientTokenGateway(object):
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def generate(self, params=None):
+        self.gateway.record('client_token.generate')
+        return 'client-token-{}'.format(next(self.gateway.ids))
+
+
+class StubTransactionGateway(object):
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.sales = []
+
+    def sale(self, params):
+        self.gateway.record('transaction.sale')
+        if params.get('payment_method_nonce') == self.gateway.declined_nonce:
+            declined = SimpleNamespace(processor_response_code='2000', processor_response_text='Do Not Honor')
+            return SimpleNamespace(is_success=False, transaction=declined, errors=None)
+        sale = SimpleNamespace(
+            id='sale{}'.format(next(self.gateway.ids)),
+            amount=Decimal(params['amount']),
+            order_id=params.get('order_id'),
+            status=braintree.Transaction.Status.SubmittedForSettlement,
+            credit_card_details=SimpleNamespace(card_type='Visa'),
+        )
+        self.sales.append(sale)
+        return SimpleNamespace(is_success=True, transaction=sale, errors=None)
+
+    def search(self, *queries):
+        # Only order_id equality is supported, which is all the payment task asks for
+        self.gateway.record('transaction.search')
+        order_ids = {query.to_param()['is'] for query in queries if query.name == 'order_id'}
+        return SimpleNamespace(items=[sale for sale in self.sales if sale.order_id in order_ids])
+
+
+class StubBraintreeGateway(object):
+    declined_nonce = 'fake-processor-declined-visa-nonce'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.ids = itertools.count(1)
+        self.client_token = StubClientTokenGateway(self)
+        self.transaction = StubTransactionGateway(self)
+
+    def record(self, call):
+        time.sleep(self.latency)
+        self.calls.append(call)
@@ -0,0 +1,161 @@
+"""
+A local stand-in for the Stripe API, used to measure the payment path offline.
+
+    with fake_stripe_server(latency=0.2) as server:
+        ...  # stripe.* calls now go to the local server
+        print(len(server.requests))
+
+Only the endpoints the payment views use are implemented. Every request sleeps `latency`
+seconds to simulate the round trip to Stripe.
+"""
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+import stripe
+
+
+class FakeStripeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.requests = []
+        self.objects = {}
+        # Responses by Idempotency-Key header, replayed like Stripe does for a repeated request
+        self.idempotent_responses = {}
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def next_id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return '{}_fake{}'.format(prefix, self.counter)
+
+    def make_card(self, token_id, customer_id=None):
+        card = {
+            'id': self.next_id('card'),
+            'object': 'card',
+            'brand': 'Visa',
+            'last4': '4242',
+            'fingerprint': 'fp_{}'.format(token_id),
+            'customer': customer_id,
+        }
+        self.objects[card['id']] = card
+        return card
+
+    def handle(self, method, path, params):
+        match = re.match(r'^/v1/tokens/([^/]+)$', path)
+        if method == 'GET' and match:
+            return 200, {'id': match.group(1), 'object': 'token', 'card': self.make_card(match.group(1))}
+
+        if method == 'POST' and path == '/v1/customers':
+            customer_id = self.next_id('cus')
+            cards = [self.make_card(params['source'], customer_id)] if params.get('source') else []
+            customer = {
+                'id': customer_id,
+                'object': 'customer',
+                'default_source': cards[0]['id'] if cards else None,
+                'metadata': {},
+                'sources': {'object': 'list', 'data': cards, 'url': '/v1/customers/{}/sources'.format(customer_id)},
+            }
+            self.objects[customer_id] = customer
+            return 200, customer
+
+        match = re.match(r'^/v1/customers/([^/]+)$', path)
+        if match and match.group(1) in self.objects:
+            if method == 'DELETE':
+                self.objects.pop(match.group(1))
+                return 200, {'id': match.group(1), 'object': 'customer', 'deleted': True}
+            return 200, self.objects[match.group(1)]
+
+        match = re.match(r'^/v1/customers/([^/]+)/sources$', path)
+        if method == 'POST' and match and match.group(1) in self.objects:
+            card = self.make_card(params.get('source'), match.group(1))
+            self.objects[match.group(1)]['sources']['data'].append(card)
+            return 200, card
+
+        if method == 'POST' and path == '/v1/charges':
+            charge = {
+                'id': self.next_id('ch'),
+                'object': 'charge',
+                'amount': int(params.get('amount', 0)),
+                'currency': params.get('currency'),
+                'customer': params.get('customer'),
+                'source': self.objects.get(params.get('source'), {'id': params.get('source')}),
+                'paid': True,
+                'status': 'succeeded',
+            }
+            self.objects[charge['id']] = charge
+            return 200, charge
+
+        if method == 'POST' and path == '/v1/refunds':
+            refund = {'id': self.next_id('re'), 'object': 'refund', 'charge': params.get('charge'),
+                      'amount': int(params['amount']) if params.get('amount') else None, 'status': 'succeeded'}
+            self.objects[refund['id']] = refund
+            return 200, refund
+
+        match = re.match(r'^/v1/refunds/([^/]+)$', path)
+        if method == 'GET' and match and match.group(1) in self.objects:
+            return 200, self.objects[match.group(1)]
+
+        return 404, {'error': {'type': 'invalid_request_error',
+                               'message': 'No such resource: {} {}'.format(method, path)}}
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+
+    def respond(self, method):
+        path, _, query = self.path.partition('?')
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        params = {key: values[-1] for key, values in parse_qs(body or query).items()}
+        self.server.requests.append((method, path))
+        time.sleep(self.server.latency)
+
+        idempotency_key = self.headers.get('Idempotency-Key')
+        if method == 'POST' and idempotency_key in self.server.idempotent_responses:
+            status, payload = self.server.idempotent_responses[idempotency_key]
+        else:
+            status, payload = self.server.handle(method, path, params)
+            if method == 'POST' and idempotency_key:
+                self.server.idempotent_responses[idempotency_key] = (status, payload)
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_DELETE(self):
+        self.respond('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def fake_stripe_server(latency=0.0):
+    server = FakeStripeServer(('127.0.0.1', 0), latency=latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    previous_api_base = stripe.api_base
+    stripe.api_base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        yield server
+    finally:
+        stripe.api_base = previous_api_base
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,108 @@
+"""
+Process-wide Braintree gateway.
+
+BraintreeGateway and Configuration are built once per process and share a pooled requests session,
+so checkout requests reuse TLS connections instead of opening a new one for every API call.
+"""
+import threading
+from contextlib import contextmanager
+
+import braintree
+import requests
+from braintree.environment import Environment
+from braintree.util.http import Http
+from django.conf import settings
+from django.core.cache import cache
+
+CLIENT_TOKEN_CACHE_KEY = 'braintree_client_token'
+# Client tokens stay valid for 24 hours; a short TTL keeps them fresh without generating one per screen
+CLIENT_TOKEN_CACHE_TIMEOUT = getattr(settings, 'BRAINTREE_CLIENT_TOKEN_CACHE_TIMEOUT', 60 * 10)
+HTTP_POOL_SIZE = 20
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+class PooledHttp(Http):
+    """
+    Braintree HTTP strategy that sends every request through one shared requests.Session.
+    """
+    session = None
+    session_lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls):
+        with cls.session_lock:
+            if cls.session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                cls.session = session
+        return cls.session
+
+    def http_do(self, http_verb, path, headers, request_body):
+        data = request_body
+        files = None
+        if type(request_body) is tuple:
+            data, files = request_body
+
+        if self.config.environment == Environment.Development:
+            verify = False
+        else:
+            verify = self.environment.ssl_certificate
+
+        if not (path.startswith(self.config.base_url()) or path.startswith(self.config.graphql_base_url())):
+            path = self.config.base_url() + path
+        response = self.get_session().request(http_verb, path, headers=headers, data=data, files=files,
+                                              verify=verify, timeout=self.config.timeout)
+        return [response.status_code, response.text]
+
+
+def build_braintree_gateway():
+    environment = getattr(settings, 'PAYPAL_ENVIRONMENT', 'sandbox')
+    return braintree.BraintreeGateway(
+        braintree.Configuration(
+            Environment.parse_environment(environment),
+            merchant_id=settings.PAYPAL_MERCHANT_ID,
+            public_key=settings.PAYPAL_PUBLIC_KEY,
+            private_key=settings.PAYPAL_PRIVATE_KEY,
+            http_strategy=PooledHttp,
+            wrap_http_exceptions=True,
+        )
+    )
+
+
+def get_braintree_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = build_braintree_gateway()
+    return _gateway
+
+
+@contextmanager
+def override_braintree_gateway(gateway):
+    """
+    Make get_braintree_gateway() return `gateway`, e.g. a StubBraintreeGateway in tests.
+    """
+    global _gateway
+    previous = _gateway
+    _gateway = gateway
+    try:
+        yield gateway
+    finally:
+        _gateway = previous
+
+
+def get_client_token():
+    """
+    Client token not bound to a Braintree customer; users have no Braintree customer of their own,
+    so vaulted payment methods are never exposed through it.
+    """
+    client_token = cache.get(CLIENT_TOKEN_CACHE_KEY)
+    if client_token is None:
+        client_token = get_braintree_gateway().client_token.generate()
+        cache.set(CLIENT_TOKEN_CACHE_KEY, client_token, CLIENT_TOKEN_CACHE_TIMEOUT)
+    return client_token
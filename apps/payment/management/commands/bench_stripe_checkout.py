@@ -0,0 +1,60 @@
+import time
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.users import models as user_models
+from apps.payment import vault as payment_vault
+from apps.payment.fake_stripe import fake_stripe_server
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure Stripe round trips and latency of the checkout path against a local fake Stripe server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.15, help='Seconds per simulated Stripe request')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), fake_stripe_server(latency=options['latency']) as server:
+                self.run_benchmark(server, options)
+                raise Rollback()
+        except Rollback:
+            self.stdout.write('Synthetic rows rolled back')
+
+    def run_benchmark(self, server, options):
+        def legacy_checkout(user):
+            # Token lookup, a new customer and the charge, as the payment views did before the vault
+            stripe.Token.retrieve(id='tok_visa', api_key=settings.STRIPE_API_KEY)
+            customer = stripe.Customer.create(source='tok_visa', api_key=settings.STRIPE_API_KEY)
+            stripe.Charge.create(amount=1000, currency='usd', customer=customer.id, api_key=settings.STRIPE_API_KEY)
+
+        def first_checkout(user):
+            payment_vault.charge(user, 1000, token_id='tok_visa')
+
+        def repeat_checkout(user):
+            card_id = next(iter(payment_vault.get_profile(user)['cards']))
+            payment_vault.charge(user, 1000, card_id=card_id)
+
+        users = [user_models.User.objects.create_user(phone='bench{:06d}'.format(index), password=None)
+                 for index in range(options['runs'])]
+        for name, checkout in (('per-request customer', legacy_checkout),
+                               ('vault, first checkout', first_checkout),
+                               ('vault, repeat checkout', repeat_checkout)):
+            requests_before = len(server.requests)
+            started = time.perf_counter()
+            for user in users:
+                checkout(user)
+            elapsed = (time.perf_counter() - started) / len(users)
+            self.stdout.write('{}: {:.1f} Stripe requests, {:.0f} ms per checkout'.format(
+                name, (len(server.requests) - requests_before) / len(users), elapsed * 1000))
+        # The profiles are rolled back with the users, so their cache entries must go too
+        cache.delete_many([payment_vault.get_profile_cache_key(user.pk) for user in users])
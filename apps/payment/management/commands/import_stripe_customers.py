@@ -0,0 +1,59 @@
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.payment import models as payment_models
+from apps.payment import vault as payment_vault
+
+
+class Command(BaseCommand):
+    help = ('Link the Stripe customers recorded on past charges to their payers, so their saved cards can be '
+            'charged. A customer charged for more than one payer is left out.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the customers that would be linked.')
+
+    def handle(self, *args, **options):
+        # The latest customer of each payer, and every payer of each customer
+        customer_by_payer = {}
+        payers_by_customer = {}
+        charges = payment_models.StripeTransaction.objects.exclude(customer_id__isnull=True).exclude(
+            customer_id='').order_by('-pk').values_list('payer_id', 'customer_id')
+        for payer_id, customer_id in charges.iterator():
+            customer_by_payer.setdefault(payer_id, customer_id)
+            payers_by_customer.setdefault(customer_id, set()).add(payer_id)
+
+        linked_users = set(payment_models.StripeCustomer.objects.values_list('user_id', flat=True))
+        linked_customers = set(payment_models.StripeCustomer.objects.values_list('customer_id', flat=True))
+        linked = skipped = 0
+        for payer_id, customer_id in sorted(customer_by_payer.items()):
+            if payer_id in linked_users or customer_id in linked_customers:
+                continue
+            if len(payers_by_customer[customer_id]) > 1:
+                self.stderr.write('Skipped {}: charged for payers {}'.format(
+                    customer_id, ', '.join(str(pk) for pk in sorted(payers_by_customer[customer_id]))))
+                skipped += 1
+                continue
+            if options['dry_run']:
+                self.stdout.write('Would link {} to user {}'.format(customer_id, payer_id))
+                linked += 1
+                continue
+            try:
+                stripe_customer = stripe.Customer.retrieve(customer_id, api_key=settings.STRIPE_API_KEY)
+            except stripe.error.InvalidRequestError as e:
+                self.stderr.write('Skipped {}: {}'.format(customer_id, e))
+                skipped += 1
+                continue
+            if getattr(stripe_customer, 'deleted', False):
+                skipped += 1
+                continue
+            with transaction.atomic():
+                customer = payment_models.StripeCustomer.objects.create(user_id=payer_id, customer_id=customer_id)
+                for card in stripe_customer.sources.data:
+                    if card.object == 'card':
+                        payment_vault.save_card(customer, card)
+            cache.delete(payment_vault.get_profile_cache_key(payer_id))
+            linked += 1
+        self.stdout.write(self.style.SUCCESS('Linked {} customers, skipped {}'.format(linked, skipped)))
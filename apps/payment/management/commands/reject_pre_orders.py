@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.orders import models as order_models
+from apps.payment import tasks as payment_tasks
+
+ORDERS_PER_TASK = 20
+
+
+class Command(BaseCommand):
+    help = "Reject a cafe's pre-orders for one day and refund their Stripe charges on the payments queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('cafe_id', type=int)
+        parser.add_argument('date', help='Pre-order day, YYYY-MM-DD.')
+        parser.add_argument('--per-task', type=int, default=ORDERS_PER_TASK,
+                            help='Orders refunded by one task; tasks run in parallel on the payment workers.')
+
+    def handle(self, *args, **options):
+        try:
+            day = datetime.datetime.strptime(options['date'], '%Y-%m-%d')
+        except ValueError:
+            raise CommandError('Date must be YYYY-MM-DD')
+        start = timezone.make_aware(day)
+        order_ids = list(order_models.Order.objects.filter(
+            cafe_id=options['cafe_id'], pre_order=True,
+            pre_order_date__gte=start, pre_order_date__lt=start + datetime.timedelta(days=1),
+        ).exclude(state=order_models.Order.REJECT).order_by('pk').values_list('pk', flat=True))
+
+        per_task = max(options['per_task'], 1)
+        for i in range(0, len(order_ids), per_task):
+            payment_tasks.reject_orders.delay(order_ids[i:i + per_task])
+        self.stdout.write(self.style.SUCCESS('Queued {} orders in {} tasks'.format(
+            len(order_ids), (len(order_ids) + per_task - 1) // per_task)))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0024_cart_price_snapshots'),
+        ('payment', '0007_stripecustomer_stripecard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIntent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=254, unique=True)),
+                ('gateway', models.CharField(choices=[('stripe', 'Stripe'), ('braintree', 'Braintree')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('amount', models.PositiveIntegerField(help_text='Amount in cents')),
+                ('card_id', models.CharField(blank=True, max_length=254, null=True)),
+                ('token', models.CharField(blank=True, max_length=254, null=True)),
+                ('payment_type', models.CharField(blank=True, max_length=254, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('charge_id', models.CharField(blank=True, max_length=254, null=True)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_intents', to='orders.Order')),
+                ('payer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_intents', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0008_paymentintent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripetransaction',
+            name='refund_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stripetransaction',
+            name='refund_id',
+            field=models.CharField(blank=True, max_length=254, null=True),
+        ),
+        migrations.AddField(
+            model_name='stripetransaction',
+            name='refund_status',
+            field=models.CharField(blank=True, max_length=60, null=True),
+        ),
+    ]
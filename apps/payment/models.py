@@ -18,6 +18,10 @@ class StripeTransaction(models.Model):
     payment_type = models.CharField(max_length=254)
     payment_time = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=60, null=True, default='in_process')
+    # Refund progress, kept per charge so an interrupted rejection can resume where it stopped
+    refund_id = models.CharField(max_length=254, null=True, blank=True)
+    refund_status = models.CharField(max_length=60, null=True, blank=True)
+    refund_error = models.TextField(null=True, blank=True)
 
 
 def stripe_saver(sender, instance, **kwargs):
@@ -39,3 +43,63 @@ class PaypalTransaction(models.Model):
     order = models.ForeignKey('orders.Order')
     payment_type = models.CharField(max_length=254)
     payment_time = models.DateTimeField(auto_now_add=True)
+
+
+class StripeCustomer(models.Model):
+    user = models.OneToOneField('users.User', related_name='stripe_customer')
+    customer_id = models.CharField(max_length=254, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.customer_id
+
+
+class StripeCard(models.Model):
+    customer = models.ForeignKey(StripeCustomer, related_name='cards', on_delete=models.CASCADE)
+    card_id = models.CharField(max_length=254, unique=True)
+    brand = models.CharField(max_length=60, null=True, blank=True)
+    last4 = models.CharField(max_length=4, null=True, blank=True)
+    fingerprint = models.CharField(max_length=254, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{} {}".format(self.brand, self.last4)
+
+
+class PaymentIntent(models.Model):
+    STRIPE = 'stripe'
+    BRAINTREE = 'braintree'
+    GATEWAY_CHOICES = (
+        (STRIPE, 'Stripe'),
+        (BRAINTREE, 'Braintree'),
+    )
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+    ACTIVE_STATUSES = (PENDING, PROCESSING, SUCCEEDED)
+
+    order = models.ForeignKey('orders.Order', related_name='payment_intents')
+    payer = models.ForeignKey('users.User', related_name='payment_intents')
+    idempotency_key = models.CharField(max_length=254, unique=True)
+    gateway = models.CharField(choices=GATEWAY_CHOICES, max_length=20)
+    status = models.CharField(choices=STATUS_CHOICES, default=PENDING, max_length=20, db_index=True)
+    amount = models.PositiveIntegerField(help_text='Amount in cents')
+    # Stripe card or token, or Braintree payment method nonce
+    card_id = models.CharField(max_length=254, null=True, blank=True)
+    token = models.CharField(max_length=254, null=True, blank=True)
+    payment_type = models.CharField(max_length=254, null=True, blank=True)
+    description = models.TextField(null=True, blank=True)
+    charge_id = models.CharField(max_length=254, null=True, blank=True)
+    error_message = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{} payment for order {} - {}".format(self.gateway, self.order_id, self.status)
@@ -0,0 +1,240 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+
+import braintree
+import stripe
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.orders import models as order_models
+from apps.orders import events as order_events
+from apps.payment import models as payment_models
+from apps.payment import vault as payment_vault
+from apps.payment import gateways as payment_gateways
+
+# Errors after which the same request may succeed; everything else fails the payment
+TRANSIENT_STRIPE_ERRORS = (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError)
+TRANSIENT_BRAINTREE_ERRORS = (braintree.exceptions.UnexpectedError, braintree.exceptions.ServerError,
+                              braintree.exceptions.TooManyRequestsError,
+                              braintree.exceptions.DownForMaintenanceError)
+BRAINTREE_PAID_STATUSES = (braintree.Transaction.Status.Authorized, braintree.Transaction.Status.Settling,
+                           braintree.Transaction.Status.SettlementPending, braintree.Transaction.Status.Settled,
+                           braintree.Transaction.Status.SubmittedForSettlement)
+# A pending refund has been accepted by Stripe and must not be sent again
+REFUND_ISSUED_STATUSES = ('succeeded', 'pending')
+REFUND_WORKERS = getattr(settings, 'STRIPE_REFUND_WORKERS', 8)
+# A capture still processing after this many seconds has lost its worker and may be claimed again. The rerun
+# sends the same idempotency key, so Stripe returns the charge it already made instead of charging twice.
+PAYMENT_CLAIM_TIMEOUT = getattr(settings, 'PAYMENT_CLAIM_TIMEOUT', 60 * 5)
+# Stripe keeps idempotency keys for 24 hours; older stale intents are left for a manual check
+PAYMENT_RECLAIM_WINDOW = datetime.timedelta(hours=23)
+
+
+class PaymentDeclined(Exception):
+    pass
+
+
+def set_status(intent_id, status, **fields):
+    return payment_models.PaymentIntent.objects.filter(pk=intent_id).update(status=status, updated_at=timezone.now(),
+                                                                            **fields)
+
+
+def finish_payment(intent, charge_id):
+    # Runs in the same transaction as the payment rows, so a paid order never has an unfinished intent
+    set_status(intent.pk, payment_models.PaymentIntent.SUCCEEDED, charge_id=charge_id, error_message=None)
+    order = intent.order
+    order.state = order_models.Order.READY
+    order.save(update_fields=['state'])
+    transaction.on_commit(lambda: order_events.publish_order_event(order, order_events.STATE_CHANGED))
+
+
+def capture_stripe(intent):
+    try:
+        if not intent.card_id:
+            # Keep the saved card on the intent, a retry must charge it instead of adding the token again
+            intent.card_id = payment_vault.add_card(intent.payer, intent.token,
+                                                    idempotency_key='{}-card'.format(intent.idempotency_key))
+            intent.save(update_fields=['card_id', 'updated_at'])
+        charge, card_id = payment_vault.charge(intent.payer, intent.amount, card_id=intent.card_id,
+                                               idempotency_key=intent.idempotency_key)
+    except payment_vault.VaultError as e:
+        raise PaymentDeclined(str(e))
+    except TRANSIENT_STRIPE_ERRORS:
+        raise
+    except stripe.error.StripeError as e:
+        raise PaymentDeclined(e.user_message or str(e))
+
+    with transaction.atomic():
+        # The StripeTransaction post_save handler records the order Transaction and the points
+        payment_models.StripeTransaction.objects.create(
+            payer=intent.payer, token=intent.token, customer_id=charge.customer, card_id=card_id,
+            amount=intent.amount, payment_id=charge.id, description=intent.description or '-empty-',
+            order=intent.order, payment_type=intent.payment_type or '-empty-', status='paid')
+        finish_payment(intent, charge.id)
+
+
+def capture_braintree(intent):
+    gateway = payment_gateways.get_braintree_gateway()
+    # Braintree has no idempotency keys; the intent key is sent as order_id and looked up before a retry
+    previous = [sale for sale in gateway.transaction.search(
+        braintree.TransactionSearch.order_id == intent.idempotency_key).items
+        if sale.status in BRAINTREE_PAID_STATUSES]
+    if previous:
+        sale = previous[0]
+    else:
+        result = gateway.transaction.sale({
+            "amount": Decimal(intent.amount) / 100,
+            "payment_method_nonce": intent.token,
+            "order_id": intent.idempotency_key,
+            "options": {
+                "submit_for_settlement": True
+            }
+        })
+        if not result.is_success:
+            if result.transaction:
+                raise PaymentDeclined(result.transaction.processor_response_text)
+            raise PaymentDeclined(result.errors.deep_errors[0].message)
+        sale = result.transaction
+
+    payment_type = sale.credit_card_details.card_type if sale.credit_card_details else 'Paypal'
+    with transaction.atomic():
+        payment_models.PaypalTransaction.objects.create(transaction_id=sale.id, order=intent.order,
+                                                        amount=sale.amount, payment_type=payment_type)
+        order_models.Transaction.objects.create(order=intent.order, amount=sale.amount, payment_type=payment_type,
+                                                payer=intent.order.customer)
+        finish_payment(intent, sale.id)
+
+
+CAPTURES = {
+    payment_models.PaymentIntent.STRIPE: capture_stripe,
+    payment_models.PaymentIntent.BRAINTREE: capture_braintree,
+}
+
+
+def get_claimable_intents():
+    """
+    Pending intents, and processing ones whose worker stopped before finishing them.
+    """
+    PaymentIntent = payment_models.PaymentIntent
+    now = timezone.now()
+    return PaymentIntent.objects.filter(
+        Q(status=PaymentIntent.PENDING) |
+        Q(status=PaymentIntent.PROCESSING, updated_at__lt=now - datetime.timedelta(seconds=PAYMENT_CLAIM_TIMEOUT),
+          created_at__gt=now - PAYMENT_RECLAIM_WINDOW)
+    )
+
+
+@shared_task(bind=True, queue='payments', max_retries=5, default_retry_delay=10)
+def capture_payment(self, intent_id):
+    PaymentIntent = payment_models.PaymentIntent
+    # Claim the intent; a duplicate delivery of this task finds it processing or finished and stops here
+    if not get_claimable_intents().filter(pk=intent_id).update(status=PaymentIntent.PROCESSING,
+                                                               updated_at=timezone.now()):
+        return None
+    intent = PaymentIntent.objects.select_related('order', 'payer').get(pk=intent_id)
+    try:
+        CAPTURES[intent.gateway](intent)
+    except PaymentDeclined as e:
+        set_status(intent_id, PaymentIntent.FAILED, error_message=str(e))
+        return PaymentIntent.FAILED
+    except TRANSIENT_STRIPE_ERRORS + TRANSIENT_BRAINTREE_ERRORS as e:
+        if self.request.retries >= self.max_retries:
+            set_status(intent_id, PaymentIntent.FAILED, error_message=str(e))
+            return PaymentIntent.FAILED
+        set_status(intent_id, PaymentIntent.PENDING, error_message=str(e))
+        raise self.retry(exc=e, countdown=self.default_retry_delay * 2 ** self.request.retries)
+    return PaymentIntent.SUCCEEDED
+
+
+@shared_task(queue='payments')
+def requeue_stale_payments():
+    """
+    Queue the captures again whose worker died or whose task message was lost. Returns the intent ids.
+    """
+    stale = timezone.now() - datetime.timedelta(seconds=PAYMENT_CLAIM_TIMEOUT)
+    intent_ids = list(get_claimable_intents().filter(updated_at__lt=stale).values_list('pk', flat=True))
+    for intent_id in intent_ids:
+        capture_payment.delay(intent_id)
+    return intent_ids
+
+
+def get_refundable_transactions(order_ids):
+    return payment_models.StripeTransaction.objects.filter(
+        order_id__in=order_ids, payment_id__isnull=False,
+    ).exclude(payment_id='').exclude(refund_status__in=REFUND_ISSUED_STATUSES)
+
+
+def create_refund(charge_id):
+    # Keyed by the charge, so a rerun of an interrupted job gets back the refund Stripe already made
+    return stripe.Refund.create(api_key=settings.STRIPE_API_KEY, charge=charge_id,
+                                idempotency_key='refund-{}'.format(charge_id))
+
+
+def set_refund_state(payment, refund_id, refund_status, error=None):
+    fields = {'refund_status': refund_status, 'refund_error': error}
+    if refund_id:
+        fields['refund_id'] = refund_id
+    if refund_status in REFUND_ISSUED_STATUSES:
+        fields['status'] = 'reject'
+    payment_models.StripeTransaction.objects.filter(pk=payment.pk).update(**fields)
+
+
+def refund_transactions(payments, workers=REFUND_WORKERS):
+    """
+    Refund the charges in parallel and record each outcome as soon as Stripe answers.
+    Stripe calls run in the pool; the database is only written from the calling thread.
+    Returns the transactions whose refund hit a transient error and may succeed on a retry.
+    """
+    payments = list(payments)
+    if not payments:
+        return []
+    transient = []
+    with ThreadPoolExecutor(max_workers=min(workers, len(payments))) as executor:
+        futures = {executor.submit(create_refund, payment.payment_id): payment for payment in payments}
+        for future in as_completed(futures):
+            payment = futures[future]
+            try:
+                refund = future.result()
+            except TRANSIENT_STRIPE_ERRORS as e:
+                set_refund_state(payment, None, None, error=str(e))
+                transient.append(payment)
+            except stripe.error.StripeError as e:
+                set_refund_state(payment, None, 'failed', error=e.user_message or str(e))
+            else:
+                set_refund_state(payment, refund.id, refund.status)
+    return transient
+
+
+def reject_refunded_orders(order_ids):
+    """
+    Mark the orders whose charges are all refunded as rejected. Returns their ids.
+    """
+    Order = order_models.Order
+    pending_ids = get_refundable_transactions(order_ids).values_list('order_id', flat=True)
+    orders = list(Order.objects.filter(pk__in=order_ids).exclude(state=Order.REJECT).exclude(pk__in=pending_ids))
+    with transaction.atomic():
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(state=Order.REJECT)
+        for order in orders:
+            order.state = Order.REJECT
+            transaction.on_commit(
+                lambda order=order: order_events.publish_order_event(order, order_events.STATE_CHANGED))
+    return [order.pk for order in orders]
+
+
+@shared_task(bind=True, queue='payments', max_retries=5, default_retry_delay=10)
+def reject_orders(self, order_ids):
+    """
+    Refund every Stripe charge of the orders and reject the fully refunded ones.
+    Safe to run again on the same orders: refunded charges are skipped and the rest resume.
+    """
+    transient = refund_transactions(get_refundable_transactions(order_ids))
+    rejected = reject_refunded_orders(order_ids)
+    if transient and self.request.retries < self.max_retries:
+        # Only the orders still waiting on a refund are retried
+        retry_ids = sorted({payment.order_id for payment in transient})
+        raise self.retry(args=(retry_ids,), countdown=self.default_retry_delay * 2 ** self.request.retries)
+    return rejected
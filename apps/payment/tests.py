@@ -1,3 +1,290 @@
-from django.test import TestCase
+import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+import stripe
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from project import modules as project_modules
+from apps.modifiers import models as modifier_models
+from apps.orders import models as order_models
+from apps.products import models as product_models
+from apps.payment import gateways as payment_gateways
+from apps.payment import models as payment_models
+from apps.payment import tasks as payment_tasks
+from apps.payment import vault as payment_vault
+from apps.payment.fake_braintree import StubBraintreeGateway
+from apps.payment.fake_stripe import fake_stripe_server
+from apps.users import models as user_models
+from apps.restapp import views as rest_views
+
+
+class BraintreeClientTokenTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+
+    def request_token(self, **data):
+        response = rest_views.PaypalRetrieveView.as_view()(self.factory.post('/', data, format='json'))
+        self.assertEqual(response.status_code, 200)
+        return response.data['token']
+
+    def test_client_token_is_generated_once(self):
+        with payment_gateways.override_braintree_gateway(StubBraintreeGateway()) as gateway:
+            first_token = self.request_token()
+            self.assertEqual(self.request_token(), first_token)
+            # A client-supplied customer id must not bind the token to that customer
+            self.assertEqual(self.request_token(customer_id='42'), first_token)
+        self.assertEqual(gateway.calls, ['client_token.generate'])
+
+    def test_gateway_is_shared_by_the_process(self):
+        self.assertIs(payment_gateways.get_braintree_gateway(), payment_gateways.get_braintree_gateway())
+
+
+@override_settings(STRIPE_API_KEY='sk_test_fake')
+class RejectOrdersTest(TestCase):
+
+    def setUp(self):
+        customer = user_models.User.objects.create_user(phone='100000003', password='secret')
+        self.orders = [order_models.Order.objects.create(customer=customer) for _ in range(3)]
+        # bulk_create skips the post_save handler that books points for a new payment
+        payment_models.StripeTransaction.objects.bulk_create([
+            payment_models.StripeTransaction(payer=customer, amount=300, payment_id='ch_{}_{}'.format(order.pk, i),
+                                             description='-', order=order, payment_type='Visa', status='paid')
+            for order in self.orders for i in range(2)
+        ])
+        # The first charge was refunded before the previous run stopped
+        payment_models.StripeTransaction.objects.filter(payment_id='ch_{}_0'.format(self.orders[0].pk)).update(
+            refund_id='re_done', refund_status='succeeded', status='reject')
+
+    def test_refunds_every_charge_once_and_resumes(self):
+        order_ids = [order.pk for order in self.orders]
+        with fake_stripe_server() as server:
+            rejected = payment_tasks.reject_orders.apply(args=(order_ids,)).get()
+            self.assertEqual(sorted(rejected), order_ids)
+            self.assertEqual(server.requests, [('POST', '/v1/refunds')] * 5)
+
+            payment_tasks.reject_orders.apply(args=(order_ids,)).get()
+            self.assertEqual(len(server.requests), 5)
+
+        self.assertFalse(payment_models.StripeTransaction.objects.exclude(status='reject').exists())
+        self.assertEqual(payment_models.StripeTransaction.objects.filter(refund_id='re_done').count(), 1)
+        self.assertFalse(order_models.Order.objects.exclude(state=order_models.Order.REJECT).exists())
+
+
+@override_settings(STRIPE_API_KEY='sk_test_fake')
+class VaultTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = user_models.User.objects.create_user(phone='100000011', password='secret')
+
+    def test_create_customer_saves_customer_and_card(self):
+        with fake_stripe_server() as server:
+            card_id = payment_vault.add_card(self.user, 'tok_visa')
+        self.assertEqual(server.requests, [('POST', '/v1/customers')])
+        customer = payment_models.StripeCustomer.objects.get(user=self.user)
+        self.assertEqual(list(customer.cards.values_list('card_id', 'brand')), [(card_id, 'Visa')])
+
+    def test_add_card_reuses_customer(self):
+        with fake_stripe_server() as server:
+            first_card_id = payment_vault.add_card(self.user, 'tok_visa')
+            second_card_id = payment_vault.add_card(self.user, 'tok_mastercard')
+        self.assertEqual(server.requests, [('POST', '/v1/customers'),
+                                           ('POST', '/v1/customers/{}/sources'.format(
+                                               payment_vault.get_profile(self.user)['customer_id']))])
+        self.assertEqual(payment_models.StripeCustomer.objects.count(), 1)
+        self.assertEqual(set(payment_vault.get_profile(self.user)['cards']), {first_card_id, second_card_id})
+
+    def test_create_customer_attaches_card_to_customer_created_meanwhile(self):
+        with fake_stripe_server() as server:
+            payment_vault.create_customer(self.user, 'tok_visa')
+            # A concurrent checkout that saw no profile before the first one committed
+            card_id = payment_vault.create_customer(self.user, 'tok_mastercard')
+        self.assertEqual(server.requests.count(('POST', '/v1/customers')), 1)
+        self.assertEqual(payment_models.StripeCustomer.objects.count(), 1)
+        self.assertIn(card_id, payment_vault.get_profile(self.user)['cards'])
+
+    def test_get_card_brand(self):
+        with fake_stripe_server():
+            card_id = payment_vault.add_card(self.user, 'tok_visa')
+        self.assertEqual(payment_vault.get_card_brand(self.user, card_id), 'Visa')
+        with self.assertRaises(payment_vault.VaultError):
+            payment_vault.get_card_brand(self.user, 'card_unknown')
+        other_user = user_models.User.objects.create_user(phone='100000012', password='secret')
+        with self.assertRaises(payment_vault.VaultError):
+            payment_vault.get_card_brand(other_user, card_id)
+
+    def test_profile_cache_is_dropped_when_a_card_is_added(self):
+        self.assertIsNone(payment_vault.get_profile(self.user))
+        with fake_stripe_server():
+            first_card_id = payment_vault.add_card(self.user, 'tok_visa')
+            self.assertEqual(list(payment_vault.get_profile(self.user)['cards']), [first_card_id])
+            second_card_id = payment_vault.add_card(self.user, 'tok_mastercard')
+        with self.assertNumQueries(0):
+            cards = payment_vault.get_profile(self.user)['cards']
+        self.assertEqual(set(cards), {first_card_id, second_card_id})
+
+
+@override_settings(STRIPE_API_KEY='sk_test_fake')
+class ImportStripeCustomersTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.payer = user_models.User.objects.create_user(phone='100000013', password='secret')
+        self.other_payer = user_models.User.objects.create_user(phone='100000014', password='secret')
+
+    def create_charge(self, payer, customer_id):
+        order = order_models.Order.objects.create(customer=payer)
+        # bulk_create skips the post_save handler that books points for a new payment
+        payment_models.StripeTransaction.objects.bulk_create([payment_models.StripeTransaction(
+            payer=payer, customer_id=customer_id, amount=300, payment_id='ch_{}'.format(order.pk), description='-',
+            order=order, payment_type='Visa', status='paid')])
+
+    def test_links_customers_charged_for_one_payer(self):
+        with fake_stripe_server():
+            customer = stripe.Customer.create(api_key='sk_test_fake', source='tok_visa')
+            shared_customer = stripe.Customer.create(api_key='sk_test_fake', source='tok_visa')
+            self.create_charge(self.payer, customer.id)
+            self.create_charge(self.payer, shared_customer.id)
+            self.create_charge(self.other_payer, shared_customer.id)
+            call_command('import_stripe_customers', stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(list(payment_models.StripeCustomer.objects.values_list('user_id', 'customer_id')),
+                         [(self.payer.pk, customer.id)])
+        self.assertEqual(payment_vault.get_card_brand(self.payer, customer.default_source), 'Visa')
+
+
+class StripeRetrieveViewTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = user_models.User.objects.create_user(phone='100000015', password='secret')
+        user_models.User.objects.create_user(phone='100000016', password='secret')
+
+    def post(self, data, user=None):
+        request = self.factory.post('/', data, format='json')
+        if user is not None:
+            force_authenticate(request, user=user)
+        return rest_views.StripeRetrieveView.as_view()(request)
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.post({'token_id': 'tok_visa', 'phone': '100000015'}).status_code, 401)
+
+    def test_cannot_save_a_card_for_another_phone(self):
+        response = self.post({'token_id': 'tok_visa', 'phone': '100000016'}, user=self.user)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(payment_models.StripeCustomer.objects.exists())
+
+    def test_token_is_required(self):
+        self.assertEqual(self.post({'phone': '100000015'}, user=self.user).status_code, 400)
+        self.assertFalse(payment_models.StripeCustomer.objects.exists())
+
+    @override_settings(STRIPE_API_KEY='sk_test_fake')
+    def test_cards_are_saved_on_the_callers_customer(self):
+        cache.clear()
+        with fake_stripe_server() as server:
+            first = self.post({'token_id': 'tok_visa'}, user=self.user)
+            second = self.post({'token_id': 'tok_mastercard', 'phone': '100000015'}, user=self.user)
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(first.data['customer'], second.data['customer'])
+        self.assertEqual([path for method, path in server.requests],
+                         ['/v1/customers', '/v1/customers/{}/sources'.format(first.data['customer'])])
+        self.assertEqual(payment_models.StripeCustomer.objects.get().customer_id, first.data['customer'])
+
+
+@override_settings(STRIPE_API_KEY='sk_test_fake')
+class CapturePaymentTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        owner = user_models.User.objects.create_user(phone='100000017', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        category = user_models.Category.objects.create(name='Coffee')
+        cafe = user_models.Cafe.objects.create(user=owner, cafe_name='Cafe', category=category, description='',
+                                               call_center='1', status=user_models.Cafe.ACTIVE, tax_rate=0)
+        modifier_category = modifier_models.ModifierCategory.objects.create(title='Milk', owner=owner)
+        product = product_models.Product.objects.create(title='Latte', description='', owner=owner, price=5,
+                                                        modifier=modifier_category)
+        self.payer = user_models.User.objects.create_user(phone='100000018', password='secret')
+        self.order = order_models.Order.objects.create(customer=self.payer, cafe=cafe, total_price=Decimal('5.00'))
+        order_models.Cart.objects.create(order=self.order, product=product, count=1)
+        patcher = mock.patch.object(project_modules, 'send_push_for_topic')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_intent(self, **fields):
+        return payment_models.PaymentIntent.objects.create(
+            order=self.order, payer=self.payer, idempotency_key='order-{}-key'.format(self.order.pk),
+            gateway=payment_models.PaymentIntent.STRIPE, amount=500, token='tok_visa', payment_type='Visa', **fields)
+
+    def capture(self, intent):
+        return payment_tasks.capture_payment.apply(args=(intent.pk,)).get()
+
+    def test_capture_saves_the_card_and_charges_it(self):
+        intent = self.create_intent()
+        with fake_stripe_server() as server:
+            self.assertEqual(self.capture(intent), payment_models.PaymentIntent.SUCCEEDED)
+        self.assertEqual(server.requests, [('POST', '/v1/customers'), ('POST', '/v1/charges')])
+
+        intent.refresh_from_db()
+        payment = payment_models.StripeTransaction.objects.get(order=self.order)
+        self.assertEqual((intent.status, intent.charge_id), (payment_models.PaymentIntent.SUCCEEDED, payment.payment_id))
+        self.assertEqual(payment_vault.get_card_brand(self.payer, intent.card_id), 'Visa')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.state, order_models.Order.READY)
+
+    def test_only_a_pending_intent_is_claimed(self):
+        intent = self.create_intent()
+        with fake_stripe_server() as server:
+            self.capture(intent)
+            # A duplicate delivery of the task finds the intent finished
+            self.assertIsNone(self.capture(intent))
+            processing = self.create_intent(status=payment_models.PaymentIntent.PROCESSING,
+                                            idempotency_key='order-{}-other'.format(self.order.pk))
+            # Another worker is still on it
+            self.assertIsNone(self.capture(processing))
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(payment_models.StripeTransaction.objects.count(), 1)
+
+    def test_stale_processing_intent_is_reconciled_through_its_idempotency_key(self):
+        intent = self.create_intent()
+        with fake_stripe_server() as server:
+            # The worker charged the card and died before recording the charge
+            card_id = payment_vault.add_card(self.payer, 'tok_visa')
+            charge, card_id = payment_vault.charge(self.payer, 500, card_id=card_id,
+                                                   idempotency_key=intent.idempotency_key)
+            payment_models.PaymentIntent.objects.filter(pk=intent.pk).update(
+                status=payment_models.PaymentIntent.PROCESSING, card_id=card_id,
+                updated_at=timezone.now() - datetime.timedelta(seconds=payment_tasks.PAYMENT_CLAIM_TIMEOUT + 1))
+
+            with mock.patch.object(payment_tasks.capture_payment, 'delay') as delay:
+                self.assertEqual(payment_tasks.requeue_stale_payments.apply().get(), [intent.pk])
+            delay.assert_called_once_with(intent.pk)
+            self.assertEqual(self.capture(intent), payment_models.PaymentIntent.SUCCEEDED)
+            charges = [obj for obj in server.objects.values() if obj['object'] == 'charge']
+
+        self.assertEqual([obj['id'] for obj in charges], [charge.id])
+        self.assertEqual(payment_models.StripeTransaction.objects.get(order=self.order).payment_id, charge.id)
+
+    def test_duplicate_submit_returns_the_first_intent(self):
+        view = rest_views.UserPaymentStripeView.as_view()
+
+        def submit():
+            request = self.factory.post('/', {'m_id': 'tok_visa', 'm_card': {'brand': 'Visa'}}, format='json',
+                                        HTTP_IDEMPOTENCY_KEY='checkout-1')
+            return view(request, phone=self.payer.phone, order_id=self.order.pk)
+
+        first = submit()
+        second = submit()
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(payment_models.PaymentIntent.objects.filter(order=self.order).count(), 1)
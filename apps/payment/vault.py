@@ -0,0 +1,118 @@
+"""
+Stripe payment profiles: one reusable Stripe customer per user and the cards attached to it.
+
+Profiles are created lazily on the first card a user pays with and cached, so a repeat checkout
+with a saved card is a single Charge call.
+"""
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.payment import models as payment_models
+from apps.users import models as user_models
+
+PROFILE_CACHE_KEY = 'stripe_profile:{}'
+PROFILE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class VaultError(Exception):
+    pass
+
+
+def get_profile_cache_key(user_id):
+    return PROFILE_CACHE_KEY.format(user_id)
+
+
+def get_profile(user):
+    """
+    Returns {'customer_id': ..., 'cards': {card_id: brand}} or None if the user has never paid with Stripe.
+    """
+    key = get_profile_cache_key(user.pk)
+    profile = cache.get(key)
+    if profile is None:
+        customer = payment_models.StripeCustomer.objects.filter(user_id=user.pk).first()
+        if customer is None:
+            return None
+        profile = {
+            'customer_id': customer.customer_id,
+            'cards': dict(customer.cards.values_list('card_id', 'brand')),
+        }
+        cache.set(key, profile, PROFILE_CACHE_TIMEOUT)
+    return profile
+
+
+def save_card(customer, card):
+    payment_models.StripeCard.objects.get_or_create(card_id=card['id'], defaults={
+        'customer': customer,
+        'brand': card.get('brand'),
+        'last4': card.get('last4'),
+        'fingerprint': card.get('fingerprint'),
+    })
+
+
+def create_customer(user, token_id, idempotency_key=None):
+    """
+    Create the user's Stripe customer with the token's card as its first source, in one API call.
+    The user row stays locked until the profile is saved, so of two concurrent first checkouts the
+    second finds the customer of the first and adds its card there. Returns the card id.
+    """
+    with transaction.atomic():
+        user_models.User.objects.select_for_update().filter(pk=user.pk).exists()
+        customer = payment_models.StripeCustomer.objects.filter(user_id=user.pk).first()
+        if customer is not None:
+            card_id = attach_card(customer, token_id, idempotency_key=idempotency_key)
+        else:
+            stripe_customer = stripe.Customer.create(api_key=settings.STRIPE_API_KEY, source=token_id,
+                                                     metadata={'phone': user.phone},
+                                                     idempotency_key=idempotency_key)
+            customer = payment_models.StripeCustomer.objects.create(user=user, customer_id=stripe_customer.id)
+            for card in stripe_customer.sources.data:
+                save_card(customer, card)
+            card_id = stripe_customer.default_source
+    cache.delete(get_profile_cache_key(user.pk))
+    return card_id
+
+
+def attach_card(customer, token_id, idempotency_key=None):
+    card = stripe.Customer.create_source(customer.customer_id, api_key=settings.STRIPE_API_KEY, source=token_id,
+                                         idempotency_key=idempotency_key)
+    save_card(customer, card)
+    return card.id
+
+
+def add_card(user, token_id, idempotency_key=None):
+    """
+    Attach the card behind a token to the user's customer, creating the customer if needed.
+    Returns the card id.
+    """
+    if get_profile(user) is None:
+        return create_customer(user, token_id, idempotency_key=idempotency_key)
+    card_id = attach_card(payment_models.StripeCustomer.objects.get(user_id=user.pk), token_id,
+                          idempotency_key=idempotency_key)
+    cache.delete(get_profile_cache_key(user.pk))
+    return card_id
+
+
+def get_card_brand(user, card_id):
+    profile = get_profile(user)
+    if profile is None or card_id not in profile['cards']:
+        raise VaultError('Card {} is not saved for this user'.format(card_id))
+    return profile['cards'][card_id]
+
+
+def charge(user, amount, card_id=None, token_id=None, currency='usd', **params):
+    """
+    Charge a saved card, or save the card behind `token_id` first and charge it.
+    Returns (charge, card_id).
+    """
+    if card_id is None:
+        if token_id is None:
+            raise VaultError('A card or a token is required')
+        card_id = add_card(user, token_id)
+    else:
+        get_card_brand(user, card_id)
+    customer_id = get_profile(user)['customer_id']
+    stripe_charge = stripe.Charge.create(api_key=settings.STRIPE_API_KEY, amount=amount, currency=currency,
+                                         customer=customer_id, source=card_id, **params)
+    return stripe_charge, card_id
@@ -0,0 +1,126 @@
+"""
+Precompiled cafe menus for /cafes/<id>/products/.
+
+A cafe's menu is compiled into one document, the list of ProductSerializer payloads of its products,
+from one query per table instead of several queries per product. Documents are cached under the cafe's
+menu version; a change to anything a menu shows bumps the version of the cafes it belongs to, so only
+those menus are compiled again, on their next read.
+"""
+from collections import defaultdict
+
+from django.core.cache import cache
+
+from apps.modifiers import models as modifier_models
+from apps.products import models as product_models
+from apps.users import models as user_models
+from apps.restapp import caching
+from apps.restapp import trees
+
+MENU_VERSION_CACHE_KEY = 'menu_version:{}'
+MENU_CACHE_KEY = 'menu:{}:{}:{}:{}'
+MENU_CACHE_TIMEOUT = 60 * 60 * 24
+# Bumped for changes every menu shows, such as a product category name
+ALL_MENUS = 'all'
+
+
+def format_decimal(value):
+    # DRF's DecimalField renders prices as strings
+    return '{:f}'.format(value) if value is not None else None
+
+
+def compile_menu(cafe_id, request=None):
+    """
+    Returns the ProductSerializer payloads of every product of the cafe, ordered by id.
+    """
+    products = list(product_models.Product.objects.filter(cafes__cafe_id=cafe_id).distinct().order_by('pk').values(
+        'pk', 'title', 'description', 'price', 'owner_id', 'category_id', 'category__name'))
+    product_ids = [product['pk'] for product in products]
+
+    images = defaultdict(list)
+    for image_id, product_id, name in product_models.ProductImage.objects.filter(
+            product_id__in=product_ids).order_by('pk').values_list('pk', 'product_id', 'file'):
+        images[product_id].append({'id': image_id,
+                                   'src': trees.get_file_url(request, product_models.ProductImage, 'file', name)})
+
+    sizes = defaultdict(list)
+    for size in product_models.Size.objects.filter(product_id__in=product_ids, available=True).order_by('pk').values(
+            'id', 'title', 'price', 'default', 'available', 'product'):
+        size['price'] = format_decimal(size['price'])
+        sizes[size['product']].append(size)
+
+    group_ids = defaultdict(list)
+    for product_id, group_id in product_models.ProductModifier.objects.filter(
+            product_id__in=product_ids).order_by('modifier_id').values_list('product_id', 'modifier_id').distinct():
+        group_ids[product_id].append(group_id)
+
+    all_group_ids = {group_id for ids in group_ids.values() for group_id in ids}
+    items = defaultdict(list)
+    for item in modifier_models.Modifier.objects.filter(category_id__in=all_group_ids).order_by('pk').values(
+            'id', 'title', 'price', 'default', 'available', 'category_id'):
+        item['price'] = format_decimal(item['price'])
+        items[item.pop('category_id')].append(item)
+    groups = {
+        group['id']: dict(group, modifier_items=items[group['id']])
+        for group in modifier_models.ModifierCategory.objects.filter(pk__in=all_group_ids).values(
+            'id', 'title', 'is_top', 'is_single', 'required', 'available')
+    }
+
+    free_item_categories = dict(user_models.CafeGeneralSettings.objects.filter(
+        owner_id__in={product['owner_id'] for product in products}).values_list('owner_id', 'exchangeable_product_id'))
+
+    menu = []
+    for product in products:
+        category_id = product['category_id']
+        menu.append({
+            'id': product['pk'],
+            'title': product['title'],
+            'description': product['description'],
+            'price': format_decimal(product['price']),
+            'sizes': sizes[product['pk']],
+            'modifiers': [groups[group_id] for group_id in group_ids[product['pk']] if group_id in groups],
+            'images': images[product['pk']],
+            'category': [{'name': product['category__name'], 'id': category_id}] if category_id else None,
+            'available_in_free_item': bool(category_id) and free_item_categories.get(
+                product['owner_id']) == category_id,
+        })
+    return menu
+
+
+def get_menu_version(cafe_id):
+    return caching.get_key_version(MENU_VERSION_CACHE_KEY.format(cafe_id))
+
+
+def get_menu(cafe_id, request=None):
+    """
+    The cafe's compiled menu. Documents are kept per scheme and host, as file URLs in them are absolute.
+    """
+    origin = '{}://{}'.format(request.scheme, request.get_host()) if request is not None else ''
+    key = MENU_CACHE_KEY.format(cafe_id, get_menu_version(ALL_MENUS), get_menu_version(cafe_id), origin)
+    menu = cache.get(key)
+    if menu is None:
+        menu = compile_menu(cafe_id, request)
+        cache.set(key, menu, MENU_CACHE_TIMEOUT)
+    return menu
+
+
+def invalidate_menus(cafe_ids):
+    """
+    Bump the menu version of these cafes once the current transaction commits.
+    """
+    caching.bump_key_versions([MENU_VERSION_CACHE_KEY.format(cafe_id) for cafe_id in set(cafe_ids)])
+
+
+def filter_menu(menu, category=None, search=''):
+    """
+    The `category` filter and `search` of CafeProductsView, applied to a compiled menu:
+    every search term must occur in the title, the category name or the description.
+    """
+    if category:
+        menu = [product for product in menu if product['category'] and str(product['category'][0]['id']) == category]
+    terms = search.replace(',', ' ').lower().split()
+    if terms:
+        def text(product):
+            category_name = product['category'][0]['name'] if product['category'] else ''
+            return '\n'.join([product['title'], category_name, product['description']]).lower()
+        menu = [product for product in menu if all(term in text(product) for term in terms)]
+    return menu
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The PRODUCT_DOCUMENT of project/search.py as it was when this migration was written
+BUILD_SEARCH_VECTORS_SQL = """
+UPDATE products_product SET search_vector =
+    setweight(to_tsvector('english'::regconfig, coalesce(products_product.title, '')), 'A') ||
+    setweight(to_tsvector('english'::regconfig, coalesce(
+        (SELECT name FROM products_productcategory
+         WHERE products_productcategory.id = products_product.category_id), '')), 'B') ||
+    setweight(to_tsvector('english'::regconfig, coalesce(regexp_replace(regexp_replace(
+        products_product.description, '<[^>]*>', ' ', 'g'), '&[#a-zA-Z0-9]+;', ' ', 'g'), '')), 'D')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_auto_20181213_1647'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'],
+                                                           name='products_search_vector_idx'),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX products_product_title_trgm_idx ON products_product USING gin (title gin_trgm_ops)',
+            'DROP INDEX products_product_title_trgm_idx',
+        ),
+        migrations.RunSQL(BUILD_SEARCH_VECTORS_SQL, migrations.RunSQL.noop),
+    ]
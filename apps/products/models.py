@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models.signals import post_save
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.shortcuts import reverse
 
 from ckeditor.fields import RichTextField
@@ -8,6 +11,7 @@ from mptt.models import MPTTModel, TreeForeignKey
 from apps.modifiers.models import ModifierCategory
 
 from apps.users.models import Album, File, Cafe
+from project import search as project_search
 
 
 class ProductCategory(MPTTModel):
@@ -47,10 +51,13 @@ class Product(models.Model):
     category = models.ForeignKey(ProductCategory, null=True, blank=True)
     price = models.DecimalField(max_digits=100, decimal_places=2)
     modifier = models.ForeignKey(ModifierCategory, on_delete=models.CASCADE, related_name='meals')
+    # Full-text document of title, category and description, maintained by product_search_handler below
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
+        indexes = [GinIndex(fields=['search_vector'], name='products_search_vector_idx')]
 
     def __str__(self):
         return self.title
@@ -83,3 +90,24 @@ class ProductModifier(models.Model):
     class Meta:
         verbose_name = 'Product modifier'
         verbose_name_plural = 'Product modifiers'
+
+
+PRODUCT_SEARCH_FIELDS = {'title', 'category', 'description'}
+
+
+def product_search_handler(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not PRODUCT_SEARCH_FIELDS.intersection(update_fields):
+        return
+    project_search.update_search_vectors(Product.objects.filter(pk=instance.pk), project_search.PRODUCT_DOCUMENT)
+
+
+def product_category_search_handler(sender, instance, **kwargs):
+    # Product documents include the category name
+    if not kwargs['created']:
+        project_search.update_search_vectors(Product.objects.filter(category_id=instance.pk),
+                                             project_search.PRODUCT_DOCUMENT)
+
+
+post_save.connect(receiver=product_search_handler, sender=Product)
+post_save.connect(receiver=product_category_search_handler, sender=ProductCategory)
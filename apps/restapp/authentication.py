@@ -0,0 +1,29 @@
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from apps.users import identity as user_identity
+from apps.users import models as user_models
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that resolves the token through the identity cache.
+    `request.auth` is the token key; the Token row is only read on a cache miss.
+    """
+
+    def authenticate_credentials(self, key):
+        user_id = user_identity.get_token_user_id(key)
+        if user_id is None:
+            user, token = super().authenticate_credentials(key)
+            user_identity.set_token_user_id(key, user.pk)
+            return user, key
+
+        try:
+            user = user_identity.get_user(user_id)
+        except user_models.User.DoesNotExist:
+            user_identity.forget_token(key)
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, key
@@ -0,0 +1,97 @@
+"""
+Versioned response cache for the public catalog endpoints.
+
+Every namespace has a version in the cache: the time of the last change to one of the models behind it.
+Save/delete signals replace the version, which orphans all cached payloads of the namespace at once.
+Responses carry an ETag and Last-Modified derived from the version, so a client that sends them back
+gets a 304 without the view touching the database.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import response, status
+
+CATEGORIES = 'categories'
+NEWS = 'news'
+PRODUCT_CATEGORIES = 'product_categories'
+PRODUCTS = 'products'
+
+VERSION_CACHE_KEY = 'catalog:version:{}'
+PAYLOAD_CACHE_KEY = 'catalog:payload:{}:{}:{}'
+PAYLOAD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_key_version(key):
+    """
+    The version stored under `key`, the time of the last change it tracks.
+    """
+    version = cache.get(key)
+    if version is None:
+        version = '{:.6f}'.format(time.time())
+        # add() keeps the version another process may have set meanwhile
+        cache.add(key, version, None)
+        version = cache.get(key) or version
+    return version
+
+
+def bump_key_versions(keys):
+    # After commit, so a request running meanwhile cannot cache the old rows under the new version
+    def bump():
+        version = '{:.6f}'.format(time.time())
+        cache.set_many({key: version for key in keys}, None)
+    if keys:
+        transaction.on_commit(bump)
+
+
+def get_version(namespace):
+    return get_key_version(VERSION_CACHE_KEY.format(namespace))
+
+
+def bump_version(*namespaces):
+    bump_key_versions([VERSION_CACHE_KEY.format(namespace) for namespace in namespaces])
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+class CatalogCacheMixin(object):
+    """
+    Serve GET from the namespace's cached payload, with ETag/Last-Modified validators.
+    The key includes the absolute URL (payloads contain absolute file URLs) and the Accept header.
+    """
+    cache_namespace = None
+
+    def get(self, request, *args, **kwargs):
+        version = get_version(self.cache_namespace)
+        variant = '{} {}'.format(request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', ''))
+        variant_hash = hashlib.md5(variant.encode()).hexdigest()
+        etag = quote_etag(hashlib.md5('{}:{}'.format(version, variant_hash).encode()).hexdigest())
+        last_modified = float(version)
+
+        if is_not_modified(request, etag, last_modified):
+            catalog_response = response.Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = PAYLOAD_CACHE_KEY.format(self.cache_namespace, version, variant_hash)
+            data = cache.get(key)
+            if data is None:
+                catalog_response = super().get(request, *args, **kwargs)
+                if catalog_response.status_code != status.HTTP_200_OK:
+                    return catalog_response
+                cache.set(key, catalog_response.data, PAYLOAD_CACHE_TIMEOUT)
+            else:
+                catalog_response = response.Response(data)
+
+        catalog_response['ETag'] = etag
+        catalog_response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(catalog_response, max_age=0, must_revalidate=True)
+        return catalog_response
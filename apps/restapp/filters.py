@@ -1,4 +1,7 @@
 from django_filters import filterset, filters
+from rest_framework.filters import SearchFilter
+
+from project import search as project_search
 from apps.users import models as user_models
 
 
@@ -8,3 +11,29 @@ class CategoryFilter(filterset.Filter):
     class Meta:
         model = user_models.Category
         fields = ['is_top']
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    `?search=` over the model's search_vector, with trigram matching on `search_name_field` of the view.
+    Results are ordered by relevance; views setting `search_rank_first = False` keep their own ordering
+    first, as nearby cafes do with distance.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        name_field = getattr(view, 'search_name_field', None)
+        if not terms or name_field is None:
+            return super().filter_queryset(request, queryset, view)
+
+        ordering = list(queryset.query.order_by)
+        queryset = project_search.search(queryset, ' '.join(terms), name_field)
+        if getattr(view, 'search_rank_first', True):
+            return queryset.order_by('-search_rank', *ordering)
+        return queryset.order_by(*(ordering + ['-search_rank']))
+
+    def get_ordering(self, request, queryset, view):
+        # Asked by cursor pagination: ranked results are paged by rank, others by the paginator's ordering
+        if self.get_search_terms(request) and getattr(view, 'search_name_field', None):
+            return ('-search_rank', '-id')
+        return view.pagination_class.ordering
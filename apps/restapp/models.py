@@ -0,0 +1,95 @@
+from django.db.models.signals import post_save, post_delete
+from mptt.signals import node_moved
+
+from apps.users import models as user_models
+from apps.products import models as product_models
+from apps.modifiers import models as modifier_models
+from apps.products import menus as product_menus
+from apps.restapp import caching
+from apps.restapp import trees
+from apps.restapp import suggestions
+
+
+def category_change_handler(sender, **kwargs):
+    trees.invalidate_tree(sender)
+    caching.bump_version(caching.CATEGORIES)
+    # Suggestions carry the category name
+    suggestions.invalidate_index()
+
+
+def cafe_suggest_change_handler(sender, **kwargs):
+    suggestions.invalidate_index()
+
+
+def news_change_handler(sender, **kwargs):
+    caching.bump_version(caching.NEWS)
+
+
+def product_category_change_handler(sender, **kwargs):
+    # Product payloads embed the category name
+    trees.invalidate_tree(sender)
+    caching.bump_version(caching.PRODUCT_CATEGORIES, caching.PRODUCTS)
+
+
+def product_change_handler(sender, **kwargs):
+    caching.bump_version(caching.PRODUCTS)
+
+
+def menu_product_change_handler(sender, instance, **kwargs):
+    # The cafes serving the product; a product deleted with its CafeMeals is handled by their own signals
+    product_id = instance.pk if sender is product_models.Product else instance.product_id
+    product_menus.invalidate_menus(
+        product_models.CafeMeals.objects.filter(product_id=product_id).values_list('cafe_id', flat=True))
+
+
+def menu_cafe_meal_change_handler(sender, instance, **kwargs):
+    product_menus.invalidate_menus([instance.cafe_id])
+
+
+def menu_modifier_change_handler(sender, instance, **kwargs):
+    group_id = instance.pk if sender is modifier_models.ModifierCategory else instance.category_id
+    product_menus.invalidate_menus(product_models.CafeMeals.objects.filter(
+        product__modifiers__modifier_id=group_id).values_list('cafe_id', flat=True))
+
+
+def menu_settings_change_handler(sender, instance, **kwargs):
+    # The owner's free item category decides `available_in_free_item` of all their products
+    product_menus.invalidate_menus(product_models.CafeMeals.objects.filter(
+        product__owner_id=instance.owner_id).values_list('cafe_id', flat=True))
+
+
+def menu_category_change_handler(sender, **kwargs):
+    product_menus.invalidate_menus([product_menus.ALL_MENUS])
+
+
+# Models rendered inside the product payload: images, sizes, modifier groups and the owner's free item category
+PRODUCT_MODELS = (
+    product_models.Product,
+    product_models.ProductImage,
+    product_models.Size,
+    product_models.ProductModifier,
+    modifier_models.ModifierCategory,
+    modifier_models.Modifier,
+    user_models.CafeGeneralSettings,
+)
+
+for signal in (post_save, post_delete):
+    signal.connect(receiver=category_change_handler, sender=user_models.Category)
+    signal.connect(receiver=cafe_suggest_change_handler, sender=user_models.Cafe)
+    signal.connect(receiver=news_change_handler, sender=user_models.News)
+    signal.connect(receiver=product_category_change_handler, sender=product_models.ProductCategory)
+    for model in PRODUCT_MODELS:
+        signal.connect(receiver=product_change_handler, sender=model)
+    for model in (product_models.Product, product_models.ProductImage, product_models.Size,
+                  product_models.ProductModifier):
+        signal.connect(receiver=menu_product_change_handler, sender=model)
+    signal.connect(receiver=menu_modifier_change_handler, sender=modifier_models.ModifierCategory)
+    signal.connect(receiver=menu_modifier_change_handler, sender=modifier_models.Modifier)
+    signal.connect(receiver=menu_settings_change_handler, sender=user_models.CafeGeneralSettings)
+    signal.connect(receiver=menu_cafe_meal_change_handler, sender=product_models.CafeMeals)
+    signal.connect(receiver=menu_category_change_handler, sender=product_models.ProductCategory)
+
+# Moving a node rewrites lft/rght of other rows with queryset updates, which send no post_save for them
+node_moved.connect(receiver=category_change_handler, sender=user_models.Category)
+node_moved.connect(receiver=product_category_change_handler, sender=product_models.ProductCategory)
+node_moved.connect(receiver=menu_category_change_handler, sender=product_models.ProductCategory)
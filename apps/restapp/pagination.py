@@ -1,9 +1,88 @@
-from rest_framework import pagination
+from collections import OrderedDict
 
+from rest_framework import pagination, response
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-class CafesPagination(pagination.PageNumberPagination):
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Cursor pagination for lists that grow without bound. A page is an indexed range after the
+    cursor's position, so its cost does not depend on how deep it is, and no COUNT(*) is run.
+    Orderings should start with a unique or nearly unique indexed field.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
+
+
+class CreatedKeysetPagination(KeysetPagination):
+    # Rows created in the same instant share a position and are told apart by the cursor offset
+    ordering = ('-created_at', '-id')
+
+
+class OptionalCountPageNumberPagination(pagination.PageNumberPagination):
+    """
+    Page numbers, with `?count=false` to skip the COUNT(*): the response then has no `count`
+    and one extra row is read to tell whether there is a next page.
+    """
+    count_query_param = 'count'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.count_query_param) != 'false':
+            self.page_number = None
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+            if self.page_number < 1:
+                raise ValueError()
+        except ValueError:
+            raise NotFound(self.invalid_page_message.format(page_number=request.query_params.get(
+                self.page_query_param), message='That page number is less than 1'))
+
+        self.request = request
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if self.page_number is None:
+            return super().get_paginated_response(data)
+        return response.Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if self.page_number is None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number is None:
+            return super().get_previous_link()
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+
+class CafesPagination(OptionalCountPageNumberPagination):
     page_size = 15
 
 
-class CafeReviewsPagination(pagination.PageNumberPagination):
+class CafeReviewsPagination(OptionalCountPageNumberPagination):
     page_size = 5
+
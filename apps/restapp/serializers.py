@@ -1,6 +1,6 @@
-from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Sum
 
 from rest_framework import serializers
@@ -10,17 +10,22 @@ from geosimple.utils import Point as GeoPoint
 from pyfcm import FCMNotification
 
 from apps.users import models as user_models
+from apps.users import points as user_points
+from apps.users import identity as user_identity
+from apps.users.managers import get_current_week_day
 from apps.products import models as product_models
 from apps.modifiers import models as modifier_models
 from apps.orders import models as order_models
+from apps.orders import assembly as order_assembly
+from apps.orders import pricing as order_pricing
+from apps.orders import events as order_events
+from apps.payment import models as payment_models
+from apps.restapp import trees
 from project import modules as project_modules
 
 User = get_user_model()
 push_service = FCMNotification(api_key=settings.FCM_API_KEY)
 
-current_day = timezone.datetime.today().weekday()
-current_week_day = user_models.get_week_day(current_day)
-
 
 class RecursiveSerializer(serializers.Serializer):
     def to_representation(self, value):
@@ -71,11 +76,13 @@ class CafesSerializer(serializers.ModelSerializer):
     class Meta:
         model = user_models.Cafe
         extra_fields = ['avatar', 'time_graphic']
-        exclude = ['user', 'id', ]
+        # Coordinates are served through `location`, counters through likes/dislikes/cafe_reviews
+        exclude = ['user', 'id', 'latitude', 'longitude', 'reviews_count', 'rating_sum', 'rating_count',
+                   'likes_count', 'dislikes_count', 'search_vector', ]
 
     @staticmethod
     def get_cafe_reviews(obj):
-        return obj.reviews.all().count()
+        return obj.reviews_count
 
     @staticmethod
     def get_category(obj):
@@ -98,11 +105,11 @@ class CafesSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_likes(obj):
-        return obj.get_likes
+        return obj.likes_count
 
     @staticmethod
     def get_dislikes(obj):
-        return obj.get_dislikes
+        return obj.dislikes_count
 
     @staticmethod
     def get_email(obj):
@@ -117,30 +124,33 @@ class CafesSerializer(serializers.ModelSerializer):
         return str(location_hash_convert.latitude) + "," + str(location_hash_convert.longitude)
 
     @staticmethod
-    def get_opening_time(obj):
+    def get_current_week_time(obj):
+        # week_time is prefetched by Cafe.objects.with_listing_data(), so this stays in memory
+        current_week_day = get_current_week_day()
         if current_week_day:
-            week_time_for_cafe = user_models.WeekTime.objects.filter(cafe=obj)
-            week_time_instance = week_time_for_cafe.filter(day=current_week_day).values('opening_time')
-            if week_time_instance.exists():
-                return week_time_instance.first().get('opening_time')
-            else:
-                return None
+            for week_time in obj.week_time.all():
+                if week_time.day == current_week_day:
+                    return week_time
         return None
 
-    @staticmethod
-    def get_closing_time(obj):
-        if current_week_day:
-            week_time_for_cafe = user_models.WeekTime.objects.filter(cafe=obj)
-            week_time_instance = week_time_for_cafe.filter(day=current_week_day).values('closing_time')
-            if week_time_instance.exists():
-                return week_time_instance.first().get('closing_time')
-            else:
-                return None
-        return None
+    def get_opening_time(self, obj):
+        week_time = self.get_current_week_time(obj)
+        return week_time.opening_time if week_time else None
+
+    def get_closing_time(self, obj):
+        week_time = self.get_current_week_time(obj)
+        return week_time.closing_time if week_time else None
 
     @staticmethod
     def get_time_graphic(obj):
-        return obj.get_time_graphic()
+        return [
+            {
+                'day': week_time.day,
+                'opening_time': week_time.opening_time,
+                'closing_time': week_time.closing_time,
+            }
+            for week_time in obj.week_time.all()
+        ]
         # return {
         #     'monday': {
         #         'opening_time': '10:00',
@@ -168,9 +178,12 @@ class CafesNearBySerializer(CafesSerializer):
     class Meta:
         model = CafesSerializer.Meta.model
         extra_fields = CafesSerializer.Meta.extra_fields + ['distance', ]
-        exclude = ['user', 'id', ]
+        exclude = CafesSerializer.Meta.exclude
 
     def get_distance(self, obj):
+        if hasattr(obj, 'distance'):
+            # Annotated in km by CafeQueryset.nearby()
+            return obj.distance
         latitude = self.context['view'].request.GET.get('latitude')
         longitude = self.context['view'].request.GET.get('longitude')
 
@@ -209,11 +222,12 @@ class CafesForUserSerializer(CafesSerializer):
     class Meta:
         model = user_models.Cafe
         extra_fields = ['avatar', 'is_bookmarked', ]
-        exclude = ['user', 'id', ]
+        exclude = CafesSerializer.Meta.exclude
 
     def get_is_bookmarked(self, obj):
         phone = self.context['view'].kwargs.get('phone')
-        cafe_in_bookmark = user_models.Bookmarks.objects.filter(user__phone=phone, cafe_id=obj.id)
+        user_id = user_identity.get_user_id_by_phone(phone, self.context.get('request'))
+        cafe_in_bookmark = user_models.Bookmarks.objects.filter(user_id=user_id, cafe_id=obj.id)
         if cafe_in_bookmark.exists():
             return True
         return False
@@ -252,11 +266,11 @@ class ReviewSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_likes(obj):
-        return user_models.ReviewLikeDislike.objects.filter(review=obj, rate=1).count()
+        return obj.likes_count
 
     @staticmethod
     def get_dislikes(obj):
-        return user_models.ReviewLikeDislike.objects.filter(review=obj, rate=-1).count()
+        return obj.dislikes_count
 
     def get_author_avatar(self, obj):
         return obj.author.get_avatar(self.context['request'])
@@ -276,7 +290,8 @@ class ReviewSerializerForUser(ReviewSerializer):
     def get_rated_status(self, obj):
         phone = self.context['view'].kwargs.get('phone')
 
-        review_rated = user_models.ReviewLikeDislike.objects.filter(like_dislike_user__phone=phone, review=obj)
+        user_id = user_identity.get_user_id_by_phone(phone, self.context.get('request'))
+        review_rated = user_models.ReviewLikeDislike.objects.filter(like_dislike_user_id=user_id, review=obj)
         if review_rated.exists():
             return review_rated.first().rate
         return 0
@@ -288,13 +303,13 @@ class ReviewCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = user_models.Review
-        exclude = ['cafe', 'lft', 'rght', 'tree_id', 'level', 'author', ]
+        exclude = ['cafe', 'lft', 'rght', 'tree_id', 'level', 'author', 'likes_count', 'dislikes_count', ]
 
     def create(self, validated_data):
         cafe_id = self.context.get('view').kwargs.get('cafe_id')
         author_phone = validated_data.get('author').get('phone')
         cafe = user_models.Cafe.objects.get(pk=cafe_id)
-        author = User.objects.get(phone=author_phone)
+        author = user_identity.get_user_by_phone(author_phone, self.context.get('request'))
         album = user_models.Album.objects.create(**{
             'owner': author,
             'cafe': cafe
@@ -303,26 +318,27 @@ class ReviewCreateSerializer(serializers.ModelSerializer):
         validated_data['cafe'] = cafe
         validated_data['album'] = album
 
-        instance = super().create(validated_data)
+        # Cafe review counters are updated by the Review signals, in the same transaction as the insert.
+        # The reply push goes to the outbox of that transaction as well.
+        with transaction.atomic():
+            instance = super().create(validated_data)
 
-        if instance.parent:
-            parent_author = instance.parent.author
+            if instance.parent:
+                parent_author = instance.parent.author
 
-            phone = parent_author.phone
-            message = "To your review has been replied"
-            kwargs = dict()
-            kwargs['title'] = "Replied to review"
-            kwargs['notification_sender'] = author.id
-            result = project_modules.send_push_for_topic(phone, message, **kwargs)
-            if result:
-                print('Successfully sent')
-        else:
-            user_models.Notifications.objects.create(**{
-                'title': 'Added new review',
-                'user': cafe.user,
-                'notification_sender': author,
-                'text': 'You have new review from {}'.format(author.get_full_name()),
-            })
+                phone = parent_author.phone
+                message = "To your review has been replied"
+                kwargs = dict()
+                kwargs['title'] = "Replied to review"
+                kwargs['notification_sender'] = author.id
+                project_modules.send_push_for_topic(phone, message, **kwargs)
+            else:
+                user_models.Notifications.objects.create(**{
+                    'title': 'Added new review',
+                    'user': cafe.user,
+                    'notification_sender': author,
+                    'text': 'You have new review from {}'.format(author.get_full_name()),
+                })
         return instance
 
     @staticmethod
@@ -349,14 +365,17 @@ class ReviewLikeDislikeSerializer(serializers.ModelSerializer):
         model = user_models.ReviewLikeDislike
         exclude = ['like_dislike_user', 'review']
 
-        def create(self, validated_data):
-            phone = validated_data.get('like_dislike_user').get('phone')
-            review_id = self.context['view'].kwargs.get('review_id')
-            like_dislike_user = User.objects.get(phone=phone)
-            review = user_models.Review.objects.get(pk=review_id)
-
-            if self.Meta.model.objects.filter(like_dislike_user=like_dislike_user, review=review).exists():
-                instance = self.Meta.model.objects.get(like_dislike_user=like_dislike_user, review=review)
+    def create(self, validated_data):
+        phone = validated_data.get('like_dislike_user').get('phone')
+        review_id = self.context['view'].kwargs.get('review_id')
+        like_dislike_user = user_identity.get_user_by_phone(phone, self.context.get('request'))
+        review = user_models.Review.objects.get(pk=review_id)
+
+        # Review like/dislike counters are moved by the ReviewLikeDislike signals inside this transaction
+        with transaction.atomic():
+            instance = self.Meta.model.objects.select_for_update().filter(like_dislike_user=like_dislike_user,
+                                                                          review=review).first()
+            if instance:
                 instance.rate = validated_data.get('rate')
                 instance.save()
             else:
@@ -378,10 +397,8 @@ class ReviewLikeDislikeSerializer(serializers.ModelSerializer):
                 kwargs['title'] = "user_models.Review was rated"
                 kwargs['notification_sender'] = like_dislike_user.id
 
-                result = project_modules.send_push_for_topic(review_author.phone, message, **kwargs)
-                if result:
-                    print('Successfully sent')
-            return instance
+                project_modules.send_push_for_topic(review_author.phone, message, **kwargs)
+        return instance
 
 
 class CafeLikeDislikeSerializer(serializers.ModelSerializer):
@@ -394,13 +411,14 @@ class CafeLikeDislikeSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         phone = validated_data.get('user').get('phone')
         cafe_id = self.context['view'].kwargs.get('cafe_id')
+        user = user_identity.get_user_by_phone(phone, self.context.get('request'))
 
-        rate_instance, created = user_models.CafeLikeDislike.objects.get_or_create(cafe_id=cafe_id, user__phone=phone,
-                                                                                   defaults={'rate': validated_data.get(
-                                                                                       'rate')})
-        if not created:
-            rate_instance.rate = validated_data.get('rate')
-            rate_instance.save()
+        with transaction.atomic():
+            rate_instance, created = user_models.CafeLikeDislike.objects.select_for_update().get_or_create(
+                cafe_id=cafe_id, user=user, defaults={'rate': validated_data.get('rate')})
+            if not created:
+                rate_instance.rate = validated_data.get('rate')
+                rate_instance.save()
 
         # Todo: Send notification to cafe owner
         return rate_instance
@@ -414,6 +432,37 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'is_top', 'icon', 'parent', 'children', 'svg_icon', ]
 
 
+CATEGORY_TREE_FIELDS = ('id', 'parent_id', 'name', 'is_top', 'icon', 'svg_icon')
+PRODUCT_CATEGORY_TREE_FIELDS = ('id', 'parent_id', 'name', 'icon')
+
+
+def render_category_tree(request):
+    """
+    The nested CategorySerializer payload of every root category, built from one cached query.
+    """
+    model = user_models.Category
+    return trees.build_tree(trees.get_tree_rows(model, CATEGORY_TREE_FIELDS), lambda row: {
+        'id': row['id'],
+        'name': row['name'],
+        'is_top': row['is_top'],
+        'icon': trees.get_file_url(request, model, 'icon', row['icon']),
+        'parent': row['parent_id'],
+        'svg_icon': trees.get_file_url(request, model, 'svg_icon', row['svg_icon']),
+    })
+
+
+def render_product_categories(request):
+    """
+    The ProductCategorySerializer payload of every product category, in tree order.
+    """
+    model = product_models.ProductCategory
+    return [{
+        'id': row['id'],
+        'name': row['name'],
+        'icon': trees.get_file_url(request, model, 'icon', row['icon']),
+    } for row in trees.get_tree_rows(model, PRODUCT_CATEGORY_TREE_FIELDS)]
+
+
 class CategoryTopSerializer(serializers.ModelSerializer):
     class Meta:
         model = user_models.Category
@@ -431,7 +480,7 @@ class BookmarkListSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_cafe_reviews(obj):
-        return obj.cafe.reviews.all().count()
+        return CafesSerializer.get_cafe_reviews(obj.cafe)
 
 
 class BookmarkSerializer(serializers.ModelSerializer):
@@ -667,8 +716,9 @@ class CartModifierSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = order_models.CartModifier
-        fields = ['id', 'count', 'cart', 'modifier__title', 'product',
+        fields = ['id', 'count', 'cart', 'modifier__title', 'product', 'price',
                   'modifier__price', 'modifier__id', 'modifier__category__title','modifier__category__id']
+        read_only_fields = ['price']
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -679,18 +729,17 @@ class CartSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = order_models.Cart
-        fields = ['id', 'product__title', 'count', 'modifiers', 'product', 'free_count', 'product__price']
+        fields = ['id', 'product__title', 'count', 'modifiers', 'product', 'size', 'price', 'free_count',
+                  'product__price']
         extra_fields = ['free_count']
+        read_only_fields = ['price']
 
     @staticmethod
     def get_modifiers(obj):
-        cart_modifier = order_models.CartModifier.objects.filter(cart_id=obj.id)
+        # Uses the modifiers prefetched by Order.objects.with_feed_data() when present
+        cart_modifier = obj.modifiers.all()
         if cart_modifier:
-            serializer = CartModifierSerializer(cart_modifier, many=True)
-            if serializer:
-                # return cart_modifier.values_list('id')
-                return serializer.data
-                # return cart_modifier
+            return CartModifierSerializer(cart_modifier, many=True).data
         return None
 
 
@@ -738,7 +787,7 @@ class OrderSerializer(serializers.ModelSerializer):
     def get_cafe_logo(self, obj):
 
         try:
-            root_settings = user_models.CafeGeneralSettings.objects.get(owner_id=obj.cafe.user_id)
+            root_settings = obj.cafe.user.settings
             request = self.context['request']
             file = request.build_absolute_uri(root_settings.logo.url)
         except (ValueError, AttributeError):
@@ -783,86 +832,20 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         model = order_models.Order
         fields = ['id', 'created', 'tax_total', 'total_price', 'sub_total_price', 'cart_items', 'cafe', 'pre_order',
                   'pre_order_date', ]
+        # Totals are computed from the cafe menu, whatever the client sends
+        read_only_fields = ['tax_total', 'total_price', 'sub_total_price']
 
     def create(self, validated_data):
-        cart_items = validated_data.pop('cart_items')
+        validated_data.pop('cart_items', None)
         phone = self.context['view'].kwargs['phone']
-        data_cart_items = self.initial_data.get('cart_items')
-
-        customer = User.objects.get(phone=phone)
-        validated_data['customer'] = customer
-        order = order_models.Order.objects.create(**validated_data)
-        cafe = order.cafe
-        total_count = 0
-
-        for cart_item in data_cart_items:
-            product = cart_item['product']
-            cart_item['order'] = order
-            cart_item_total_count = cart_item['count']
-            free_items_count = cart_item.pop('free_count')
-            paid_items_count = cart_item_total_count - free_items_count
-
-            if paid_items_count:
-                paid_cart_item = order_models.Cart()
-                paid_cart_item.order = order
-                paid_cart_item.count = paid_items_count
-                paid_cart_item.is_free = False
-                paid_cart_item.product_id = product
-                # paid_cart_item.price = paid_items_count * product.price
-                paid_cart_item.save()
-                modifiers = cart_item['modifiers']
-                for modifier_item in modifiers:
-                    modifier = order_models.CartModifier()
-                    modifier.product_id = product
-                    # modifier.price = product
-                    modifier.order = order
-                    modifier.modifier_id = modifier_item
-                    modifier.cart = paid_cart_item
-                    modifier.count = paid_items_count
-                    modifier.save()
-
-                # sub_total_price += paid_cart_item.price
-                total_count += paid_cart_item.count
-
-            if free_items_count:
-                free_cart_item = order_models.Cart()
-                free_cart_item.order = order
-                free_cart_item.count = free_items_count
-                free_cart_item.is_free = True
-                free_cart_item.product_id = product
-                free_cart_item.price = 0
-                free_cart_item.save()
-                modifiers = cart_item['modifiers']
-                for modifier_item in modifiers:
-                    modifier = order_models.CartModifier()
-                    modifier.product_id = product
-                    # modifier.price = product
-                    modifier.order = order
-                    modifier.modifier_id = modifier_item
-                    modifier.cart = free_cart_item
-                    modifier.count = free_items_count
-                    modifier.save()
-                free_items = user_models.FreeItem.objects.filter(owner=customer,
-                                                                 root_cafe=cafe.user.settings,
-                                                                 status=user_models.FreeItem.VALID
-                                                                 ).order_by('pk')[0:free_items_count]
-                free_items_pk_list = free_items.values_list('pk', flat=True)
-                free_items_list = user_models.FreeItem.objects.select_for_update().filter(
-                    pk__in=free_items_pk_list).update(product=product, status=user_models.FreeItem.REDEEMED)
-
-        # tax_total = total_price * tax_rate / 100
-        # total_price = sub_total_price + tax_total
-        # order.total_price = total_price
-        # order.sub_total_price = sub_total_price
-        # order.tax_total = tax_total
-        order.save()
-        inviter = getattr(customer, 'inviter', None)
-        if inviter:
-            if inviter.given_free_item is False:
-                user_models.FreeItem(owner=inviter.inviter).save()
-                customer.inviter.given_free_item = True
-                customer.inviter.save()
+        data_cart_items = self.initial_data.get('cart_items') or []
 
+        customer = user_identity.get_user_by_phone(phone, self.context.get('request'))
+        try:
+            order = order_assembly.create_order(customer, data_cart_items, **validated_data)
+        except (order_assembly.OrderAssemblyError, order_pricing.PricingError) as e:
+            raise serializers.ValidationError({'cart_items': [str(e)]})
+        transaction.on_commit(lambda: order_events.publish_order_event(order, order_events.CREATED))
         return order
 
 
@@ -909,10 +892,15 @@ class OrderUpdateSerializer(serializers.ModelSerializer):
         fields = ['state', ]
 
     def update(self, instance, validated_data):
-        if validated_data['state'] == self.Meta.model.READY:
-            project_modules.send_push_for_topic(phone=instance.customer.phone, message='Your order is ready',
-                                                tag='order_ready')
-        super().update(instance=instance, validated_data=validated_data)
+        state_changed = validated_data.get('state', instance.state) != instance.state
+        with transaction.atomic():
+            if validated_data['state'] == self.Meta.model.READY:
+                project_modules.send_push_for_topic(phone=instance.customer.phone, message='Your order is ready',
+                                                    tag='order_ready')
+            super().update(instance=instance, validated_data=validated_data)
+            if state_changed:
+                transaction.on_commit(
+                    lambda: order_events.publish_order_event(instance, order_events.STATE_CHANGED))
         return instance
 
 
@@ -990,7 +978,7 @@ class UsersPointSerializer(serializers.ModelSerializer):
     def get_total_point(self, obj):
         cafe_id = self.context['view'].kwargs.get('cafe_id')
         cafe = user_models.Cafe.objects.get(pk=cafe_id)
-        return obj.points.filter(root_cafe__owner_id=cafe.user_id).aggregate(Sum('point_count'))['point_count__sum']
+        return user_points.get_balance(obj.id, cafe.user_id)
 
     def get_free_items(self, obj):
         cafe_id = self.context['view'].kwargs.get('cafe_id')
@@ -1030,14 +1018,15 @@ class UserExchangedProductsSerializer(serializers.ModelSerializer):
     def get_products(self, obj):
         phone = self.context['view'].kwargs.get('phone')
         status = self.context['request'].GET.get('status', user_models.FreeItem.VALID)
-        free_items = user_models.FreeItem.objects.filter(owner__phone=phone, root_cafe__owner=obj, status=status)
+        customer_id = user_identity.get_user_id_by_phone(phone, self.context.get('request'))
+        free_items = user_models.FreeItem.objects.filter(owner_id=customer_id, root_cafe__owner=obj, status=status)
         serializer = CafePointsExchangedProductsSerializer(many=True, instance=free_items)
         return serializer.data
 
     def get_points(self, obj):
         phone = self.context['view'].kwargs.get('phone')
-        points = user_models.Point.objects.filter(owner__phone=phone, root_cafe__owner=obj)
-        return points.aggregate(total=Sum('point_count')).get('total')
+        customer_id = user_identity.get_user_id_by_phone(phone, self.context.get('request'))
+        return user_points.get_balance(customer_id, obj.id) if customer_id else None
 
     def get_logo(self, obj):
         try:
@@ -1077,7 +1066,8 @@ class CustomerFreeItemsSerializer(serializers.ModelSerializer):
 
     def get_points(self, obj):
         phone = self.context['view'].kwargs.get('phone')
-        points = user_models.Point.objects.filter(owner__phone=phone)
+        points = user_models.Point.objects.filter(
+            owner_id=user_identity.get_user_id_by_phone(phone, self.context.get('request')))
         return points.aggregate(total=Sum('point_count')).get('total')
 
 
@@ -1087,8 +1077,17 @@ class FreeItemSerializer(serializers.ModelSerializer):
         fields = ['status', ]
 
     def update(self, instance, validated_data):
-        if validated_data['status'] == self.Meta.model.REDEEMED:
-            project_modules.send_push_for_topic(phone=instance.owner.phone, message='Your free item was redeemed',
-                                                tag='free_item_redeemed')
-        super().update(instance=instance, validated_data=validated_data)
+        with transaction.atomic():
+            if validated_data['status'] == self.Meta.model.REDEEMED:
+                project_modules.send_push_for_topic(phone=instance.owner.phone, message='Your free item was redeemed',
+                                                    tag='free_item_redeemed')
+            super().update(instance=instance, validated_data=validated_data)
         return instance
+
+
+class PaymentIntentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = payment_models.PaymentIntent
+        fields = ['id', 'order', 'gateway', 'status', 'amount', 'charge_id', 'error_message', 'created_at',
+                  'updated_at', ]
+        read_only_fields = fields
@@ -0,0 +1,124 @@
+"""
+In-process prefix index of active cafe names for cafes/suggest/.
+
+Every word of every name goes into one sorted array, so the cafes having a word that starts with a prefix
+are a bisect range of it. Cafes are numbered by popularity, most popular first, and candidates are kept in
+that order. Prefixes of one or two letters would cover large ranges, so their candidates are precomputed.
+Without a location the scan stops at the first `limit` matches; with one, every match is ranked by distance
+before the limit is applied, so close but less popular cafes are not cut off. Each process keeps its own
+index and rebuilds it when the version in the shared cache, bumped on Cafe and Category changes, differs
+from the one it was built for.
+"""
+import heapq
+import re
+import time
+from bisect import bisect_left
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import F
+
+from apps.users import models as user_models
+from apps.users.managers import get_distance
+from apps.restapp import caching
+
+SUGGEST_VERSION_CACHE_KEY = 'cafe_suggest:version'
+# The shared version is read at most once per interval, so a lookup normally touches no cache at all
+SUGGEST_VERSION_CHECK_INTERVAL = getattr(settings, 'SUGGEST_VERSION_CHECK_INTERVAL', 1)
+SHORT_PREFIX_LENGTH = 2
+# With a location, closer rings of this width in km come first, the most popular cafes first within a ring
+SUGGEST_DISTANCE_STEP = getattr(settings, 'SUGGEST_DISTANCE_STEP', 1)
+
+WORD_RE = re.compile(r'\w+')
+
+
+def get_words(text):
+    return WORD_RE.findall(text.lower())
+
+
+class CafeNameIndex(object):
+
+    def __init__(self, cafes):
+        # `cafes` in popularity order, their position is their rank
+        self.cafes = cafes
+        self.cafe_words = [set(get_words(cafe['cafe_name'])) for cafe in cafes]
+        pairs = sorted((word, rank) for rank, words in enumerate(self.cafe_words) for word in words)
+        self.words = [word for word, rank in pairs]
+        self.ranks = [rank for word, rank in pairs]
+        self.short_prefixes = {}
+        for word, rank in pairs:
+            for length in range(1, min(len(word), SHORT_PREFIX_LENGTH) + 1):
+                self.short_prefixes.setdefault(word[:length], set()).add(rank)
+        self.short_prefixes = {prefix: sorted(ranks) for prefix, ranks in self.short_prefixes.items()}
+
+    def get_candidates(self, prefix):
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            return self.short_prefixes.get(prefix, [])
+        start = bisect_left(self.words, prefix)
+        end = bisect_left(self.words, prefix + '\uffff', start)
+        return sorted(set(self.ranks[start:end]))
+
+    def suggest(self, text, limit, location=None):
+        """
+        Cafes with a word starting with each word of `text`, most popular first, or closest first with a location.
+        """
+        prefixes = get_words(text)
+        if not prefixes:
+            return []
+        ranks = self.get_candidates(max(prefixes, key=len))
+        matches = (
+            rank for rank in ranks
+            if all(any(word.startswith(prefix) for word in self.cafe_words[rank]) for prefix in prefixes)
+        )
+        if location is None:
+            matches = islice(matches, limit)
+        else:
+            matches = heapq.nsmallest(limit, matches, key=lambda rank: (self.get_ring(rank, location), rank))
+        return [self.cafes[rank]['suggestion'] for rank in matches]
+
+    def get_ring(self, rank, location):
+        cafe = self.cafes[rank]
+        if cafe['latitude'] is None or cafe['longitude'] is None:
+            return float('inf')
+        return int(get_distance(location[0], location[1], cafe['latitude'], cafe['longitude']) //
+                   SUGGEST_DISTANCE_STEP)
+
+
+def build_index():
+    cafes = user_models.Cafe.objects.filter(status=user_models.Cafe.ACTIVE).annotate(
+        popularity=F('reviews_count') + F('likes_count')
+    ).order_by('-popularity', 'pk').values('pk', 'cafe_name', 'category_id', 'category__name', 'latitude',
+                                          'longitude')
+    return CafeNameIndex([
+        dict(cafe, suggestion={
+            'id': cafe['pk'],
+            'cafe_name': cafe['cafe_name'],
+            'category': {'id': cafe['category_id'], 'name': cafe['category__name']},
+        })
+        for cafe in cafes
+    ])
+
+
+def get_version():
+    return caching.get_key_version(SUGGEST_VERSION_CACHE_KEY)
+
+
+# (version, index, time the version was last checked) of this process
+_index_state = (None, None, 0)
+
+
+def get_index():
+    global _index_state
+    version, index, checked_at = _index_state
+    now = time.monotonic()
+    if index is not None and now - checked_at < SUGGEST_VERSION_CHECK_INTERVAL:
+        return index
+    current_version = get_version()
+    if index is None or current_version != version:
+        index = build_index()
+    _index_state = (current_version, index, now)
+    return index
+
+
+def invalidate_index():
+    caching.bump_key_versions([SUGGEST_VERSION_CACHE_KEY])
@@ -1,3 +1,438 @@
-from django.test import TestCase
+import json
+from urllib.parse import parse_qs, urlparse
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.urls import resolve
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIRequestFactory
+
+from project import metrics as project_metrics
+from project import search as project_search
+from project.testing import QueryCountAssertionsMixin
+
+from apps.users import models as user_models
+from apps.products import models as product_models
+from apps.modifiers import models as modifier_models
+from apps.orders import models as order_models
+from apps.products import menus as product_menus
+from apps.restapp import views as rest_views
+from apps.restapp import serializers as rest_serializers
+from apps.restapp import suggestions
+
+
+class CafesListQueryCountTest(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.category = user_models.Category.objects.create(name='Coffee')
+        self.owner = user_models.User.objects.create_user(phone='100000000', password='secret',
+                                                          user_type=user_models.User.OWNER)
+        user_models.CafeGeneralSettings.objects.create(owner=self.owner, cafe_name='Owner settings')
+
+    def create_cafes(self, count):
+        for index in range(count):
+            cafe = user_models.Cafe.objects.create(user=self.owner, cafe_name='Cafe {}'.format(index),
+                                                   category=self.category, description='', call_center='1',
+                                                   status=user_models.Cafe.ACTIVE, tax_rate=0)
+            for day, title in user_models.WEEK_DAYS:
+                user_models.WeekTime.objects.create(cafe=cafe, day=day, opening_time='09:00',
+                                                    closing_time='18:00')
+            user_models.Review.objects.create(author=self.owner, cafe=cafe, comment='Good', rate=1)
+
+    def test_cafes_query_count_does_not_grow_with_page_size(self):
+        view = rest_views.CafesView.as_view()
+        self.assertQueryCountDoesNotGrow(lambda: view(self.factory.get('/')), self.create_cafes)
+
+    def test_related_cafes_query_count_does_not_grow_with_page_size(self):
+        view = rest_views.CafesRelatedView.as_view()
+        self.create_cafes(1)
+        cafe_id = user_models.Cafe.objects.first().pk
+        self.assertQueryCountDoesNotGrow(lambda: view(self.factory.get('/'), cafe_id=cafe_id), self.create_cafes)
+
+
+class OrderFeedQueryCountTest(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        category = user_models.Category.objects.create(name='Coffee')
+        owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        user_models.CafeGeneralSettings.objects.create(owner=owner, cafe_name='Owner settings')
+        self.cafe = user_models.Cafe.objects.create(user=owner, cafe_name='Cafe', category=category, description='',
+                                                    call_center='1', status=user_models.Cafe.ACTIVE, tax_rate=0)
+        self.cashier = user_models.User.objects.create_user(phone='100000002', password='secret')
+        user_models.Cashier.objects.create(cafe=self.cafe, cashier=self.cashier)
+        self.customer = user_models.User.objects.create_user(phone='100000003', password='secret')
+        modifier_category = modifier_models.ModifierCategory.objects.create(title='Milk', owner=owner)
+        self.modifier = modifier_models.Modifier.objects.create(title='Oat milk', price=1, owner=owner,
+                                                                category=modifier_category)
+        self.product = product_models.Product.objects.create(title='Latte', description='', owner=owner, price=3,
+                                                             modifier=modifier_category)
+
+    def create_orders(self, count):
+        for index in range(count):
+            order = order_models.Order.objects.create(customer=self.customer, cafe=self.cafe)
+            cart = order_models.Cart.objects.create(order=order, product=self.product, count=1)
+            order_models.CartModifier.objects.create(cart=cart, order=order, product=self.product,
+                                                     modifier=self.modifier, count=1)
+
+    def test_cashier_orders_query_count_does_not_grow_with_orders(self):
+        view = rest_views.CashierOrdersListView.as_view()
+        self.assertQueryCountDoesNotGrow(lambda: view(self.factory.get('/'), phone=self.cashier.phone),
+                                         self.create_orders)
+
+    def test_customer_orders_query_count_does_not_grow_with_orders(self):
+        view = rest_views.UserOrdersView.as_view()
+        self.assertQueryCountDoesNotGrow(lambda: view(self.factory.get('/'), phone=self.customer.phone),
+                                         self.create_orders)
+
+
+class CatalogCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.owner = user_models.User.objects.create_user(phone='100000001', password='secret')
+        user_models.News.objects.create(owner=self.owner, title='Opening', content='Come by')
+        self.view = rest_views.NewsView.as_view()
+
+    def get(self, **headers):
+        response = self.view(self.factory.get('/news/', **headers))
+        response.render()
+        return response
+
+    def test_unchanged_news_are_served_from_cache_and_revalidated(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            cached = self.get()
+            not_modified = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+
+class CatalogCacheInvalidationTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        user_models.Category.objects.create(name='Coffee')
+        self.view = rest_views.CategoryView.as_view()
+
+    def get(self, **headers):
+        response = self.view(self.factory.get('/categories/', **headers))
+        response.render()
+        return response
+
+    def test_saving_a_category_changes_the_etag(self):
+        first = self.get()
+        user_models.Category.objects.create(name='Tea')
+        changed = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertIn(b'Tea', changed.content)
+
+
+class CategoryTreeTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        coffee = user_models.Category.objects.create(name='Coffee')
+        espresso = user_models.Category.objects.create(name='Espresso', parent=coffee)
+        user_models.Category.objects.create(name='Ristretto', parent=espresso)
+        user_models.Category.objects.create(name='Tea')
+
+    def test_tree_is_built_from_one_query(self):
+        with self.assertNumQueries(1):
+            response = rest_views.CategoryView.as_view()(self.factory.get('/categories/'))
+        self.assertEqual(response.status_code, 200)
+        categories = response.data['results'] if 'results' in response.data else response.data
+
+        def names(nodes):
+            return [(node['name'], names(node['children'])) for node in nodes]
+
+        self.assertEqual(names(categories), [('Coffee', [('Espresso', [('Ristretto', [])])]), ('Tea', [])])
+
+
+class CafeMenuTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        category = user_models.Category.objects.create(name='Coffee')
+        owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        drinks = product_models.ProductCategory.objects.create(name='Drinks')
+        user_models.CafeGeneralSettings.objects.create(owner=owner, cafe_name='Owner settings',
+                                                       exchangeable_product=drinks)
+        self.cafe = user_models.Cafe.objects.create(user=owner, cafe_name='Cafe', category=category, description='',
+                                                    call_center='1', status=user_models.Cafe.ACTIVE, tax_rate=0)
+        milk = modifier_models.ModifierCategory.objects.create(title='Milk', owner=owner)
+        modifier_models.Modifier.objects.create(title='Oat milk', price=1, owner=owner, category=milk)
+        for index in range(5):
+            product = product_models.Product.objects.create(title='Latte {}'.format(index), description='Hot',
+                                                            owner=owner, price=3, modifier=milk,
+                                                            category=drinks if index % 2 else None)
+            product_models.Size.objects.create(title='Large', price=4, product=product)
+            product_models.ProductImage.objects.create(product=product)
+            product_models.ProductModifier.objects.create(product=product, modifier=milk)
+            product_models.CafeMeals.objects.create(cafe=self.cafe, product=product)
+
+    def test_compiled_menu_matches_the_product_serializer(self):
+        request = self.factory.get('/')
+        products = product_models.Product.objects.filter(cafes__cafe_id=self.cafe.pk).order_by('pk')
+        serialized = rest_serializers.ProductSerializer(products, many=True, context={'request': request}).data
+        self.assertEqual(product_menus.compile_menu(self.cafe.pk, request), json.loads(json.dumps(serialized)))
+
+    def test_menu_is_served_from_cache(self):
+        view = rest_views.CafeProductsView.as_view()
+        with self.assertNumQueries(7):
+            view(self.factory.get('/'), cafe_id=self.cafe.pk)
+        with self.assertNumQueries(0):
+            response = view(self.factory.get('/', {'search': 'latte 3'}), cafe_id=self.cafe.pk)
+        products = response.data['results'] if 'results' in response.data else response.data
+        self.assertEqual([product['title'] for product in products], ['Latte 3'])
+
+    def test_menus_are_cached_per_scheme(self):
+        http_menu = product_menus.get_menu(self.cafe.pk, self.factory.get('/'))
+        https_menu = product_menus.get_menu(self.cafe.pk, self.factory.get('/', secure=True))
+        self.assertTrue(http_menu[0]['images'][0]['src'].startswith('http://'))
+        self.assertTrue(https_menu[0]['images'][0]['src'].startswith('https://'))
+
+
+class CafeSearchTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        category = user_models.Category.objects.create(name='Bakery')
+        owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        user_models.CafeGeneralSettings.objects.create(owner=owner, cafe_name='Owner settings')
+        for name, description in (('Golden Roastery', '<p>Single origin beans</p>'),
+                                  ('Corner Cafe', '<p>Fresh <strong>roastery</strong> coffee</p>'),
+                                  ('Tea House', '<span class="roastery">Loose leaf tea</span>')):
+            user_models.Cafe.objects.create(user=owner, cafe_name=name, category=category, description=description,
+                                            call_center='1', status=user_models.Cafe.ACTIVE, tax_rate=0)
+
+    def search(self, text):
+        response = rest_views.CafesView.as_view()(self.factory.get('/', {'search': text}))
+        self.assertEqual(response.status_code, 200)
+        cafes = response.data['results'] if 'results' in response.data else response.data
+        return [cafe['cafe_name'] for cafe in cafes]
+
+    def test_matches_are_ranked_and_html_is_not_indexed(self):
+        # The name outranks the description, and attribute values of tags are not searchable
+        self.assertEqual(self.search('roastery'), ['Golden Roastery', 'Corner Cafe'])
+
+    def test_misspelt_name_matches_by_similarity(self):
+        self.assertEqual(self.search('Golden Rostery'), ['Golden Roastery'])
+
+    def test_category_name_is_searchable(self):
+        self.assertEqual(len(self.search('bakery')), 3)
+
+
+class ProductSearchPagingTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        milk = modifier_models.ModifierCategory.objects.create(title='Milk', owner=owner)
+        # Tied ranks from identical rows, and fractional ones from names and descriptions of varying length
+        products = [('Latte', 'Hot')] * 4 + [
+            ('Iced Latte', 'Cold'), ('Latte Macchiato', 'Layered latte'), ('Oat Latte', 'With oat milk'),
+            ('Flat White', 'Like a small latte'), ('Vanilla Latte Grande', 'Sweet latte with syrup'),
+        ]
+        for title, description in products:
+            product_models.Product.objects.create(title=title, description=description, owner=owner, price=3,
+                                                  modifier=milk)
+
+    def get_page(self, cursor=None):
+        params = {'search': 'latte', 'page_size': 2}
+        if cursor:
+            params['cursor'] = cursor
+        response = rest_views.ProductsView.as_view()(self.factory.get('/', params))
+        self.assertEqual(response.status_code, 200)
+        next_cursor = None
+        if response.data['next']:
+            next_cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+        return [product['id'] for product in response.data['results']], next_cursor
+
+    def test_pages_neither_repeat_nor_skip_ranked_rows(self):
+        seen, cursor = self.get_page()
+        while cursor:
+            ids, cursor = self.get_page(cursor)
+            seen += ids
+        expected = list(project_search.search(product_models.Product.objects.all(), 'latte', 'title')
+                        .order_by('-search_rank', '-id').values_list('pk', flat=True))
+        self.assertEqual(len(expected), 9)
+        self.assertEqual(seen, expected)
+
+
+class CafeSuggestTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        suggestions._index_state = (None, None, 0)
+        self.factory = APIRequestFactory()
+        category = user_models.Category.objects.create(name='Coffee')
+        owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        for name, likes, location in (('Golden Roastery', 1, (51.5, -0.1)), ('Golden Gate Cafe', 9, (48.8, 2.3)),
+                                      ('Rose Garden', 5, (51.5, -0.1))):
+            user_models.Cafe.objects.create(user=owner, cafe_name=name, category=category, description='',
+                                            call_center='1', status=user_models.Cafe.ACTIVE, tax_rate=0,
+                                            likes_count=likes, location=location)
+        self.view = rest_views.CafeSuggestView.as_view()
+
+    def suggest(self, **params):
+        response = self.view(self.factory.get('/cafes/suggest/', params))
+        self.assertEqual(response.status_code, 200)
+        return [cafe['cafe_name'] for cafe in response.data]
+
+    def test_prefixes_of_any_word_match_by_popularity(self):
+        self.assertEqual(self.suggest(q='go'), ['Golden Gate Cafe', 'Golden Roastery'])
+        self.assertEqual(self.suggest(q='ro'), ['Rose Garden', 'Golden Roastery'])
+        self.assertEqual(self.suggest(q='gold roa'), ['Golden Roastery'])
+
+    def test_location_puts_closer_cafes_first(self):
+        self.assertEqual(self.suggest(q='golden', latitude=51.5, longitude=-0.1),
+                         ['Golden Roastery', 'Golden Gate Cafe'])
+
+    def test_short_prefix_with_location_ranks_every_match_by_distance(self):
+        index = suggestions.CafeNameIndex([
+            {'cafe_name': 'Grill {}'.format(rank), 'latitude': 48.8, 'longitude': 2.3, 'suggestion': rank}
+            for rank in range(600)
+        ] + [{'cafe_name': 'Green Room', 'latitude': 51.5, 'longitude': -0.1, 'suggestion': 'near'}])
+        self.assertEqual(index.suggest('gr', 1, location=(51.5, -0.1)), ['near'])
+        self.assertEqual(index.suggest('gr', 2), [0, 1])
+
+    def test_lookups_after_the_first_need_no_query(self):
+        self.suggest(q='golden')
+        with self.assertNumQueries(0):
+            self.suggest(q='golden')
+
+
+class NearbyCafesTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        category = user_models.Category.objects.create(name='Coffee')
+        owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        user_models.CafeGeneralSettings.objects.create(owner=owner, cafe_name='Owner settings')
+        for name, latitude in (('Far', 51.52), ('Near', 51.5), ('Middle', 51.51)):
+            user_models.Cafe.objects.create(user=owner, cafe_name=name, category=category, description='',
+                                            call_center='1', status=user_models.Cafe.ACTIVE, tax_rate=0,
+                                            location=(latitude, -0.1))
+
+    def get(self, **params):
+        params = dict({'distance': 50, 'latitude': 51.5, 'longitude': -0.1}, **params)
+        return rest_views.CafesNearByView.as_view()(self.factory.get('/cafes/nearby/', params))
+
+    def get_names(self, **params):
+        response = self.get(**params)
+        self.assertEqual(response.status_code, 200)
+        cafes = response.data['results'] if 'results' in response.data else response.data
+        return [cafe['cafe_name'] for cafe in cafes]
+
+    def test_limit_keeps_the_closest_cafes(self):
+        self.assertEqual(self.get_names(limit=2), ['Near', 'Middle'])
+
+    def test_bad_numbers_are_rejected(self):
+        self.assertEqual(self.get(limit='ten').status_code, 400)
+        self.assertEqual(self.get(limit=0).status_code, 400)
+        self.assertEqual(self.get(limit=-3).status_code, 400)
+        self.assertEqual(self.get(latitude='north').status_code, 400)
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = user_models.User.objects.create_user(phone='100000001', password='secret')
+        user_models.Notifications.objects.bulk_create([
+            user_models.Notifications(user=self.user, title='Notification {}'.format(index), text='')
+            for index in range(30)
+        ])
+        self.view = rest_views.UserNotificationsView.as_view()
+
+    def get(self, url):
+        request = self.factory.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.view(request, phone=self.user.phone)
+        self.assertEqual(response.status_code, 200)
+        return response, context.captured_queries
+
+    def test_pages_follow_the_cursor_without_counting(self):
+        first, first_queries = self.get('/?page_size=20')
+        second, second_queries = self.get(first.data['next'])
+        titles = [notification['title'] for notification in first.data['results'] + second.data['results']]
+        self.assertEqual(titles, ['Notification {}'.format(index) for index in reversed(range(30))])
+        self.assertIsNone(second.data['next'])
+        self.assertNotIn('count', first.data)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in first_queries + second_queries))
+
+    def test_page_size_is_capped(self):
+        response, queries = self.get('/?page_size=100000')
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertTrue(any('LIMIT 101' in query['sql'] for query in queries))
+
+
+class QueryMetricsMiddlewareTest(TestCase):
+
+    def setUp(self):
+        project_metrics.store.clear()
+        self.users = [user_models.User.objects.create_user(phone='10000000{}'.format(index), password='secret')
+                      for index in range(3)]
+
+    def get_response(self, request):
+        request.resolver_match = resolve('/api/v1/news/')
+        for user in self.users:
+            user_models.User.objects.filter(pk=user.pk).exists()
+        return HttpResponse('ok')
+
+    def test_repeated_queries_are_recorded_per_view(self):
+        middleware = project_metrics.QueryMetricsMiddleware(self.get_response)
+        middleware(RequestFactory().get('/api/v1/news/'))
+        metrics = project_metrics.store.render()
+        self.assertIn('api_sql_queries_sum{view="rest_api_urls:news",', metrics)
+        self.assertIn('api_response_bytes_count{view="rest_api_urls:news",', metrics)
+        duplicates = [line for line in metrics.splitlines() if line.startswith('api_duplicate_queries_total{')]
+        self.assertEqual(len(duplicates), 1)
+        self.assertTrue(duplicates[0].endswith(' 2'))
+        self.assertIn('= ?', duplicates[0])
+
+    def test_serializer_time_is_recorded_for_timed_views(self):
+        def get_response(request):
+            request.resolver_match = resolve('/api/v1/clients/')
+            return rest_views.UserListView.as_view()(request)
+
+        middleware = project_metrics.QueryMetricsMiddleware(get_response)
+        middleware(RequestFactory().get('/api/v1/clients/'))
+        sums = [line for line in project_metrics.store.render().splitlines()
+                if line.startswith('api_serializer_seconds_sum{view="rest_api_urls:clients",')]
+        self.assertEqual(len(sums), 1)
+        self.assertGreater(float(sums[0].rsplit(' ', 1)[1]), 0)
+
+    def test_metrics_need_staff_or_the_token(self):
+        def get_metrics(user, **headers):
+            request = RequestFactory().get('/metrics/', **headers)
+            request.user = user
+            return project_metrics.metrics_view(request)
+
+        user = self.users[0]
+        self.assertEqual(get_metrics(AnonymousUser(), REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(get_metrics(user).status_code, 403)
+        with mock.patch.object(project_metrics, 'METRICS_TOKEN', 'scrape-token'):
+            self.assertEqual(get_metrics(AnonymousUser(), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(get_metrics(AnonymousUser(), HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+        user.is_staff = True
+        self.assertEqual(get_metrics(user).status_code, 200)
@@ -0,0 +1,59 @@
+"""
+In-memory rendering of MPTT trees.
+
+A whole tree model is read in one query ordered by (tree_id, lft), so every parent comes before its
+children and the nested payload is assembled in a single pass, without a get_children() query per node.
+The rows are cached until a node of the model is saved, moved or deleted.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+TREE_CACHE_KEY = 'tree:{}'
+TREE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_tree_cache_key(model):
+    return TREE_CACHE_KEY.format(model._meta.label_lower)
+
+
+def get_tree_rows(model, fields):
+    """
+    All nodes of `model` as value dicts in tree order. `fields` must include 'id' and 'parent_id'.
+    """
+    key = get_tree_cache_key(model)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(model._default_manager.order_by('tree_id', 'lft').values(*fields))
+        cache.set(key, rows, TREE_CACHE_TIMEOUT)
+    return rows
+
+
+def build_tree(rows, render_node):
+    """
+    Nest `rows` (in tree order) under their parents. `render_node` turns a row into its payload,
+    which gets a 'children' list. Returns the payloads of the root nodes.
+    """
+    roots = []
+    nodes = {}
+    for row in rows:
+        node = render_node(row)
+        node['children'] = []
+        nodes[row['id']] = node
+        parent = nodes.get(row['parent_id'])
+        (parent['children'] if parent else roots).append(node)
+    return roots
+
+
+def get_file_url(request, model, field_name, name):
+    """
+    Absolute URL of a stored file, as a FileField serializer would render it.
+    """
+    if not name:
+        return None
+    url = model._meta.get_field(field_name).storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def invalidate_tree(model):
+    key = get_tree_cache_key(model)
+    transaction.on_commit(lambda: cache.delete(key))
@@ -1 +1 @@
-from django.conf.urls import urlfrom apps.restapp import views as rest_viewsurlpatterns = [    url(r'^categories/$', rest_views.CategoryView.as_view(), name='categories'),    url(r'^categories/top/$', rest_views.CategoryTopView.as_view(), name='top_categories'),    url(r'^news/$', rest_views.NewsView.as_view(), name='news'),    url(r'^news/(?P<news_id>[\d]+)/$', rest_views.NewsDetailView.as_view(), name='news_detail'),    url(r'^cafes/$', rest_views.CafesView.as_view(), name='cafes'),    url(r'^cafes/nearby/$', rest_views.CafesNearByView.as_view(), name='cafes_nearby'),    url(r'^cafes/nearby/(?P<phone>[\d]+)/$', rest_views.CafesNearByForUserView.as_view(), name='cafes_nearby_for_user'),    url(r'^cafes/(?P<cafe_id>[\d]+)/$', rest_views.CafeDetailView.as_view(), name='cafe_detail'),    url(r'^cafes/(?P<cafe_id>[\d]+)/related/$', rest_views.CafesRelatedView.as_view(), name='cafe_related'),    url(r'^cafes/(?P<cafe_id>[\d]+)/like-dislike/$', rest_views.CafeLikeDislikeView.as_view(),        name='cafe_like_dislike'),    url(r'^cafes/(?P<cafe_id>[\d]+)/products/$', rest_views.CafeProductsView.as_view(), name='cafe_products'),    url(r'^cafes/(?P<cafe_id>[\d]+)/(?P<phone>[\d]+)/$', rest_views.CafeDetailForUserView.as_view(),        name='cafe_detail_for_user'),    url(r'^cafes/(?P<cafe_id>[\d]+)/(?P<phone>[\d]+)/free-items/$',        rest_views.UserFreeItemsForCashierView.as_view(), name='user_free_items_for_cashier'),    url(r'^cafes/(?P<cafe_id>[\d]+)/files/$', rest_views.CafeFilesView.as_view(), name='cafe_files'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/$', rest_views.CafeReviewView.as_view(), name='cafe_reviews'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/for/user/(?P<phone>[\d]+)/$',        rest_views.CafeReviewForUserView.as_view(),        name='cafe_reviews_for_user'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/create/$', rest_views.CafeReviewCreateView.as_view(),        name='cafe_review_create'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/$', rest_views.CafeReviewRUD.as_view(),        name='cafe_review_rud'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/like-dislike/$',        rest_views.ReviewLikeDislikeView.as_view(), name='cafe_review_like_dislike'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/like-dislike/all/$',        rest_views.ReviewLikeDislikeAllView.as_view(), name='cafe_review_like_dislike_all'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/files/$', rest_views.ReviewAllFilesView.as_view(),        name='cafe_all_review_files'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/files/$', rest_views.ReviewFilesView.as_view(),        name='cafe_review_files'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/files/upload/$',        rest_views.ReviewFilesUploadView.as_view(), name='cafe_review_files_upload'),    url(r'^cafes/(?P<cafe_id>[\d]+)/points/$', rest_views.CafePointsView.as_view(), name='cafe_points'),    url(r'^cafes/(?P<cafe_id>[\d]+)/points/(?P<phone>[\d]+)/$', rest_views.CafePointsExchangedProductsView.as_view(),        name='cafe_points_exchanged'),    url(r'^clients/$', rest_views.UserListView.as_view(), name='clients'),    url(r'^clients/create/$', rest_views.UserCreateView.as_view(), name='user_create'),    url(r'^clients/(?P<phone>[\d]+)/$', rest_views.UserRetrieveView.as_view(), name='user_detail'),    url(r'^clients/(?P<phone>[\d]+)/reviews/$', rest_views.UserReviewListView.as_view(), name='user_reviews'),    url(r'^clients/(?P<phone>[\d]+)/update/$', rest_views.UserUpdateView.as_view(), name='user_update'),    url(r'^clients/(?P<phone>[\d]+)/password/change/$', rest_views.UserPasswordChangeView.as_view(),        name='password_change'),    url(r'^clients/(?P<phone>[\d]+)/bookmarks/$', rest_views.BookmarkView.as_view(), name='user_bookmarks'),    url(r'^clients/(?P<phone>[\d]+)/bookmarks/create/$', rest_views.BookmarkCreateView.as_view(),        name='user_bookmarks_create'),    url(r'^clients/(?P<phone>[\d]+)/bookmarks/delete/$', rest_views.BookmarkDestroyView.as_view(),        name='user_bookmarks_destroy'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/$', rest_views.UserRecentlyViewedListView.as_view(),        name='user_recently_viewed_list'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/send/$', rest_views.UserRecentlyViewedCreateView.as_view(),        name='user_recently_viewed_send'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/(?P<cafe_id>[\d]+)/delete/$',        rest_views.UserRecentlyViewedDeleteView.as_view(), name='user_recently_viewed_delete'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/clear/$', rest_views.UserRecentlyViewedClearAllView.as_view(),        name='user_recently_viewed_delete'),    url(r'^clients/(?P<phone>[\d]+)/notifications/$',        rest_views.UserNotificationsView.as_view(), name='user_notifications'),    url(r'^clients/(?P<phone>[\d]+)/notifications/clear/$',        rest_views.UserNotificationsClearView.as_view(), name='user_notifications_clear'),    url(r'^clients/(?P<phone>[\d]+)/notifications/(?P<notification_id>[\d]+)/update/$',        rest_views.UserNotificationsUpdateView.as_view(), name='user_notification_update'),    url(r'^clients/(?P<phone>[\d]+)/orders/$', rest_views.UserOrdersView.as_view(), name='user_orders'),    url(r'^clients/(?P<phone>[\d]+)/orders/create/$', rest_views.UserOrdersCreateView.as_view(),        name='user_orders_create'),    url(r'^clients/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/payment/stripe/$',        rest_views.UserPaymentStripeView.as_view(), name='user_payment_stripe'),    url(r'^clients/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/payment/stripe/existing/card/$',        rest_views.UserPaymentStripeExistingCardView.as_view(), name='user_payment_with_existing_card_stripe'),    url(r'^clients/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/payment/paypal/$',        rest_views.UserPaymentPaypalView.as_view(), name='user_payment_paypal'),    url(r'^clients/(?P<phone>[\d]+)/points/$', rest_views.UserPointsView.as_view(), name='user_points'),    url(r'^clients/(?P<phone>[\d]+)/points/create/$', rest_views.UserPointCreateView.as_view(),        name='user_points_create'),    url(r'^clients/(?P<phone>[\d]+)/points/subtraction/$', rest_views.UserPointSubtractionView.as_view(),        name='user_points_subtraction'),    url(r'^clients/(?P<phone>[\d]+)/free/items/$', rest_views.CustomerFreeItemsView.as_view(),        name='customer_free_items'),    url(r'^clients/(?P<phone>[\d]+)/free/items/cafes/$', rest_views.CustomerFreeItemsForCafeView.as_view(),        name='customer_free_items_for_cafe'),    url(r'^cashier/(?P<phone>[\d]+)/orders/$', rest_views.CashierOrdersListView.as_view(), name='cashier_orders_list'),    url(r'^cashier/(?P<phone>[\d]+)/free-item/(?P<pk>[\d]+)/update/$', rest_views.CashierFreeItemChangeView.as_view(),        name='cashier_free_item_change'),    url(r'^cashier/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/update/$', rest_views.CashierOrderUpdateView.as_view(),        name='cashier_orders_list'),    url(r'^cashier/(?P<phone>[\d]+)/users/$', rest_views.CashierOrderedUsersListView.as_view(),        name='cashier_ordered_users_list'),    url(r'^cashier/(?P<phone>[\d]+)/users/transactions/$', rest_views.CashierOrderedUsersTransactionsListView.as_view(),        name='cashier_ordered_users_transactions_list'),    url(r'^clients/social/login/(?P<provider>facebook|google)/$',        rest_views.SocialLoginView.as_view(), name='user_social_login'),    url(r'^clients/social/register/(?P<provider>facebook|google)/$',        rest_views.SocialRegisterView.as_view(), name='user_social_register'),    url(r'^products/$', rest_views.ProductsView.as_view(), name='products'),    url(r'^products/category/$', rest_views.ProductsCategoryView.as_view(), name='products_category'),    url(r'^products/(?P<product_id>[\d]+)/$', rest_views.ProductsDetailView.as_view(), name='products_detail'),    url(r'^products/(?P<product_id>[\d]+)/files/$', rest_views.ProductFileUploadView.as_view(),        name='product_file_upload'),    url(r'^stripe/retrieve/$', rest_views.StripeRetrieveView.as_view(), name='stripe_retrieve'),    url(r'^paypal/retrieve/$', rest_views.PaypalRetrieveView.as_view(), name='paypal_retrieve'),    url(r'^send/notifications/$', rest_views.SendNotificationsView.as_view(), name='send_noticiations'),    url(r'^stripe/(?P<phone>[\d]+)/reject/(?P<order_id>[\d]+)$', rest_views.StripeRejectView.as_view(), name='stripe_reject'),]
\ No newline at end of file
+from django.conf.urls import urlfrom apps.restapp import views as rest_viewsurlpatterns = [    url(r'^categories/$', rest_views.CategoryView.as_view(), name='categories'),    url(r'^categories/top/$', rest_views.CategoryTopView.as_view(), name='top_categories'),    url(r'^news/$', rest_views.NewsView.as_view(), name='news'),    url(r'^news/(?P<news_id>[\d]+)/$', rest_views.NewsDetailView.as_view(), name='news_detail'),    url(r'^cafes/$', rest_views.CafesView.as_view(), name='cafes'),    url(r'^cafes/nearby/$', rest_views.CafesNearByView.as_view(), name='cafes_nearby'),    url(r'^cafes/suggest/$', rest_views.CafeSuggestView.as_view(), name='cafes_suggest'),    url(r'^cafes/nearby/(?P<phone>[\d]+)/$', rest_views.CafesNearByForUserView.as_view(), name='cafes_nearby_for_user'),    url(r'^cafes/(?P<cafe_id>[\d]+)/$', rest_views.CafeDetailView.as_view(), name='cafe_detail'),    url(r'^cafes/(?P<cafe_id>[\d]+)/related/$', rest_views.CafesRelatedView.as_view(), name='cafe_related'),    url(r'^cafes/(?P<cafe_id>[\d]+)/like-dislike/$', rest_views.CafeLikeDislikeView.as_view(),        name='cafe_like_dislike'),    url(r'^cafes/(?P<cafe_id>[\d]+)/products/$', rest_views.CafeProductsView.as_view(), name='cafe_products'),    url(r'^cafes/(?P<cafe_id>[\d]+)/(?P<phone>[\d]+)/$', rest_views.CafeDetailForUserView.as_view(),        name='cafe_detail_for_user'),    url(r'^cafes/(?P<cafe_id>[\d]+)/(?P<phone>[\d]+)/free-items/$',        rest_views.UserFreeItemsForCashierView.as_view(), name='user_free_items_for_cashier'),    url(r'^cafes/(?P<cafe_id>[\d]+)/files/$', rest_views.CafeFilesView.as_view(), name='cafe_files'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/$', rest_views.CafeReviewView.as_view(), name='cafe_reviews'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/for/user/(?P<phone>[\d]+)/$',        rest_views.CafeReviewForUserView.as_view(),        name='cafe_reviews_for_user'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/create/$', rest_views.CafeReviewCreateView.as_view(),        name='cafe_review_create'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/$', rest_views.CafeReviewRUD.as_view(),        name='cafe_review_rud'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/like-dislike/$',        rest_views.ReviewLikeDislikeView.as_view(), name='cafe_review_like_dislike'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/like-dislike/all/$',        rest_views.ReviewLikeDislikeAllView.as_view(), name='cafe_review_like_dislike_all'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/files/$', rest_views.ReviewAllFilesView.as_view(),        name='cafe_all_review_files'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/files/$', rest_views.ReviewFilesView.as_view(),        name='cafe_review_files'),    url(r'^cafes/(?P<cafe_id>[\d]+)/reviews/(?P<review_id>[\d]+)/files/upload/$',        rest_views.ReviewFilesUploadView.as_view(), name='cafe_review_files_upload'),    url(r'^cafes/(?P<cafe_id>[\d]+)/points/$', rest_views.CafePointsView.as_view(), name='cafe_points'),    url(r'^cafes/(?P<cafe_id>[\d]+)/points/(?P<phone>[\d]+)/$', rest_views.CafePointsExchangedProductsView.as_view(),        name='cafe_points_exchanged'),    url(r'^clients/$', rest_views.UserListView.as_view(), name='clients'),    url(r'^clients/create/$', rest_views.UserCreateView.as_view(), name='user_create'),    url(r'^clients/(?P<phone>[\d]+)/$', rest_views.UserRetrieveView.as_view(), name='user_detail'),    url(r'^clients/(?P<phone>[\d]+)/reviews/$', rest_views.UserReviewListView.as_view(), name='user_reviews'),    url(r'^clients/(?P<phone>[\d]+)/update/$', rest_views.UserUpdateView.as_view(), name='user_update'),    url(r'^clients/(?P<phone>[\d]+)/password/change/$', rest_views.UserPasswordChangeView.as_view(),        name='password_change'),    url(r'^clients/(?P<phone>[\d]+)/bookmarks/$', rest_views.BookmarkView.as_view(), name='user_bookmarks'),    url(r'^clients/(?P<phone>[\d]+)/bookmarks/create/$', rest_views.BookmarkCreateView.as_view(),        name='user_bookmarks_create'),    url(r'^clients/(?P<phone>[\d]+)/bookmarks/delete/$', rest_views.BookmarkDestroyView.as_view(),        name='user_bookmarks_destroy'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/$', rest_views.UserRecentlyViewedListView.as_view(),        name='user_recently_viewed_list'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/send/$', rest_views.UserRecentlyViewedCreateView.as_view(),        name='user_recently_viewed_send'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/(?P<cafe_id>[\d]+)/delete/$',        rest_views.UserRecentlyViewedDeleteView.as_view(), name='user_recently_viewed_delete'),    url(r'^clients/(?P<phone>[\d]+)/recently/viewed/clear/$', rest_views.UserRecentlyViewedClearAllView.as_view(),        name='user_recently_viewed_delete'),    url(r'^clients/(?P<phone>[\d]+)/notifications/$',        rest_views.UserNotificationsView.as_view(), name='user_notifications'),    url(r'^clients/(?P<phone>[\d]+)/notifications/clear/$',        rest_views.UserNotificationsClearView.as_view(), name='user_notifications_clear'),    url(r'^clients/(?P<phone>[\d]+)/notifications/(?P<notification_id>[\d]+)/update/$',        rest_views.UserNotificationsUpdateView.as_view(), name='user_notification_update'),    url(r'^clients/(?P<phone>[\d]+)/orders/$', rest_views.UserOrdersView.as_view(), name='user_orders'),    url(r'^clients/(?P<phone>[\d]+)/orders/create/$', rest_views.UserOrdersCreateView.as_view(),        name='user_orders_create'),    url(r'^clients/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/payment/stripe/$',        rest_views.UserPaymentStripeView.as_view(), name='user_payment_stripe'),    url(r'^clients/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/payment/stripe/existing/card/$',        rest_views.UserPaymentStripeExistingCardView.as_view(), name='user_payment_with_existing_card_stripe'),    url(r'^clients/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/payment/paypal/$',        rest_views.UserPaymentPaypalView.as_view(), name='user_payment_paypal'),    url(r'^clients/(?P<phone>[\d]+)/payments/(?P<intent_id>[\d]+)/$', rest_views.PaymentIntentStatusView.as_view(),        name='user_payment_status'),    url(r'^clients/(?P<phone>[\d]+)/points/$', rest_views.UserPointsView.as_view(), name='user_points'),    url(r'^clients/(?P<phone>[\d]+)/points/create/$', rest_views.UserPointCreateView.as_view(),        name='user_points_create'),    url(r'^clients/(?P<phone>[\d]+)/points/subtraction/$', rest_views.UserPointSubtractionView.as_view(),        name='user_points_subtraction'),    url(r'^clients/(?P<phone>[\d]+)/free/items/$', rest_views.CustomerFreeItemsView.as_view(),        name='customer_free_items'),    url(r'^clients/(?P<phone>[\d]+)/free/items/cafes/$', rest_views.CustomerFreeItemsForCafeView.as_view(),        name='customer_free_items_for_cafe'),    url(r'^cashier/(?P<phone>[\d]+)/orders/$', rest_views.CashierOrdersListView.as_view(), name='cashier_orders_list'),    url(r'^cashier/(?P<phone>[\d]+)/orders/stream/$', rest_views.CashierOrdersStreamView.as_view(),        name='cashier_orders_stream'),    url(r'^cashier/(?P<phone>[\d]+)/free-item/(?P<pk>[\d]+)/update/$', rest_views.CashierFreeItemChangeView.as_view(),        name='cashier_free_item_change'),    url(r'^cashier/(?P<phone>[\d]+)/orders/(?P<order_id>[\d]+)/update/$', rest_views.CashierOrderUpdateView.as_view(),        name='cashier_orders_list'),    url(r'^cashier/(?P<phone>[\d]+)/users/$', rest_views.CashierOrderedUsersListView.as_view(),        name='cashier_ordered_users_list'),    url(r'^cashier/(?P<phone>[\d]+)/users/transactions/$', rest_views.CashierOrderedUsersTransactionsListView.as_view(),        name='cashier_ordered_users_transactions_list'),    url(r'^clients/social/login/(?P<provider>facebook|google)/$',        rest_views.SocialLoginView.as_view(), name='user_social_login'),    url(r'^clients/social/register/(?P<provider>facebook|google)/$',        rest_views.SocialRegisterView.as_view(), name='user_social_register'),    url(r'^products/$', rest_views.ProductsView.as_view(), name='products'),    url(r'^products/category/$', rest_views.ProductsCategoryView.as_view(), name='products_category'),    url(r'^products/(?P<product_id>[\d]+)/$', rest_views.ProductsDetailView.as_view(), name='products_detail'),    url(r'^products/(?P<product_id>[\d]+)/files/$', rest_views.ProductFileUploadView.as_view(),        name='product_file_upload'),    url(r'^stripe/retrieve/$', rest_views.StripeRetrieveView.as_view(), name='stripe_retrieve'),    url(r'^paypal/retrieve/$', rest_views.PaypalRetrieveView.as_view(), name='paypal_retrieve'),    url(r'^send/notifications/$', rest_views.SendNotificationsView.as_view(), name='send_noticiations'),    url(r'^stripe/(?P<phone>[\d]+)/reject/(?P<order_id>[\d]+)$', rest_views.StripeRejectView.as_view(), name='stripe_reject'),]
\ No newline at end of file
@@ -1,14 +1,15 @@
 import ast
+import uuid
 import requests
 
 from django.utils import timezone
-from django.db.models import Avg, Q, Sum, Count
+from django.db import transaction as db_transaction
+from django.db.models import Avg, Q, Sum, Count, Prefetch
 from django.shortcuts import get_object_or_404, Http404
 from django.conf import settings
 
 import stripe
 import stripe.error
-import braintree
 from authy.api import AuthyApiClient
 from django_filters.rest_framework import DjangoFilterBackend
 from google.oauth2 import id_token
@@ -21,129 +22,138 @@ from rest_framework import (
     status,
     generics,
     views,
-    filters
+    filters,
+    exceptions
 )
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
+from rest_framework.settings import api_settings
 
 from project.tasks import send_free_item_expire_notifications
 from project import modules as project_modules
+from project import metrics as project_metrics
 from apps.users import models as user_models
+from apps.users import identity as user_identity
 from apps.products import models as product_models
+from apps.products import menus as product_menus
 from apps.orders import models as order_models
+from apps.orders import events as order_events
 from apps.payment import models as payment_models
+from apps.payment import vault as payment_vault
+from apps.payment import tasks as payment_tasks
+from apps.payment import gateways as payment_gateways
 from apps.restapp import serializers as rest_serializers
 from apps.restapp import pagination
 from apps.restapp import permissions as rest_permissions
 from apps.restapp import filters as rest_filters
+from apps.restapp import caching
+from apps.restapp import suggestions
+from apps.restapp.authentication import CachedTokenAuthentication
 
 
-class CafesView(generics.ListAPIView):
+class CafesView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.CafesSerializer
     queryset = user_models.Cafe.objects.filter(status=user_models.Cafe.ACTIVE)
+    filter_backends = (DjangoFilterBackend, rest_filters.FullTextSearchFilter)
     filter_fields = ['category', ]
     search_fields = ['cafe_name', 'address', 'description', ]
+    search_name_field = 'cafe_name'
     pagination_class = pagination.CafesPagination
 
     def get_queryset(self):
         if self.request.GET.get('rate'):
-            rate = self.request.GET.get('rate', 0)
-            self.queryset = self.queryset.annotate(total_rate=Avg('review__rate')).filter(
-                Q(total_rate__lte=rate) | Q(total_rate=None))
+            self.queryset = self.queryset.filter_by_max_rate(self.request.GET.get('rate', 0))
         if self.request.GET.get('states'):
-            now = timezone.now().time()
-            states = self.request.GET.get('states').split(',')
-            open_cafes = closed_cafes = unknown_cafes = list()
-
-            current_day_available_cafes_queryset = \
-                user_models.WeekTime.objects.filter(day=rest_serializers.current_week_day)
-
-            if states.__contains__('open'):
-                query = Q(opening_time__lte=now, closing_time__gte=now)
-                open_cafes = current_day_available_cafes_queryset.filter(query).values_list('cafe', flat=True)
-            if states.__contains__('closed'):
-                query = Q(opening_time__lte=now, closing_time__gte=now)
-                open_cafes_queryset = current_day_available_cafes_queryset.filter(query).values_list('cafe', flat=True)
-                closed_cafes_queryset = current_day_available_cafes_queryset.values_list('cafe', flat=True)
-                closed_cafes = list(set(closed_cafes_queryset) - set(open_cafes_queryset))
-
-            if states.__contains__('unknown'):
-                current_day_available_cafes = \
-                    current_day_available_cafes_queryset.distinct('cafe').values_list('cafe', flat=True)
-                unknown_cafes = self.queryset.exclude(pk__in=current_day_available_cafes).values_list('id', flat=True)
-            all_cafes = list(open_cafes) + list(closed_cafes) + list(unknown_cafes)
-            self.queryset = self.queryset.filter(pk__in=all_cafes)
-        return self.queryset
-
-
-class CafesNearByView(generics.ListAPIView):
-    serializer_class = rest_serializers.CafesNearBySerializer
+            self.queryset = self.queryset.filter_by_states(self.request.GET.get('states').split(','))
+        return self.queryset.with_listing_data()
+
+
+class NearbyCafesMixin(object):
+    """
+    Active cafes within `distance` km of `latitude` and `longitude`, closest first. `limit` keeps the closest ones.
+    """
     queryset = user_models.Cafe.objects.filter(status=user_models.Cafe.ACTIVE)
+    filter_backends = (DjangoFilterBackend, rest_filters.FullTextSearchFilter)
     filter_fields = ['category', ]
     search_fields = ['cafe_name', 'address', 'description', ]
+    search_name_field = 'cafe_name'
+    # Closest cafes first, relevance only breaks ties
+    search_rank_first = False
+    max_limit = 100
+
+    def get_number_param(self, name, parse):
+        value = self.request.GET.get(name)
+        if not value:
+            return None
+        try:
+            return parse(value)
+        except ValueError:
+            raise exceptions.ValidationError({name: 'A number is required.'})
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        distance = self.request.GET.get('distance')
-        latitude = self.request.GET.get('latitude')
-        longitude = self.request.GET.get('longitude')
+        distance = self.get_number_param('distance', float)
+        latitude = self.get_number_param('latitude', float)
+        longitude = self.get_number_param('longitude', float)
 
-        if distance and latitude and longitude:
+        if distance is not None and latitude is not None and longitude is not None:
             kwargs = dict()
             if self.request.GET.get('rate'):
-                rate = self.request.GET.get('rate', 0)
-                kwargs.update({'rate': rate})
+                kwargs.update({'rate': self.request.GET.get('rate', 0)})
 
             if self.request.GET.get('states'):
                 kwargs.update({'states': self.request.GET.get('states')})
 
-            queryset = queryset.get_nearby_locations(distance=float(distance), location_lat_long=(float(latitude),
-                                                                                                  float(longitude)),
-                                                     **kwargs)
-        else:
-            queryset = queryset.none()
+            return self.queryset.get_nearby_locations(distance=distance, location_lat_long=(latitude, longitude),
+                                                      **kwargs).with_listing_data()
+        return self.queryset.none()
+
+    def filter_queryset(self, queryset):
+        # Results are already sorted by distance, so the limit keeps the closest cafes
+        queryset = super().filter_queryset(queryset)
+        limit = self.get_number_param('limit', int)
+        if limit is not None:
+            if limit < 1:
+                raise exceptions.ValidationError({'limit': 'A positive number is required.'})
+            queryset = queryset[:min(limit, self.max_limit)]
         return queryset
 
 
-class CafesNearByForUserView(generics.ListAPIView):
-    serializer_class = rest_serializers.CafesForUserSerializer
-    queryset = user_models.Cafe.objects.filter(status=user_models.Cafe.ACTIVE)
-    filter_fields = ['category', ]
-    search_fields = ['cafe_name', 'address', 'description', ]
+class CafesNearByView(NearbyCafesMixin, project_metrics.SerializerMetricsMixin, generics.ListAPIView):
+    serializer_class = rest_serializers.CafesNearBySerializer
 
-    def get_queryset(self):
 
-        distance = self.request.GET.get('distance')
-        latitude = self.request.GET.get('latitude')
-        longitude = self.request.GET.get('longitude')
+class CafesNearByForUserView(NearbyCafesMixin, project_metrics.SerializerMetricsMixin, generics.ListAPIView):
+    serializer_class = rest_serializers.CafesForUserSerializer
 
-        if distance and latitude and longitude:
-            kwargs = dict()
-            if self.request.GET.get('rate'):
-                rate = self.request.GET.get('rate', 0)
-                kwargs.update({'rate': rate})
 
-            if self.request.GET.get('states'):
-                kwargs.update({'states': self.request.GET.get('states')})
+class CafeSuggestView(views.APIView):
+    """
+    Cafe names starting with the words of `q`, for search as you type. Closest first with `latitude` and `longitude`.
+    """
+    default_limit = 10
+    max_limit = 20
 
-            queryset = user_models.Cafe.objects.get_nearby_locations(distance=float(distance),
-                                                                     location_lat_long=(
-                                                                         float(latitude), float(longitude)),
-                                                                     **kwargs)
-        else:
-            queryset = user_models.Cafe.objects.none()
-        return queryset
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = max(1, min(int(request.GET.get('limit', self.default_limit)), self.max_limit))
+            latitude = request.GET.get('latitude')
+            longitude = request.GET.get('longitude')
+            location = (float(latitude), float(longitude)) if latitude and longitude else None
+        except ValueError:
+            return response.Response({'detail': 'limit, latitude and longitude must be numbers'},
+                                     status=status.HTTP_400_BAD_REQUEST)
+        cafes = suggestions.get_index().suggest(request.GET.get('q', ''), limit, location)
+        return response.Response(cafes)
 
 
-class CafeDetailView(generics.RetrieveAPIView):
+class CafeDetailView(project_metrics.SerializerMetricsMixin, generics.RetrieveAPIView):
     serializer_class = rest_serializers.CafesSerializer
 
     def get_object(self):
         pk = self.kwargs.get('cafe_id')
-        return get_object_or_404(user_models.Cafe, pk=pk)
+        return get_object_or_404(user_models.Cafe.objects.with_listing_data(), pk=pk)
 
 
-class CafeDetailForUserView(generics.RetrieveAPIView):
+class CafeDetailForUserView(project_metrics.SerializerMetricsMixin, generics.RetrieveAPIView):
     serializer_class = rest_serializers.CafesForUserSerializer
 
     def get_object(self):
@@ -151,8 +161,9 @@ class CafeDetailForUserView(generics.RetrieveAPIView):
         return get_object_or_404(user_models.Cafe, pk=pk)
 
 
-class CafeFilesView(generics.ListAPIView):
+class CafeFilesView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.CafeFilesSerializer
+    pagination_class = pagination.KeysetPagination
 
     def get_queryset(self):
         cafe = user_models.Cafe.objects.get(pk=self.kwargs.get('cafe_id'))
@@ -160,7 +171,7 @@ class CafeFilesView(generics.ListAPIView):
         return files
 
 
-class CafeReviewView(generics.ListAPIView):
+class CafeReviewView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ReviewSerializer
     queryset = user_models.Review.objects.filter(parent=None)
     pagination_class = pagination.CafeReviewsPagination
@@ -174,7 +185,7 @@ class CafeReviewView(generics.ListAPIView):
         return reviews
 
 
-class CafeReviewForUserView(generics.ListAPIView):
+class CafeReviewForUserView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ReviewSerializerForUser
     queryset = user_models.Review.objects.filter(parent=None)
 
@@ -191,7 +202,7 @@ class CafeReviewCreateView(generics.CreateAPIView, ):
     serializer_class = rest_serializers.ReviewCreateSerializer
 
 
-class CafeReviewRUD(generics.RetrieveUpdateDestroyAPIView):
+class CafeReviewRUD(project_metrics.SerializerMetricsMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = rest_serializers.ReviewReadUpdateDestroySerializer
     lookup_url_kwarg = ['review_id']
 
@@ -205,14 +216,15 @@ class CafeReviewRUD(generics.RetrieveUpdateDestroyAPIView):
         return review
 
 
-class ReviewsView(viewsets.ModelViewSet):
+class ReviewsView(project_metrics.SerializerMetricsMixin, viewsets.ModelViewSet):
     serializer_class = rest_serializers.ReviewSerializer
     queryset = user_models.Review.objects.all()
     filter_backends = (DjangoFilterBackend,)
 
 
-class ReviewAllFilesView(generics.ListAPIView):
+class ReviewAllFilesView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ReviewFileUploadSerializer
+    pagination_class = pagination.KeysetPagination
     queryset = user_models.File.objects.all()
 
     def get_queryset(self):
@@ -220,7 +232,7 @@ class ReviewAllFilesView(generics.ListAPIView):
         return self.queryset.filter(album__cafe=cafe).exclude(album__owner=cafe.user).order_by('-pk')
 
 
-class ReviewFilesView(generics.ListAPIView):
+class ReviewFilesView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ReviewFileUploadSerializer
     queryset = user_models.File.objects.all()
 
@@ -233,22 +245,36 @@ class ReviewFilesUploadView(generics.CreateAPIView):
     serializer_class = rest_serializers.ReviewFileUploadSerializer
 
 
-class CategoryView(generics.ListAPIView):
+class CategoryView(caching.CatalogCacheMixin, project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.CategorySerializer
+    cache_namespace = caching.CATEGORIES
     queryset = user_models.Category.objects.filter(parent=None)
 
+    def list(self, request, *args, **kwargs):
+        # The whole tree comes from one query instead of a get_children() query per node
+        categories = rest_serializers.render_category_tree(request)
+        page = self.paginate_queryset(categories)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return response.Response(categories)
 
-class CategoryTopView(generics.ListAPIView):
+
+class CategoryTopView(caching.CatalogCacheMixin, project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.CategoryTopSerializer
+    cache_namespace = caching.CATEGORIES
     queryset = user_models.Category.objects.filter(is_top=1)
 
 
-class BookmarkView(generics.ListAPIView):
+class BookmarkView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.BookmarkListSerializer
+    pagination_class = pagination.KeysetPagination
 
     def get_queryset(self):
         phone = self.kwargs.get('phone')
-        return user_models.Bookmarks.objects.filter(user__phone=phone).order_by('-pk')
+        cafes = user_models.Cafe.objects.with_listing_data()
+        user_id = user_identity.get_user_id_by_phone(phone, self.request)
+        return user_models.Bookmarks.objects.filter(user_id=user_id).prefetch_related(
+            Prefetch('cafe', queryset=cafes)).order_by('-pk')
 
 
 class BookmarkCreateView(views.APIView):
@@ -256,7 +282,7 @@ class BookmarkCreateView(views.APIView):
 
     def post(self, request, *args, **kwargs):
         phone = kwargs.get('phone')
-        user = user_models.User.objects.get(phone=phone)
+        user = user_identity.get_user_by_phone(phone, request)
         ids = request.POST.get('cafe_ids', None)
         if ids:
             cafe_ids = ast.literal_eval(ids)
@@ -272,34 +298,37 @@ class BookmarkCreateView(views.APIView):
 
 
 class BookmarkDestroyView(views.APIView):
-    authentication_classes = [TokenAuthentication, ]
+    authentication_classes = [CachedTokenAuthentication, ]
     model = user_models.Bookmarks
 
     def post(self, request, *args, **kwargs):
         cafe_ids = request.POST.get('cafe_ids', None)
         if cafe_ids:
             ids = ast.literal_eval(cafe_ids)
-            user_models.Bookmarks.objects.filter(cafe_id__in=ids, user__phone=self.kwargs.get('phone')).delete()
+            user_models.Bookmarks.objects.filter(
+                cafe_id__in=ids, user_id=user_identity.get_user_id_by_phone(self.kwargs.get('phone'), request)).delete()
             msg = 'Successful removed'
         else:
             msg = 'Can not remove'
         return response.Response({"status": "success", "message": [msg]}, status=status.HTTP_200_OK)
 
 
-class UserListView(generics.ListAPIView):
+class UserListView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.UserSerializer
+    pagination_class = pagination.KeysetPagination
     queryset = user_models.User.objects.all()
 
 
-class UserReviewListView(generics.ListAPIView):
+class UserReviewListView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ReviewSerializer
+    pagination_class = pagination.KeysetPagination
     queryset = user_models.Review.objects.all()
 
     def get_queryset(self):
         return self.queryset.filter(author__phone=self.kwargs.get('phone')).order_by('-pk')
 
 
-class UserRetrieveView(generics.RetrieveAPIView):
+class UserRetrieveView(project_metrics.SerializerMetricsMixin, generics.RetrieveAPIView):
     serializer_class = rest_serializers.UserSerializer
     model = user_models.User
 
@@ -307,13 +336,15 @@ class UserRetrieveView(generics.RetrieveAPIView):
         return get_object_or_404(user_models.User, phone=self.kwargs.get('phone'))
 
 
-class UserNotificationsView(generics.ListAPIView):
+class UserNotificationsView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     model = user_models.Notifications
     serializer_class = rest_serializers.NotificationsSerializer
+    pagination_class = pagination.KeysetPagination
 
     def get_queryset(self):
         phone = self.kwargs.get('phone')
-        return self.model.objects.filter(user__phone=phone).order_by('-pk')
+        user_id = user_identity.get_user_id_by_phone(phone, self.request)
+        return self.model.objects.filter(user_id=user_id).order_by('-pk')
 
 
 class UserNotificationsClearView(generics.DestroyAPIView):
@@ -323,7 +354,8 @@ class UserNotificationsClearView(generics.DestroyAPIView):
 
     def get_queryset(self):
         phone = self.kwargs.get('phone')
-        return self.model.objects.filter(user__phone=phone).order_by('-pk')
+        user_id = user_identity.get_user_id_by_phone(phone, self.request)
+        return self.model.objects.filter(user_id=user_id).order_by('-pk')
 
     def destroy(self, request, *args, **kwargs):
         query_set = self.get_queryset()
@@ -344,13 +376,13 @@ class UserNotificationsUpdateView(generics.UpdateAPIView):
         return response.Response({"status": "success", "message": ["Successful updated"]})
 
 
-class UserRecentlyViewedListView(generics.ListAPIView):
+class UserRecentlyViewedListView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.CafesSerializer
     model = user_models.RecentlyViewed
 
     def get_queryset(self):
         viewed_cafes = self.model.objects.filter(user__phone=self.kwargs.get('phone')).values_list('cafe')
-        return user_models.Cafe.objects.filter(pk__in=viewed_cafes)
+        return user_models.Cafe.objects.filter(pk__in=viewed_cafes).with_listing_data()
 
 
 class UserRecentlyViewedCreateView(generics.CreateAPIView):
@@ -368,10 +400,11 @@ class UserRecentlyViewedCreateView(generics.CreateAPIView):
         phone = kwargs.get('phone')
         cafe_id = request.data.get('cafe')
 
-        viewed_cafe = self.model.objects.filter(user__phone=phone, cafe__id=cafe_id)
+        user = user_identity.get_user_by_phone(phone, request)
+        viewed_cafe = self.model.objects.filter(user=user, cafe__id=cafe_id)
         if not viewed_cafe.exists():
             self.model.objects.create(**{
-                'user': user_models.User.objects.get(phone=phone),
+                'user': user,
                 'cafe': user_models.Cafe.objects.get(id=cafe_id)
             })
         headers = self.get_success_headers(serializer.data)
@@ -381,22 +414,23 @@ class UserRecentlyViewedCreateView(generics.CreateAPIView):
 
 class UserRecentlyViewedDeleteView(generics.DestroyAPIView):
     serializer_class = rest_serializers.RecentlyViewedSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     model = user_models.RecentlyViewed
 
     def get_object(self):
-        return self.model.objects.get(cafe_id=self.kwargs.get('cafe_id'), user__phone=self.kwargs.get('phone'))
+        user_id = user_identity.get_user_id_by_phone(self.kwargs.get('phone'), self.request)
+        return self.model.objects.get(cafe_id=self.kwargs.get('cafe_id'), user_id=user_id)
 
 
 class UserRecentlyViewedClearAllView(generics.DestroyAPIView):
     serializer_class = rest_serializers.RecentlyViewedSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     model = user_models.RecentlyViewed
     lookup_url_kwarg = ['phone']
 
     def get_queryset(self):
         phone = self.kwargs.get('phone')
-        return self.model.objects.filter(user__phone=phone)
+        return self.model.objects.filter(user_id=user_identity.get_user_id_by_phone(phone, self.request))
 
     def destroy(self, request, *args, **kwargs):
         query_set = self.get_queryset()
@@ -424,7 +458,7 @@ class UserCreateView(generics.CreateAPIView):
             return response.Response(errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserUpdateView(generics.RetrieveUpdateAPIView):
+class UserUpdateView(project_metrics.SerializerMetricsMixin, generics.RetrieveUpdateAPIView):
     serializer_class = rest_serializers.UserUpdateSerializer
 
     def get_object(self):
@@ -488,7 +522,7 @@ class CafeLikeDislikeView(generics.CreateAPIView):
     serializer_class = rest_serializers.CafeLikeDislikeSerializer
 
 
-class ReviewLikeDislikeAllView(generics.ListAPIView):
+class ReviewLikeDislikeAllView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ReviewLikeDislikeSerializer
     queryset = user_models.ReviewLikeDislike.objects.all()
 
@@ -497,38 +531,46 @@ class ReviewLikeDislikeAllView(generics.ListAPIView):
         return self.queryset.filter(review=review).order_by('-pk')
 
 
-class NewsView(generics.ListAPIView):
+class NewsView(caching.CatalogCacheMixin, project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.NewsSerializer
+    pagination_class = pagination.CreatedKeysetPagination
+    cache_namespace = caching.NEWS
     queryset = user_models.News.objects.order_by('-created_at')
     permission_classes = (permissions.AllowAny,)
 
 
-class NewsDetailView(generics.RetrieveAPIView):
+class NewsDetailView(caching.CatalogCacheMixin, project_metrics.SerializerMetricsMixin, generics.RetrieveAPIView):
     serializer_class = rest_serializers.NewsSerializer
+    cache_namespace = caching.NEWS
     permission_classes = (permissions.AllowAny,)
     queryset = user_models.News.objects.all()
     lookup_url_kwarg = 'news_id'
 
 
-class ProductsView(generics.ListAPIView):
+class ProductsView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ProductSerializer
+    pagination_class = pagination.KeysetPagination
     queryset = product_models.Product.objects.all()
     permission_classes = (permissions.AllowAny,)
+    filter_backends = (rest_filters.FullTextSearchFilter,)
     search_fields = ['title', 'category__name', 'description', ]
+    search_name_field = 'title'
 
 
-class ProductsDetailView(generics.RetrieveAPIView):
+class ProductsDetailView(caching.CatalogCacheMixin, project_metrics.SerializerMetricsMixin, generics.RetrieveAPIView):
     serializer_class = rest_serializers.ProductSerializer
+    cache_namespace = caching.PRODUCTS
     queryset = product_models.Product.objects.all()
     permission_classes = (permissions.AllowAny,)
     lookup_url_kwarg = 'product_id'
 
 
-class UserOrdersView(generics.ListAPIView):
+class UserOrdersView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.OrderSerializer
+    pagination_class = pagination.KeysetPagination
 
     def get_queryset(self):
-        return order_models.Order.objects.filter(customer__phone=self.kwargs.get('phone')).order_by('-id')
+        return order_models.Order.objects.filter(customer__phone=self.kwargs.get('phone')).with_feed_data()
         # return order_models.Order.objects.filter(customer__phone=self.kwargs.get('phone'),
         #                                          transaction__isnull=False)
 
@@ -547,15 +589,25 @@ class CafeProductsView(generics.ListAPIView):
         queryset = product_models.Product.objects.filter(cafes__cafe_id=self.kwargs.get('cafe_id')).distinct('id')
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # The menu is compiled once per change of the cafe's products, not serialized per request
+        menu = product_menus.get_menu(self.kwargs.get('cafe_id'), request)
+        products = product_menus.filter_menu(menu, category=request.query_params.get('category'),
+                                             search=request.query_params.get(api_settings.SEARCH_PARAM, ''))
+        page = self.paginate_queryset(products)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return response.Response(products)
+
 
-class UserPointsView(generics.ListAPIView):
+class UserPointsView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.PointSerializer
 
     def get_queryset(self):
         return user_models.Point.objects.filter(owner__phone=self.kwargs.get('phone'))
 
 
-class CafePointsView(generics.ListAPIView):
+class CafePointsView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.UsersPointSerializer
     filter_fields = ['phone']
     search_fields = ['first_name', 'last_name', 'username', 'phone', ]
@@ -577,7 +629,7 @@ class UserPointCreateView(views.APIView):
 
         cafe = user_models.Cafe.objects.get(pk=cafe_id)
 
-        point_owner = user_models.User.objects.get(phone=phone)
+        point_owner = user_identity.get_user_by_phone(phone, request)
 
         point = project_modules.point_free_item_calculation(cafe=cafe, client=point_owner, count=point_count)
 
@@ -597,14 +649,41 @@ class UserPointSubtractionView(views.APIView):
         return response.Response(data={'message': total_point_count})
 
 
-class CashierOrdersListView(generics.ListAPIView):
+class CashierOrdersListView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.OrderSerializer
+    pagination_class = pagination.KeysetPagination
     filter_backends = (DjangoFilterBackend,)
     filter_fields = ('state',)
 
     def get_queryset(self):
         return order_models.Order.objects.filter(
-            cafe__cafe_cashiers__cashier__phone=self.kwargs.get('phone'), ).order_by('-id')
+            cafe__cafe_cashiers__cashier__phone=self.kwargs.get('phone'), ).with_feed_data()
+
+
+class CashierOrdersStreamView(views.APIView):
+    """
+    Long-poll feed of order events for the cafes of a cashier.
+    `since` is the id of the last event the client has seen; the response holds the newer events
+    and the id to send as `since` next time. Without `since` the current id is returned right away.
+    """
+    max_timeout = 25
+
+    def get(self, request, *args, **kwargs):
+        cafe_ids = list(user_models.Cashier.objects.filter(cashier__phone=self.kwargs.get('phone'))
+                        .values_list('cafe_id', flat=True))
+        if not cafe_ids:
+            raise Http404()
+        try:
+            since = int(request.GET['since'])
+            timeout = min(float(request.GET.get('timeout', self.max_timeout)), self.max_timeout)
+        except KeyError:
+            return response.Response({'events': [], 'since': order_events.get_last_event_id()})
+        except ValueError:
+            return response.Response({'message': 'since and timeout must be numbers'},
+                                     status=status.HTTP_400_BAD_REQUEST)
+
+        events = order_events.wait_for_events(cafe_ids, since, max(timeout, 0))
+        return response.Response({'events': events, 'since': events[-1]['id'] if events else since})
 
 
 class CashierOrderUpdateView(generics.UpdateAPIView):
@@ -623,7 +702,7 @@ class CashierOrderUpdateView(generics.UpdateAPIView):
         return order
 
 
-class CashierOrderedUsersListView(generics.ListAPIView):
+class CashierOrderedUsersListView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.OrderedUsersSerializer
 
     def get_queryset(self):
@@ -634,8 +713,9 @@ class CashierOrderedUsersListView(generics.ListAPIView):
         return users
 
 
-class CashierOrderedUsersTransactionsListView(generics.ListAPIView):
+class CashierOrderedUsersTransactionsListView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.OrderedUsersTransactionSerializer
+    pagination_class = pagination.KeysetPagination
 
     def get_queryset(self):
         phone = self.kwargs.get('phone')
@@ -644,13 +724,21 @@ class CashierOrderedUsersTransactionsListView(generics.ListAPIView):
         return order_models.Transaction.objects.filter(order_id__in=orders)
 
 
-class ProductsCategoryView(generics.ListAPIView):
+class ProductsCategoryView(caching.CatalogCacheMixin, project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.ProductCategorySerializer
+    cache_namespace = caching.PRODUCT_CATEGORIES
     queryset = product_models.ProductCategory.objects.all()
     permission_classes = (permissions.AllowAny,)
 
+    def list(self, request, *args, **kwargs):
+        categories = rest_serializers.render_product_categories(request)
+        page = self.paginate_queryset(categories)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return response.Response(categories)
 
-class CafePointsExchangedProductsView(generics.ListAPIView):
+
+class CafePointsExchangedProductsView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.CafePointsExchangedProductsSerializer
 
     def get_queryset(self):
@@ -659,19 +747,20 @@ class CafePointsExchangedProductsView(generics.ListAPIView):
                                                    root_cafe__owner_id=cafe.user_id)
 
 
-class CustomerFreeItemsView(generics.ListAPIView):
+class CustomerFreeItemsView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.UserExchangedProductsSerializer
 
     def get_queryset(self):
         status = self.request.GET.get('status', user_models.FreeItem.VALID)
 
-        owners = user_models.User.objects.get(phone=self.kwargs.get('phone')).product_exchanger.filter(
-            status=status).values_list('root_cafe__owner', flat=True).distinct('root_cafe__owner')
+        customer_id = user_identity.get_user_id_by_phone(self.kwargs.get('phone'), self.request)
+        owners = user_models.FreeItem.objects.filter(owner_id=customer_id, status=status).values_list(
+            'root_cafe__owner', flat=True).distinct('root_cafe__owner')
         t = user_models.User.objects.filter(pk__in=owners)
         return t
 
 
-class UserFreeItemsForCashierView(generics.ListAPIView):
+class UserFreeItemsForCashierView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.UsersFreeItemsForCashierSerializer
     filter_backends = (DjangoFilterBackend,)
     filter_fields = ['status', ]
@@ -683,141 +772,99 @@ class UserFreeItemsForCashierView(generics.ListAPIView):
         return products
 
 
-class UserPaymentStripeView(views.APIView):
+class PaymentIntentMixin(object):
+    """
+    Records a pending payment intent and leaves the gateway call to the payments Celery queue.
+    An order has at most one pending, processing or succeeded intent, and repeating a request with the same
+    Idempotency-Key header (or idempotency_key field) returns the intent of the first request.
+    """
+
+    def start_payment(self, request, order, payer, gateway, **fields):
+        if order.total_price is None:
+            return response.Response(data={'message': 'Order {} has no total price'.format(order.pk)},
+                                     status=status.HTTP_400_BAD_REQUEST)
+        client_key = (request.META.get('HTTP_IDEMPOTENCY_KEY') or request.data.get('idempotency_key') or
+                      uuid.uuid4().hex)
+        idempotency_key = 'order-{}-{}'.format(order.pk, client_key)
+        PaymentIntent = payment_models.PaymentIntent
+        with db_transaction.atomic():
+            # Lock the order so concurrent payment requests for it are handled one after another
+            order_models.Order.objects.select_for_update().filter(pk=order.pk).exists()
+            intent = PaymentIntent.objects.filter(
+                Q(idempotency_key=idempotency_key) | Q(order=order, status__in=PaymentIntent.ACTIVE_STATUSES)
+            ).order_by('-pk').first()
+            if intent is None:
+                intent = PaymentIntent.objects.create(order=order, payer=payer, idempotency_key=idempotency_key,
+                                                      gateway=gateway, amount=int(order.total_price * 100), **fields)
+                intent_id = intent.pk
+                db_transaction.on_commit(lambda: payment_tasks.capture_payment.delay(intent_id))
+
+        serializer = rest_serializers.PaymentIntentSerializer(intent)
+        finished = intent.status in (PaymentIntent.SUCCEEDED, PaymentIntent.FAILED)
+        return response.Response(serializer.data, status=status.HTTP_200_OK if finished else status.HTTP_202_ACCEPTED)
+
+
+class PaymentIntentStatusView(project_metrics.SerializerMetricsMixin, generics.RetrieveAPIView):
+    serializer_class = rest_serializers.PaymentIntentSerializer
+
+    def get_object(self):
+        return get_object_or_404(payment_models.PaymentIntent, pk=self.kwargs.get('intent_id'),
+                                 payer__phone=self.kwargs.get('phone'))
+
+
+class UserPaymentStripeView(PaymentIntentMixin, views.APIView):
 
     def get(self, request, *args, **kwargs):
         return response.Response('Hello world')
 
     def post(self, request, *args, **kwargs):
-        print(request)
-        stripe.api_key = settings.STRIPE_API_KEY
         order = order_models.Order.objects.get(id=kwargs.get('order_id'))
-        payer = user_models.User.objects.get(phone=kwargs.get('phone'))
+        payer = user_identity.get_user_by_phone(kwargs.get('phone'), request)
 
         data = request.data
+        # A saved card is charged directly; a new token is saved to the payer's Stripe customer first
         token_id = data.get('m_id')
-        token = stripe.Token.retrieve(id=token_id)
-        amount = int(order.total_price * 100)
-        payment_type = data.get('m_card').get('brand', '-empty-')
-
-        transaction = payment_models.StripeTransaction()
-        transaction.token = token_id
-        transaction.order_id = order.id
-        transaction.amount = amount
-        transaction.payer_id = payer.id
-        transaction.payment_type = payment_type
-        transaction.description = data.get('description', '-empty-')
-        transaction.save()
-
-        simple_transaction = order_models.Transaction()
-        simple_transaction.amount = amount
-        simple_transaction.order = order
-        simple_transaction.payment_type = payment_type
-        simple_transaction.payer = order.customer
-        simple_transaction.save()
-
-        customer = stripe.Customer.create(
-            source=token_id,
-        )
-        print(customer)
+        card_id = data.get('card_id')
         try:
-            charge = stripe.Charge.create(
-                amount=amount,
-                currency='usd',
-                customer=customer.id,
-            )
-            message = "Successfully transaction was created"
-            status_code = 200
-
-            transaction.payment_id = charge.__getitem__('id')
-            transaction.status = 'paid'
-            transaction.order.state = transaction.order.READY
-            transaction.order.save()
-            transaction.save()
-
-        except stripe.error.CardError as e:
-            # Since it's a decline, stripe.error.CardError will be caught
-            body = e.json_body
-            err = body.get('error', {})
-
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.RateLimitError as e:
-            # Too many requests made to the API too quickly
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.InvalidRequestError as e:
-            # Invalid parameters were supplied to Stripe's API
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.AuthenticationError as e:
-            # Authentication with Stripe's API failed
-            # (maybe you changed API keys recently)
-
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.APIConnectionError as e:
-            # Network communication with Stripe failed
-
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.StripeError as e:
-            # Display a very generic error to the user, and maybe send
-            # yourself an email
-
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except Exception as e:
-            # Something else happened, completely unrelated to Stripe
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        return response.Response(data={
-            'message': message,
-            'customer_id': customer.id
-        }, status=status_code)
+            if card_id:
+                payment_type = payment_vault.get_card_brand(payer, card_id) or '-empty-'
+            elif token_id:
+                payment_type = (data.get('m_card') or {}).get('brand', '-empty-')
+            else:
+                raise payment_vault.VaultError('A card or a token is required')
+        except payment_vault.VaultError as e:
+            return response.Response(data={'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.start_payment(request, order, payer, payment_models.PaymentIntent.STRIPE, card_id=card_id,
+                                  token=token_id, payment_type=payment_type,
+                                  description=data.get('description', '-empty-'))
 
 
 class StripeRetrieveView(views.APIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request, *args, **kwargs):
-        if request.data.get('token_id'):
-            stripe.api_key = settings.STRIPE_API_KEY
-            token_id = request.data.get('token_id')
-            # token = stripe.Token.retrieve(id=token_id)
-            customer = stripe.Customer.create(source=token_id)
-            # customer.sources.create(source=token_id)
-            print(customer.id)
-            return response.Response(data={'customer': customer.id})
-        return response.Response(data={'customer': '12'})
+        token_id = request.data.get('token_id')
+        if not token_id:
+            return response.Response(data={'message': 'token_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        phone = request.data.get('phone')
+        # Cards can only be saved on the caller's own customer
+        if phone and phone != request.user.phone:
+            return response.Response(data={'message': 'The phone does not belong to this user'},
+                                     status=status.HTTP_403_FORBIDDEN)
+        try:
+            card_id = payment_vault.add_card(request.user, token_id)
+        except stripe.error.StripeError as e:
+            return response.Response(data={'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return response.Response(data={'customer': payment_vault.get_profile(request.user)['customer_id'],
+                                       'card': card_id})
 
 
 class PaypalRetrieveView(views.APIView):
 
     def post(self, request, *args, **kwargs):
-        cse_key = request.data.get('token_id')
-        print(cse_key)
-        print(request)
-        gateway = braintree.BraintreeGateway(
-            braintree.Configuration(
-                braintree.Environment.Sandbox,
-                merchant_id=settings.PAYPAL_MERCHANT_ID,
-                public_key=settings.PAYPAL_PUBLIC_KEY,
-                private_key=settings.PAYPAL_PRIVATE_KEY
-            )
-        )
-        client_token = gateway.client_token.generate()
+        client_token = payment_gateways.get_client_token()
         return response.Response(data={
             'token': client_token
         })
@@ -826,52 +873,22 @@ class PaypalRetrieveView(views.APIView):
 class StripeRejectView(views.APIView):
 
     def post(self, request, *args, **kwargs):
-        user = user_models.User.objects.get(phone=self.kwargs.get('phone'))
-        status = 'succeeded'
+        user = get_object_or_404(user_models.User, phone=self.kwargs.get('phone'))
+        if not user.is_can_reject:
+            return response.Response(data={'message': 'User is not allowed to reject orders'},
+                                     status=status.HTTP_403_FORBIDDEN)
+        order = get_object_or_404(order_models.Order, pk=self.kwargs.get('order_id'))
+        # Refunds run on the payments queue; the order turns to reject once every charge is refunded
+        payment_tasks.reject_orders.delay([order.pk])
+        return response.Response(data={'status': 'pending', 'order': order.pk}, status=status.HTTP_202_ACCEPTED)
 
-        try:
-            print(self.kwargs.get('phone'))
-            # user = user_models.User.objects.get(phone=self.kwargs.get('phone'))
-            if user.is_can_reject:
-                stripe.api_key = settings.STRIPE_API_KEY
-                # token_id = request.data.get('token_id')
-                order = order_models.Order.objects.get(id=self.kwargs.get('order_id'))
-                # payer = user_models.User.objects.get(post_data.get('phone'))
-                if order:
-                    payments = payment_models.StripeTransaction.objects.filter(order_id=order.id)
-                    for payment in payments:
-                        refund = stripe.Refund.create(charge=payment.payment_id)
-                        reject = stripe.Refund.retrieve(refund.id)
-                        if reject.status == 'succeeded':
-                            payment.status = 'reject'
-
-                            payment.save()
-                    order.state = 'reject'
-                    order.save()
-                return response.Response(data={'status': status})
-        except stripe.error.StripeError as e:
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-            return response.Response(data={'message': message, 'order': order.id}, status=status_code)
-        except Exception as e:
-            # Something else happened, completely unrelated to Stripe
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-            return response.Response(data={'message': message, 'customer_id': user.id}, status=status_code)
-
-        return response.Response(data={'customer': user.id})
-
-
-class CafesRelatedView(generics.ListAPIView):
+
+class CafesRelatedView(project_metrics.SerializerMetricsMixin, generics.ListAPIView):
     serializer_class = rest_serializers.CafesSerializer
 
     def get_queryset(self):
         cafe = user_models.Cafe.objects.get(pk=self.kwargs.get('cafe_id'))
-        return user_models.Cafe.objects.filter(category_id=cafe.category.id).exclude(pk=cafe.id)
+        return user_models.Cafe.objects.filter(category_id=cafe.category_id).exclude(pk=cafe.id).with_listing_data()
 
 
 class ProductFileUploadView(views.APIView):
@@ -886,107 +903,23 @@ class CustomerFreeItemsForCafeView(views.APIView):
         return response.Response(data=free_items)
 
 
-class UserPaymentStripeExistingCardView(views.APIView):
+class UserPaymentStripeExistingCardView(PaymentIntentMixin, views.APIView):
 
     def post(self, request, *args, **kwargs):
-
-        stripe.api_key = settings.STRIPE_API_KEY
         order = order_models.Order.objects.get(id=kwargs.get('order_id'))
-        payer = user_models.User.objects.get(phone=kwargs.get('phone'))
+        payer = user_identity.get_user_by_phone(kwargs.get('phone'), request)
 
         data = request.data
 
-        customer_id = data.get('customer_id')
-        customer = stripe.Customer.retrieve(id=customer_id)
+        # The card must be saved in the payer's profile; its brand is known locally
         card_id = data.get('card_id')
-        token_id = data.get('token_id')
-        token = stripe.Token.retrieve(id=token_id)
-
-        amount = int(order.total_price * 100)
-        payment_type = token.card.get('brand', '--empty--')
-
-        transaction = payment_models.StripeTransaction()
-        transaction.order_id = order.id
-        transaction.amount = amount
-        transaction.payer_id = payer.id
-        transaction.customer_id = customer_id
-        transaction.card_id = card_id
-        transaction.payment_type = payment_type
-        transaction.description = token.card.get('description', '-empty-')
-        transaction.save()
-
-        simple_transaction = order_models.Transaction()
-        simple_transaction.amount = amount
-        simple_transaction.order = order
-        simple_transaction.payment_type = payment_type
-        simple_transaction.payer = order.customer
-        simple_transaction.save()
-
         try:
-            charge = stripe.Charge.create(
-                amount=amount,
-                currency='usd',
-                customer=customer,
-                source=card_id
-            )
-            message = "Successfully transaction was created"
-            status_code = 200
-
-            transaction.payment_id = charge.__getitem__('id')
-            transaction.status = 'paid'
-            transaction.save()
-
-        except stripe.error.CardError as e:
-            # Since it's a decline, stripe.error.CardError will be caught
-            body = e.json_body
-            err = body.get('error', {})
-
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.RateLimitError as e:
-            # Too many requests made to the API too quickly
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.InvalidRequestError as e:
-            # Invalid parameters were supplied to Stripe's API
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.AuthenticationError as e:
-            # Authentication with Stripe's API failed
-            # (maybe you changed API keys recently)
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.APIConnectionError as e:
-            # Network communication with Stripe failed
-
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except stripe.error.StripeError as e:
-            # Display a very generic error to the user, and maybe send
-            # yourself an email
-
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        except Exception as e:
-            # Something else happened, completely unrelated to Stripe
-            body = e.json_body
-            err = body.get('error', {})
-            message = err.get('message')
-            status_code = e.http_status
-        return response.Response(data={
-            'message': message,
-            'customer_id': customer.id
-        }, status=status_code)
+            payment_type = payment_vault.get_card_brand(payer, card_id) or '--empty--'
+        except payment_vault.VaultError as e:
+            return response.Response(data={'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.start_payment(request, order, payer, payment_models.PaymentIntent.STRIPE, card_id=card_id,
+                                  payment_type=payment_type, description=data.get('description', '-empty-'))
 
 
 class SendNotificationsView(views.APIView):
@@ -1115,68 +1048,15 @@ class SocialRegisterView(views.APIView):
         return response.Response(data=data, status=status_code)
 
 
-class UserPaymentPaypalView(views.APIView):
+class UserPaymentPaypalView(PaymentIntentMixin, views.APIView):
 
     def post(self, request, *args, **kwargs):
-        order = order_models.Order.objects.get(pk=kwargs.get('order_id'))
+        order = get_object_or_404(order_models.Order, pk=kwargs.get('order_id'), customer__phone=kwargs.get('phone'))
         nonce = request.data.get('nonce')
-
-        gateway = braintree.BraintreeGateway(
-            braintree.Configuration(
-                braintree.Environment.Sandbox,
-                merchant_id=settings.PAYPAL_MERCHANT_ID,
-                public_key=settings.PAYPAL_PUBLIC_KEY,
-                private_key=settings.PAYPAL_PRIVATE_KEY
-            )
-        )
-        try:
-            result = gateway.transaction.sale({
-                "amount": order.total_price,
-                "payment_method_nonce": nonce,
-                "options": {
-                    "submit_for_settlement": True
-                }
-            })
-            if result.is_success:
-                transaction_id = result.transaction.id
-                paypal_payment = payment_models.PaypalTransaction()
-                paypal_payment.transaction_id = transaction_id
-                paypal_payment.order = order
-                paypal_payment.amount = result.transaction.amount
-                paypal_payment.payment_type = result.transaction.credit_card_details.card_type if result.transaction.credit_card_details else 'Paypal'
-                paypal_payment.save()
-                order.state = order_models.Order.READY
-                order.save()
-                simple_transaction = order_models.Transaction()
-                simple_transaction.amount = result.transaction.amount
-                simple_transaction.order = order
-                simple_transaction.payment_type = result.transaction.credit_card_details.card_type if result.transaction.credit_card_details else 'Paypal'
-                simple_transaction.payer = order.customer
-                simple_transaction.save()
-
-                data = {
-                    'message': 'Successful paid',
-                    'transaction_id': transaction_id,
-                    'is_success': True
-                }
-            elif result.transaction:
-                data = {
-                    'status': result.transaction.processor_response_code,
-                    'message': result.transaction.processor_response_text,
-                    'is_success': False
-                }
-            else:
-                print(result.errors)
-                data = {
-                    'message': result.errors.deep_errors[0].message,
-                    'is_success': False
-                }
-        except Exception as e:
-            print(e)
-            return response.Response(data={
-                'message': e
-            })
-        return response.Response(data=data)
+        if not nonce:
+            return response.Response(data={'message': 'nonce is required'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.start_payment(request, order, order.customer, payment_models.PaymentIntent.BRAINTREE,
+                                  token=nonce)
 
 
 class CashierFreeItemChangeView(generics.UpdateAPIView):
@@ -18,6 +18,7 @@ from mptt.admin import DraggableMPTTAdmin
 from rest_framework.authtoken import models as rest_auth_models
 
 from apps.users import models as user_models
+from project import tasks as project_tasks
 from .forms import CategoryForm, NotificationsAdminForm
 
 
@@ -125,25 +126,15 @@ class NotificationsAdmin(admin.ModelAdmin):
                 text = form.data.get('text')
                 user_type = form.data.get('user_type')
 
-                users = user_models.User.objects.filter(user_type=user_type)
-
-                if count <= users.count():
-                    receivers = users[:count]
-                else:
-                    receivers = users
+                receiver_ids = list(user_models.User.objects.filter(user_type=user_type)
+                                    .order_by('pk').values_list('pk', flat=True)[:count])
                 if int(user_type) == user_models.User.OWNER:
-                    for receiver in receivers:
-                        user_models.Notifications.objects.create(**{
-                            'title': 'Notifications from Administrator',
-                            'user': receiver,
-                            'notification_sender': request.user,
-                            'text': text
-                        })
+                    project_tasks.send_admin_notifications.delay(receiver_ids, text, request.user.pk)
                 else:
                     pattern = re.compile(r"^[^.]*")
                     message = re.search(pattern, text).group(0)
 
-                self.message_user(request, "Notifications have been sent to {} users!".format(receivers.count()))
+                self.message_user(request, "Notifications have been sent to {} users!".format(len(receiver_ids)))
                 return redirect('/admin/users/notifications/')
             context = {'form': form}
             return render(request, 'admin/notifications/notifications_send.html', context)
@@ -197,8 +188,22 @@ class NewsAdmin(admin.ModelAdmin):
     list_display = ['title', 'created_at', ]
 
 
+class PointEntryInline(admin.TabularInline):
+    model = user_models.PointEntry
+    fields = ['created_at', 'reason', 'delta', 'balance', 'free_items_count', 'order']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request):
+        return False
+
+
 class PointAdmin(admin.ModelAdmin):
     list_display = ['owner', 'point_count', 'get_root_cafe', ]
+    # The balance only changes through the ledger, see apps.users.points
+    readonly_fields = ['point_count']
+    inlines = [PointEntryInline, ]
 
     @staticmethod
     def get_root_cafe(obj):
@@ -219,6 +224,12 @@ class FreeItemAdmin(admin.ModelAdmin):
         return None
 
 
+class PushOutboxAdmin(admin.ModelAdmin):
+    list_display = ['phone', 'tag', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'tag', ]
+    list_per_page = 50
+
+
 class CafeGeneralSettingsAdmin(admin.ModelAdmin):
     list_display = ['cafe_name', 'owner']
 
@@ -239,6 +250,7 @@ admin.site.register(user_models.Review, ReviewAdmin)
 admin.site.register(user_models.Album, AlbumAdmin)
 admin.site.register(user_models.ReviewLikeDislike, ReviewLikeDislikeAdmin)
 admin.site.register(user_models.Notifications, NotificationsAdmin)
+admin.site.register(user_models.PushOutbox, PushOutboxAdmin)
 admin.site.register(user_models.File, FileAdminPanel)
 admin.site.register(user_models.Cashier)
 admin.site.register(user_models.WeekTime)
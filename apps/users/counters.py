@@ -0,0 +1,63 @@
+"""
+Rebuild and check the denormalized review counters on Cafe and Review.
+
+The functions take the model class as an argument. Migration 0129_review_counters keeps its own
+frozen copy of the aggregation, so changes here do not alter what it did.
+"""
+from django.db.models import Count, Sum, Case, When, Value, IntegerField, FloatField
+from django.db.models.functions import Coalesce
+
+CAFE_COUNTERS = ('reviews_count', 'rating_sum', 'rating_count', 'likes_count', 'dislikes_count')
+REVIEW_COUNTERS = ('likes_count', 'dislikes_count')
+
+
+def count_when(**lookups):
+    return Sum(Case(When(then=Value(1), **lookups), default=Value(0), output_field=IntegerField()))
+
+
+def get_cafe_counters(cafe_model):
+    rating_sum = Sum(Case(When(reviews__parent__isnull=True, then='reviews__rate'), output_field=FloatField()))
+    return cafe_model.objects.annotate(
+        expected_reviews_count=Count('reviews'),
+        expected_rating_sum=Coalesce(rating_sum, Value(0.0)),
+        expected_rating_count=count_when(reviews__pk__isnull=False, reviews__parent__isnull=True),
+        expected_likes_count=count_when(reviews__parent__isnull=True, reviews__rate=1),
+        expected_dislikes_count=count_when(reviews__parent__isnull=True, reviews__rate=-1),
+    )
+
+
+def get_review_counters(review_model):
+    return review_model.objects.annotate(
+        expected_likes_count=count_when(reviewlikedislike__rate=1),
+        expected_dislikes_count=count_when(reviewlikedislike__rate=-1),
+    )
+
+
+def rebuild_counters(queryset, counters, commit=True):
+    """
+    Compare stored counters with freshly aggregated ones. Returns a list of
+    (pk, {counter: (stored, expected)}) for every row that was off, and fixes those rows
+    unless `commit` is False.
+    """
+    expected_names = ['expected_{}'.format(counter) for counter in counters]
+    mismatches = []
+    for row in queryset.values('pk', *(list(counters) + expected_names)).iterator():
+        expected = {counter: row['expected_{}'.format(counter)] for counter in counters}
+        differences = {
+            counter: (row[counter], expected[counter])
+            for counter in counters
+            if abs(row[counter] - expected[counter]) > 1e-6
+        }
+        if differences:
+            mismatches.append((row['pk'], differences))
+            if commit:
+                queryset.model.objects.filter(pk=row['pk']).update(**expected)
+    return mismatches
+
+
+def rebuild_cafe_counters(cafe_model, commit=True):
+    return rebuild_counters(get_cafe_counters(cafe_model), CAFE_COUNTERS, commit=commit)
+
+
+def rebuild_review_counters(review_model, commit=True):
+    return rebuild_counters(get_review_counters(review_model), REVIEW_COUNTERS, commit=commit)
@@ -0,0 +1,89 @@
+"""
+Cached identities: phone -> user id, auth token -> user id and user id -> User.
+
+Lookups go through a per-request identity map first, then the shared cache, and only then the database,
+so resolving the `<phone>` of a URL or an auth token costs no query once the cache is warm.
+The User entry is dropped whenever the user is saved or deleted and token entries when the token is
+deleted (rotated). A phone entry is checked against the cached user's phone, so after a phone change
+the old phone stops resolving without having to know it.
+"""
+from django.core.cache import cache
+
+from apps.users import models as user_models
+
+USER_CACHE_KEY = 'identity:user:{}'
+PHONE_CACHE_KEY = 'identity:phone:{}'
+TOKEN_CACHE_KEY = 'identity:token:{}'
+IDENTITY_CACHE_TIMEOUT = 60 * 60
+
+
+def get_identity_map(request):
+    """
+    Users already resolved for this request. Without a request every lookup starts from the shared cache.
+    """
+    if request is None:
+        return {}
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_identity_map'):
+        request._identity_map = {}
+    return request._identity_map
+
+
+def get_user(user_id, request=None):
+    identity_map = get_identity_map(request)
+    if user_id in identity_map:
+        return identity_map[user_id]
+    key = USER_CACHE_KEY.format(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = user_models.User.objects.get(pk=user_id)
+        cache.set(key, user, IDENTITY_CACHE_TIMEOUT)
+    identity_map[user_id] = user
+    return user
+
+
+def get_user_by_phone(phone, request=None):
+    """
+    Same as User.objects.get(phone=phone), raises User.DoesNotExist for an unknown phone.
+    """
+    identity_map = get_identity_map(request)
+    key = PHONE_CACHE_KEY.format(phone)
+    user_id = identity_map.get(key) or cache.get(key)
+    if user_id is not None:
+        try:
+            user = get_user(user_id, request)
+        except user_models.User.DoesNotExist:
+            user = None
+        if user is not None and user.phone == phone:
+            identity_map[key] = user_id
+            return user
+        cache.delete(key)
+
+    user = user_models.User.objects.get(phone=phone)
+    cache.set_many({key: user.pk, USER_CACHE_KEY.format(user.pk): user}, IDENTITY_CACHE_TIMEOUT)
+    identity_map[key] = user.pk
+    identity_map[user.pk] = user
+    return user
+
+
+def get_user_id_by_phone(phone, request=None):
+    try:
+        return get_user_by_phone(phone, request).pk
+    except user_models.User.DoesNotExist:
+        return None
+
+
+def get_token_user_id(key):
+    return cache.get(TOKEN_CACHE_KEY.format(key))
+
+
+def set_token_user_id(key, user_id):
+    cache.set(TOKEN_CACHE_KEY.format(key), user_id, IDENTITY_CACHE_TIMEOUT)
+
+
+def forget_user(user_id):
+    cache.delete(USER_CACHE_KEY.format(user_id))
+
+
+def forget_token(key):
+    cache.delete(TOKEN_CACHE_KEY.format(key))
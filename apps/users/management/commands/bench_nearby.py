@@ -0,0 +1,72 @@
+import random
+import time
+
+import geohash
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.users import models as user_models
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark nearby cafe search against synthetic cafes. All created rows are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cafes', type=int, default=100000)
+        parser.add_argument('--distance', type=float, default=5)
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=15)
+        parser.add_argument('--latitude', type=float, default=50.822482)
+        parser.add_argument('--longitude', type=float, default=-0.141449)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.create_cafes(options)
+                self.run_benchmark(options)
+                raise Rollback()
+        except Rollback:
+            self.stdout.write('Synthetic cafes rolled back')
+
+    def create_cafes(self, options):
+        owner = user_models.User.objects.create_user(phone='bench000000', password=None,
+                                                     user_type=user_models.User.OWNER)
+        category = user_models.Category.objects.create(name='Nearby benchmark')
+        cafes = []
+        for index in range(options['cafes']):
+            # Spread cafes over roughly +/- 2 degrees around the search point
+            latitude = options['latitude'] + random.uniform(-2, 2)
+            longitude = options['longitude'] + random.uniform(-2, 2)
+            cafes.append(user_models.Cafe(user=owner, category=category, cafe_name='Cafe {}'.format(index),
+                                          description='', call_center='0', status=user_models.Cafe.ACTIVE,
+                                          location=geohash.encode(latitude, longitude), latitude=latitude,
+                                          longitude=longitude, tax_rate=0))
+        user_models.Cafe.objects.bulk_create(cafes, batch_size=5000)
+        self.stdout.write('Created {} synthetic cafes'.format(len(cafes)))
+
+    def run_benchmark(self, options):
+        location = (options['latitude'], options['longitude'])
+        distance = options['distance']
+        queryset = user_models.Cafe.objects.filter(status=user_models.Cafe.ACTIVE)
+
+        def geohash_search():
+            cafes = list(queryset.filter(location__distance_lt=(location, distance)).order_by_distance())
+            return cafes[:options['limit']]
+
+        def bounding_box_search():
+            return list(queryset.nearby(location[0], location[1], distance, limit=options['limit']))
+
+        for name, search in (('geohash + python distance', geohash_search),
+                             ('bounding box + sql haversine', bounding_box_search)):
+            timings = []
+            for run in range(options['runs']):
+                started = time.perf_counter()
+                found = search()
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write('{}: {} results, median {:.2f} ms, max {:.2f} ms'.format(
+                name, len(found), timings[len(timings) // 2] * 1000, timings[-1] * 1000))
@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from project import modules as project_modules
+
+
+class Command(BaseCommand):
+    help = 'Benchmark news push fan-out against a stub FCM client with simulated request latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--latency', type=float, default=0.01, help='Seconds per simulated FCM request')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent chunk workers to simulate')
+
+    def handle(self, *args, **options):
+        phones = ['99890{:07d}'.format(index) for index in range(options['users'])]
+
+        push_client = project_modules.StubFCMNotification(latency=options['latency'])
+        started = time.perf_counter()
+        for phone in phones:
+            push_client.notify_topic_subscribers(topic_name=phone, message_body='News', sound="Default",
+                                                 tag='news_tag')
+        self.report('one request per user', push_client, started, len(phones))
+
+        push_client = project_modules.StubFCMNotification(latency=options['latency'])
+        chunk_size = options['chunk_size']
+        chunks = [phones[index:index + chunk_size] for index in range(0, len(phones), chunk_size)]
+
+        def send_chunk(chunk):
+            return sum(len(topics) for topics in project_modules.notify_topics(
+                chunk, 'News', push_client=push_client, sound="Default", tag='news_tag'))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            reached = sum(executor.map(send_chunk, chunks))
+        self.report('{} chunks, condition sends, {} workers'.format(len(chunks), options['workers']),
+                    push_client, started, reached)
+
+    def report(self, name, push_client, started, reached):
+        elapsed = time.perf_counter() - started
+        self.stdout.write('{}: {} users, {} requests, {:.2f} s, {:.0f} users/s'.format(
+            name, reached, len(push_client.requests), elapsed, reached / elapsed if elapsed else 0))
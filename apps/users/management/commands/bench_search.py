@@ -0,0 +1,84 @@
+import operator
+import random
+import time
+from functools import reduce
+
+import geohash
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from project import search as project_search
+from apps.users import models as user_models
+
+WORDS = ('espresso', 'latte', 'bakery', 'roastery', 'brunch', 'garden', 'vegan', 'croissant', 'harbour', 'market',
+         'station', 'corner', 'little', 'golden', 'bean', 'cup', 'kitchen', 'terrace', 'river', 'oak')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark cafe text search against synthetic cafes. All created rows are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cafes', type=int, default=100000)
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=15)
+        parser.add_argument('--search', default='golden roastery')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.create_cafes(options)
+                self.run_benchmark(options)
+                raise Rollback()
+        except Rollback:
+            self.stdout.write('Synthetic cafes rolled back')
+
+    def create_cafes(self, options):
+        owner = user_models.User.objects.create_user(phone='bench000000', password=None,
+                                                     user_type=user_models.User.OWNER)
+        category = user_models.Category.objects.create(name='Search benchmark')
+        cafes = []
+        for index in range(options['cafes']):
+            name = ' '.join(random.sample(WORDS, 2)).title()
+            description = '<p><strong>{}</strong>&nbsp;{}</p>'.format(name, ' '.join(random.sample(WORDS, 8)))
+            cafes.append(user_models.Cafe(user=owner, category=category, cafe_name='{} {}'.format(name, index),
+                                          description=description, address='{} Street'.format(random.choice(WORDS)),
+                                          call_center='0', status=user_models.Cafe.ACTIVE,
+                                          location=geohash.encode(50.8, -0.1), latitude=50.8, longitude=-0.1,
+                                          tax_rate=0))
+        user_models.Cafe.objects.bulk_create(cafes, batch_size=5000)
+        # bulk_create sends no post_save, so the vectors are built here in one statement
+        project_search.update_search_vectors(user_models.Cafe.objects.filter(category=category),
+                                             project_search.CAFE_DOCUMENT)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE users_cafe')
+        self.stdout.write('Created {} synthetic cafes'.format(len(cafes)))
+
+    def run_benchmark(self, options):
+        text = options['search']
+        queryset = user_models.Cafe.objects.filter(status=user_models.Cafe.ACTIVE)
+
+        def icontains_search():
+            # What SearchFilter builds for search_fields = ['cafe_name', 'address', 'description']
+            query = reduce(operator.and_, [
+                Q(cafe_name__icontains=term) | Q(address__icontains=term) | Q(description__icontains=term)
+                for term in text.split()
+            ])
+            return list(queryset.filter(query)[:options['limit']])
+
+        def full_text_search():
+            return list(project_search.search(queryset, text, 'cafe_name').order_by('-search_rank')[:options['limit']])
+
+        for name, search in (('icontains or-chain', icontains_search), ('tsvector + trigram, ranked', full_text_search)):
+            timings = []
+            for run in range(options['runs']):
+                started = time.perf_counter()
+                found = search()
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write('{}: {} results, median {:.2f} ms, max {:.2f} ms'.format(
+                name, len(found), timings[len(timings) // 2] * 1000, timings[-1] * 1000))
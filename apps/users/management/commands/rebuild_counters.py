@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.users import models as user_models
+from apps.users.counters import rebuild_cafe_counters, rebuild_review_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized rating, review and like/dislike counters on cafes and reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', default=False,
+                            help='Only report counters that are off and exit with an error if any are found.')
+
+    def handle(self, *args, **options):
+        commit = not options['check']
+        with transaction.atomic():
+            cafe_mismatches = rebuild_cafe_counters(user_models.Cafe, commit=commit)
+            review_mismatches = rebuild_review_counters(user_models.Review, commit=commit)
+
+        for label, mismatches in (('Cafe', cafe_mismatches), ('Review', review_mismatches)):
+            for pk, differences in mismatches:
+                details = ', '.join('{} {} -> {}'.format(counter, stored, expected)
+                                    for counter, (stored, expected) in sorted(differences.items()))
+                self.stdout.write('{} {}: {}'.format(label, pk, details))
+
+        total = len(cafe_mismatches) + len(review_mismatches)
+        if not commit and total:
+            raise CommandError('{} rows have counters out of sync'.format(total))
+        action = 'Fixed' if commit else 'Checked'
+        self.stdout.write(self.style.SUCCESS('{} counters, {} rows were out of sync'.format(action, total)))
@@ -1,9 +1,11 @@
-from datetime import datetime, date
+import math
 
 from django.contrib.auth.models import BaseUserManager
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import Q, Avg
+from django.db.models import Q, F, Case, When, ExpressionWrapper, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.apps import apps
 
@@ -28,49 +30,170 @@ def get_week_day(day):
     return None
 
 
-current_day = date.today().weekday()
-current_week_day = get_week_day(current_day)
+MINUTES_IN_DAY = 24 * 60
+MINUTES_IN_WEEK = 7 * MINUTES_IN_DAY
+
+
+def get_local_now():
+    now = timezone.now()
+    if timezone.is_aware(now):
+        now = timezone.localtime(now)
+    return now
+
+
+def get_current_week_day():
+    # Resolved per call: a value computed at import time goes stale after midnight in long-lived workers
+    return get_week_day(get_local_now().weekday())
+
+
+def get_week_minute(moment):
+    """Minutes since Monday 00:00 for a datetime (weekday) or (weekday, time) pair."""
+    if isinstance(moment, tuple):
+        week_day, moment = moment
+    else:
+        week_day = moment.weekday()
+    return week_day * MINUTES_IN_DAY + moment.hour * 60 + moment.minute
+
+
+def get_week_intervals(day, opening_time, closing_time):
+    """
+    Opening hours of a week day as [start, end) minute-of-week intervals. Hours closing at or
+    before the opening time run past midnight, and Sunday night wraps around to Monday morning.
+    """
+    if opening_time is None or closing_time is None or opening_time == closing_time:
+        return []
+    day_index = [week_day[0] for week_day in WEEK_DAYS].index(day)
+    start = get_week_minute((day_index, opening_time))
+    end = get_week_minute((day_index, closing_time))
+    if closing_time < opening_time:
+        end += MINUTES_IN_DAY
+    if end > MINUTES_IN_WEEK:
+        return [(start, MINUTES_IN_WEEK), (0, end - MINUTES_IN_WEEK)]
+    return [(start, end)]
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+HAVERSINE_SQL = (
+    "2 * %s * ASIN(SQRT(LEAST(1.0, "
+    "POWER(SIN(RADIANS({table}.latitude - %s) / 2), 2) + "
+    "COS(RADIANS(%s)) * COS(RADIANS({table}.latitude)) * POWER(SIN(RADIANS({table}.longitude - %s) / 2), 2))))"
+)
+
+
+def get_distance(latitude, longitude, other_latitude, other_longitude):
+    """Great-circle distance in km, the Python counterpart of HAVERSINE_SQL"""
+    half_chord = (math.sin(math.radians(other_latitude - latitude) / 2) ** 2 +
+                  math.cos(math.radians(latitude)) * math.cos(math.radians(other_latitude)) *
+                  math.sin(math.radians(other_longitude - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, half_chord)))
+
+
+def get_bounding_box(latitude, longitude, distance):
+    """
+    Return ((min_lat, max_lat), longitude_ranges) covering a circle of `distance` km.
+    Longitude ranges are split in two when the box crosses the antimeridian and are empty
+    when the box reaches a pole, because then every longitude is a candidate.
+    """
+    latitude_delta = distance / KM_PER_DEGREE
+    min_latitude = max(latitude - latitude_delta, -90.0)
+    max_latitude = min(latitude + latitude_delta, 90.0)
+    if min_latitude <= -90.0 or max_latitude >= 90.0:
+        return (min_latitude, max_latitude), []
+
+    # Widest point of the box is on the parallel closest to a pole
+    widest_cos = math.cos(math.radians(max(abs(min_latitude), abs(max_latitude))))
+    longitude_delta = distance / (KM_PER_DEGREE * widest_cos)
+    if longitude_delta >= 180:
+        return (min_latitude, max_latitude), []
+
+    min_longitude = longitude - longitude_delta
+    max_longitude = longitude + longitude_delta
+    if min_longitude < -180:
+        longitude_ranges = [(min_longitude + 360, 180.0), (-180.0, max_longitude)]
+    elif max_longitude > 180:
+        longitude_ranges = [(min_longitude, 180.0), (-180.0, max_longitude - 360)]
+    else:
+        longitude_ranges = [(min_longitude, max_longitude)]
+    return (min_latitude, max_latitude), longitude_ranges
 
 
 class CafeQueryset(GeoQuerySet):
+    def filter_by_states(self, states, moment=None):
+        """
+        Filter by any of the 'open', 'closed' and 'unknown' states at `moment` (default: now) in
+        one statement. 'open' comes from the minute-of-week CafeOpenInterval index, so overnight
+        hours are covered; 'closed' and 'unknown' depend on whether today has a WeekTime row.
+        """
+        open_interval_model = apps.get_model(app_label='users', model_name='cafeopeninterval')
+        week_time_model = apps.get_model(app_label='users', model_name='weektime')
+        moment = moment or get_local_now()
+        week_minute = get_week_minute(moment)
+
+        open_cafes = open_interval_model.objects.filter(start_minute__lte=week_minute,
+                                                        end_minute__gt=week_minute).values('cafe_id')
+        scheduled_cafes = week_time_model.objects.filter(day=get_week_day(moment.weekday()),
+                                                         cafe__isnull=False).values('cafe_id')
+        is_open = Q(pk__in=open_cafes)
+        query = Q()
+        if 'open' in states:
+            query |= is_open
+        if 'closed' in states:
+            query |= Q(pk__in=scheduled_cafes) & ~is_open
+        if 'unknown' in states:
+            query |= ~Q(pk__in=scheduled_cafes) & ~is_open
+        if not query:
+            return self.none()
+        return self.filter(query)
+
+    def nearby(self, latitude, longitude, distance, limit=None):
+        """
+        Cafes within `distance` km of the point, closest first, with the exact haversine
+        distance in km annotated as `distance`. Candidates are pruned by a bounding box on the
+        indexed latitude/longitude columns before the database computes any distance.
+        """
+        latitude_range, longitude_ranges = get_bounding_box(latitude, longitude, distance)
+        queryset = self.filter(latitude__range=latitude_range)
+        if longitude_ranges:
+            longitude_query = Q()
+            for longitude_range in longitude_ranges:
+                longitude_query |= Q(longitude__range=longitude_range)
+            queryset = queryset.filter(longitude_query)
+
+        table = self.model._meta.db_table
+        distance_sql = RawSQL(HAVERSINE_SQL.format(table=table), (EARTH_RADIUS_KM, latitude, latitude, longitude),
+                              output_field=FloatField())
+        queryset = queryset.annotate(distance=distance_sql).filter(distance__lte=distance).order_by('distance')
+        if limit:
+            queryset = queryset[:limit]
+        return queryset
+
+    def filter_by_max_rate(self, rate):
+        """Cafes whose average rating is at most `rate`, plus cafes that have not been rated yet"""
+        total_rate = Case(When(rating_count=0, then=None),
+                          default=ExpressionWrapper(F('rating_sum') / F('rating_count'), output_field=FloatField()),
+                          output_field=FloatField())
+        return self.annotate(total_rate=total_rate).filter(Q(total_rate__lte=rate) | Q(total_rate=None))
+
+    def with_listing_data(self):
+        """
+        Load everything CafesSerializer needs for a whole page up front: owner, owner settings
+        and category are joined and week times are prefetched once. Review counters are
+        denormalized on Cafe, so no aggregation is needed.
+        """
+        return self.select_related('category', 'user', 'user__settings').prefetch_related('week_time')
+
     def get_nearby_locations(self, location_lat_long, distance, **kwargs):
         cafe = apps.get_model(app_label='users', model_name='cafe')
-        queryset = self.filter(location__distance_lt=(location_lat_long, distance), status=cafe.ACTIVE)
+        latitude, longitude = location_lat_long
         # distance in kilometres
+        queryset = self.filter(status=cafe.ACTIVE).nearby(latitude, longitude, distance)
         if kwargs.get('rate') or kwargs.get('states'):
-            week_time_model = apps.get_model(app_label='users', model_name='weektime')
-            queryset = queryset
             if kwargs.get('rate'):
-                rate = kwargs.get('rate', 0)
-                queryset = queryset.annotate(total_rate=Avg('review__rate')).filter(
-                    Q(total_rate__lte=rate) | Q(total_rate=None))
+                queryset = queryset.filter_by_max_rate(kwargs.get('rate', 0))
 
             if kwargs.get('states'):
-                now = datetime.now().time()
-                states = kwargs.get('states').split(',')
-                open_cafes = closed_cafes = unknown_cafes = list()
-
-                current_day_available_cafes_queryset = week_time_model.objects.filter(day=current_week_day)
-
-                if states.__contains__('open'):
-                    open_cafes = current_day_available_cafes_queryset.filter(opening_time__lte=now,
-                                                                             closing_time__gte=now).values_list(
-                        'cafe', flat=True)
-                if states.__contains__('closed'):
-                    open_cafes_queryset = current_day_available_cafes_queryset.filter(opening_time__lte=now,
-                                                                                      closing_time__gte=now).values_list(
-                        'cafe', flat=True)
-                    closed_cafes_queryset = current_day_available_cafes_queryset.values_list('cafe',
-                                                                                             flat=True)
-                    closed_cafes = list(set(closed_cafes_queryset) - set(open_cafes_queryset))
-
-                if states.__contains__('unknown'):
-                    current_day_available_cafes = current_day_available_cafes_queryset.distinct(
-                        'cafe').values_list('cafe', flat=True)
-                    unknown_cafes = queryset.exclude(pk__in=current_day_available_cafes).values_list('id',
-                                                                                                     flat=True)
-                all_cafes = list(open_cafes) + list(closed_cafes) + list(unknown_cafes)
-                queryset = queryset.filter(pk__in=all_cafes)
+                queryset = queryset.filter_by_states(kwargs.get('states').split(','))
         return queryset
 
 
@@ -81,6 +204,9 @@ class CafeManager(GeoManager):
     def get_nearby_locations(self, location_lat_long, distance, **kwargs):
         return self.get_queryset().get_nearby_locations(location_lat_long, distance,**kwargs)
 
+    def with_listing_data(self):
+        return self.get_queryset().with_listing_data()
+
 
 class AlbumManager(models.Manager):
 
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from geosimple.utils import convert_to_point
+
+
+def fill_coordinates(apps, schema_editor):
+    Cafe = apps.get_model('users', 'Cafe')
+    for cafe in Cafe.objects.exclude(location='').exclude(location__isnull=True).iterator():
+        point = convert_to_point(cafe.location)
+        Cafe.objects.filter(pk=cafe.pk).update(latitude=point.latitude, longitude=point.longitude)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0126_auto_20181213_1703'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cafe',
+            name='latitude',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='cafe',
+            name='longitude',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_coordinates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of apps.users.managers.get_week_intervals as of this migration
+WEEK_DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+MINUTES_IN_DAY = 24 * 60
+MINUTES_IN_WEEK = 7 * MINUTES_IN_DAY
+
+
+def get_week_intervals(day, opening_time, closing_time):
+    """
+    Opening hours of a week day as [start, end) minute-of-week intervals. Hours closing at or
+    before the opening time run past midnight, and Sunday night wraps around to Monday morning.
+    """
+    if opening_time is None or closing_time is None or opening_time == closing_time:
+        return []
+    day_start = WEEK_DAYS.index(day) * MINUTES_IN_DAY
+    start = day_start + opening_time.hour * 60 + opening_time.minute
+    end = day_start + closing_time.hour * 60 + closing_time.minute
+    if closing_time < opening_time:
+        end += MINUTES_IN_DAY
+    if end > MINUTES_IN_WEEK:
+        return [(start, MINUTES_IN_WEEK), (0, end - MINUTES_IN_WEEK)]
+    return [(start, end)]
+
+
+def build_open_intervals(apps, schema_editor):
+    WeekTime = apps.get_model('users', 'WeekTime')
+    CafeOpenInterval = apps.get_model('users', 'CafeOpenInterval')
+    intervals = [
+        CafeOpenInterval(cafe_id=week_time.cafe_id, start_minute=start, end_minute=end)
+        for week_time in WeekTime.objects.filter(cafe__isnull=False).iterator()
+        for start, end in get_week_intervals(week_time.day, week_time.opening_time, week_time.closing_time)
+    ]
+    CafeOpenInterval.objects.bulk_create(intervals, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0127_cafe_latitude_longitude'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CafeOpenInterval',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_minute', models.PositiveIntegerField()),
+                ('end_minute', models.PositiveIntegerField()),
+                ('cafe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_intervals', to='users.Cafe')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='cafeopeninterval',
+            index_together=set([('start_minute', 'end_minute')]),
+        ),
+        migrations.RunPython(build_open_intervals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Case, When, Value, IntegerField, FloatField
+from django.db.models.functions import Coalesce
+
+# Frozen copy of apps.users.counters as of this migration, so later changes there do not alter it
+CAFE_COUNTERS = ('reviews_count', 'rating_sum', 'rating_count', 'likes_count', 'dislikes_count')
+REVIEW_COUNTERS = ('likes_count', 'dislikes_count')
+
+
+def count_when(**lookups):
+    return Sum(Case(When(then=Value(1), **lookups), default=Value(0), output_field=IntegerField()))
+
+
+def fill_model_counters(queryset, counters):
+    expected_names = ['expected_{}'.format(counter) for counter in counters]
+    for row in queryset.values('pk', *expected_names).iterator():
+        expected = {counter: row['expected_{}'.format(counter)] for counter in counters}
+        # The new columns default to 0, so only rows with reviews or votes need a write
+        if any(expected.values()):
+            queryset.model.objects.filter(pk=row['pk']).update(**expected)
+
+
+def fill_counters(apps, schema_editor):
+    Cafe = apps.get_model('users', 'Cafe')
+    Review = apps.get_model('users', 'Review')
+    rating_sum = Sum(Case(When(reviews__parent__isnull=True, then='reviews__rate'), output_field=FloatField()))
+    fill_model_counters(Cafe.objects.annotate(
+        expected_reviews_count=Count('reviews'),
+        expected_rating_sum=Coalesce(rating_sum, Value(0.0)),
+        expected_rating_count=count_when(reviews__pk__isnull=False, reviews__parent__isnull=True),
+        expected_likes_count=count_when(reviews__parent__isnull=True, reviews__rate=1),
+        expected_dislikes_count=count_when(reviews__parent__isnull=True, reviews__rate=-1),
+    ), CAFE_COUNTERS)
+    fill_model_counters(Review.objects.annotate(
+        expected_likes_count=count_when(reviewlikedislike__rate=1),
+        expected_dislikes_count=count_when(reviewlikedislike__rate=-1),
+    ), REVIEW_COUNTERS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0128_cafeopeninterval'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cafe',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cafe',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cafe',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cafe',
+            name='rating_sum',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cafe',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def open_ledger(apps, schema_editor):
+    Point = apps.get_model('users', 'Point')
+    PointEntry = apps.get_model('users', 'PointEntry')
+    # Merge duplicate balances of a customer at one cafe before they become unique
+    duplicates = Point.objects.values('owner_id', 'root_cafe_id').annotate(
+        rows=Count('id'), total=Sum('point_count')).filter(rows__gt=1)
+    for duplicate in duplicates:
+        points = Point.objects.filter(owner_id=duplicate['owner_id'],
+                                      root_cafe_id=duplicate['root_cafe_id']).order_by('id')
+        kept = points.first()
+        points.exclude(pk=kept.pk).delete()
+        Point.objects.filter(pk=kept.pk).update(point_count=duplicate['total'])
+
+    PointEntry.objects.bulk_create(
+        PointEntry(point_id=pk, delta=point_count, balance=point_count, reason='opening')
+        for pk, point_count in Point.objects.values_list('pk', 'point_count').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0024_cart_price_snapshots'),
+        ('users', '0129_review_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('balance', models.PositiveIntegerField()),
+                ('reason', models.CharField(choices=[('opening', 'Opening balance'), ('earned', 'Earned'), ('exchanged', 'Exchanged for free items')], max_length=20)),
+                ('free_items_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='orders.Order')),
+                ('point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='users.Point')),
+            ],
+            options={
+                'ordering': ('id',),
+                'verbose_name_plural': 'Point entries',
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='point',
+            unique_together=set([('owner', 'root_cafe')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0131_pushoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='freeitem',
+            index=models.Index(fields=['status', 'expire_time'], name='users_freeitem_status_exp_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The CAFE_DOCUMENT of project/search.py as it was when this migration was written
+BUILD_SEARCH_VECTORS_SQL = """
+UPDATE users_cafe SET search_vector =
+    setweight(to_tsvector('english'::regconfig, coalesce(users_cafe.cafe_name, '')), 'A') ||
+    setweight(to_tsvector('english'::regconfig, coalesce(
+        (SELECT name FROM users_category WHERE users_category.id = users_cafe.category_id), '')), 'B') ||
+    setweight(to_tsvector('english'::regconfig, coalesce(users_cafe.address, '')), 'C') ||
+    setweight(to_tsvector('english'::regconfig, coalesce(regexp_replace(regexp_replace(
+        users_cafe.description, '<[^>]*>', ' ', 'g'), '&[#a-zA-Z0-9]+;', ' ', 'g'), '')), 'D')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0132_freeitem_status_expire_time_index'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='cafe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cafe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'],
+                                                           name='users_cafe_search_vector_idx'),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX users_cafe_name_trgm_idx ON users_cafe USING gin (cafe_name gin_trgm_ops)',
+            'DROP INDEX users_cafe_name_trgm_idx',
+        ),
+        migrations.RunSQL(BUILD_SEARCH_VECTORS_SQL, migrations.RunSQL.noop),
+    ]
@@ -2,24 +2,32 @@
 from __future__ import unicode_literals
 import os
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser, PermissionsMixin, BaseUserManager
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
 from django.shortcuts import reverse
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from mptt.models import MPTTModel, TreeForeignKey
 from ckeditor.fields import RichTextField
 from geosimple.fields import GeohashField
+from geosimple.utils import convert_to_point
 from autoslug.fields import AutoSlugField
 from localflavor.us.models import USStateField
 
 from project import tasks as project_tasks
 from project import modules as project_modules
+from project import search as project_search
+from apps.users import identity as user_identity
 
 from .managers import (
     CafeManager,
     AlbumManager,
+    get_week_intervals,
 )
 
 
@@ -197,8 +205,50 @@ class WeekTime(models.Model):
     def __str__(self):
         return self.day
 
+    def get_week_intervals(self):
+        return get_week_intervals(self.day, self.opening_time, self.closing_time)
 
-class Cafe(models.Model):
+
+class CafeOpenInterval(models.Model):
+    """Schedule index built from WeekTime rows, see rebuild_open_intervals()"""
+    cafe = models.ForeignKey('Cafe', on_delete=models.CASCADE, related_name='open_intervals')
+    start_minute = models.PositiveIntegerField()
+    end_minute = models.PositiveIntegerField()
+
+    class Meta:
+        index_together = [('start_minute', 'end_minute')]
+
+
+def rebuild_open_intervals(cafe_id):
+    intervals = [
+        CafeOpenInterval(cafe_id=cafe_id, start_minute=start, end_minute=end)
+        for week_time in WeekTime.objects.filter(cafe_id=cafe_id)
+        for start, end in week_time.get_week_intervals()
+    ]
+    with transaction.atomic():
+        CafeOpenInterval.objects.filter(cafe_id=cafe_id).delete()
+        CafeOpenInterval.objects.bulk_create(intervals)
+
+
+class CounterFieldsMixin(object):
+    """
+    Keeps `counter_fields`, which are only changed by F() updates, out of saves of existing rows:
+    a full save would write back the values loaded with the instance and lose every update since.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            deferred_fields = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+                and field.attname not in deferred_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Cafe(CounterFieldsMixin, models.Model):
     BLOCKED = 0
     ACTIVE = 1
     PENDING = 2
@@ -216,37 +266,54 @@ class Cafe(models.Model):
     website = models.URLField(null=True, blank=True)
     status = models.IntegerField(choices=STATUS, default=BLOCKED)
     location = GeohashField(default={'latitude': 50.822482, 'longitude': -0.141449}, editable=False)
+    # Plain copies of location, kept in sync on save, so nearby search can use indexed range lookups
+    latitude = models.FloatField(null=True, editable=False, db_index=True)
+    longitude = models.FloatField(null=True, editable=False, db_index=True)
     address = models.TextField(null=True, blank=True, verbose_name=_('Address 1'))
     second_address = models.TextField(null=True, blank=True, verbose_name=_('Address 2'))
     city = models.CharField(null=True, blank=True, max_length=220)
     state = USStateField(null=True)
     postal_code = models.CharField(null=True, max_length=12)
     tax_rate = models.DecimalField(max_digits=100, decimal_places=2)
+    # Review counters, maintained by the Review signal handlers below and rebuilt by `manage.py rebuild_counters`.
+    # Ratings, likes and dislikes come from top-level reviews only, replies just add to reviews_count.
+    reviews_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.FloatField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    dislikes_count = models.PositiveIntegerField(default=0, editable=False)
+    # Full-text document of name, category, address and description, maintained by cafe_search_handler below
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = CafeManager()
+    counter_fields = ('reviews_count', 'rating_sum', 'rating_count', 'likes_count', 'dislikes_count')
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='users_cafe_search_vector_idx')]
 
     def __str__(self):
         return self.cafe_name
 
+    def save(self, *args, **kwargs):
+        if self.location:
+            point = convert_to_point(self.location)
+            self.latitude = point.latitude
+            self.longitude = point.longitude
+        super().save(*args, **kwargs)
+
     @property
     def get_total_rate(self):
-        total_rate = 0
-        rates = Review.objects.filter(cafe=self).values('rate')
-        if len(rates) > 0:
-            for rate in rates:
-                total_rate += rate['rate']
-            total_rate = total_rate / len(rates)
-        return total_rate
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
+        return 0
 
     @property
     def get_likes(self):
-        likes = Review.objects.filter(cafe=self, rate=1).count()
-        return likes
+        return self.likes_count
 
     @property
     def get_dislikes(self):
-        dislikes = Review.objects.filter(cafe=self, rate=-1).count()
-        return dislikes
+        return self.dislikes_count
 
     def cafe_changed(self):
         self.status = self.PENDING
@@ -289,7 +356,7 @@ class Cashier(models.Model):
         return "Cafe - {}, Cashier - {}".format(self.cafe.cafe_name, self.cashier)
 
 
-class Review(MPTTModel):
+class Review(CounterFieldsMixin, MPTTModel):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='review_author')
     parent = TreeForeignKey('self', null=True, blank=True, related_name='review_parent', db_index=True)
     comment = models.TextField()
@@ -297,6 +364,11 @@ class Review(MPTTModel):
     album = models.ForeignKey(Album, null=True, blank=True, related_name='review_album')
     cafe = models.ForeignKey(Cafe, null=True, related_name='reviews')
     rate = models.FloatField(default=0)
+    # ReviewLikeDislike counters, maintained by the signal handlers below
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    dislikes_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('likes_count', 'dislikes_count')
 
     def get_files(self, obj):
         return File.objects.all()
@@ -332,6 +404,38 @@ class Notifications(models.Model):
         verbose_name_plural = 'Notifications'
 
 
+class PushOutbox(models.Model):
+    """
+    A push waiting to be sent to one phone topic. Rows are written in the transaction that causes the push
+    and sent by `project.tasks.send_queued_pushes`, so a slow FCM never holds up that transaction.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+    phone = models.CharField(max_length=12)
+    message = models.TextField()
+    tag = models.CharField(max_length=60)
+    status = models.CharField(choices=STATUS_CHOICES, default=PENDING, max_length=20)
+    attempts = models.PositiveIntegerField(default=0)
+    # Earliest time a worker may pick the row up: retry backoff for pending rows, claim expiry for sending ones
+    available_at = models.DateTimeField(default=timezone.now)
+    response = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Push outbox'
+        verbose_name_plural = 'Push outbox'
+        indexes = [models.Index(fields=['status', 'available_at'], name='users_push_status_avail_idx')]
+
+
 class News(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL)
     title = models.CharField(max_length=120)
@@ -344,6 +448,8 @@ class News(models.Model):
     class Meta:
         verbose_name = 'News'
         verbose_name_plural = 'News'
+        # Backs the (created_at, id) cursor of the news feed
+        indexes = [models.Index(fields=['created_at', 'id'], name='users_news_created_id_idx')]
 
     def __str__(self):
         return self.title
@@ -370,6 +476,32 @@ class Point(models.Model):
     root_cafe = models.ForeignKey(CafeGeneralSettings, null=True)
     # Todo: removed cafe_owner, everywhere must be replaced cafe_owner to root_cafe,
 
+    class Meta:
+        # One balance row per customer and cafe; every change to it is recorded in PointEntry
+        unique_together = ('owner', 'root_cafe')
+
+
+class PointEntry(models.Model):
+    OPENING = 'opening'
+    EARNED = 'earned'
+    EXCHANGED = 'exchanged'
+    REASON_CHOICES = (
+        (OPENING, 'Opening balance'),
+        (EARNED, 'Earned'),
+        (EXCHANGED, 'Exchanged for free items'),
+    )
+    point = models.ForeignKey(Point, related_name='entries')
+    delta = models.IntegerField()
+    balance = models.PositiveIntegerField()
+    reason = models.CharField(choices=REASON_CHOICES, max_length=20)
+    order = models.ForeignKey('orders.Order', null=True, blank=True, on_delete=models.SET_NULL)
+    free_items_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name_plural = 'Point entries'
+
 
 class FreeItem(models.Model):
     VALID = 'valid'
@@ -388,13 +520,19 @@ class FreeItem(models.Model):
     expire_time = models.DateTimeField(null=True)
     status = models.CharField(choices=STATUS_CHOICES, default=VALID, max_length=60)
 
+    class Meta:
+        indexes = [models.Index(fields=['status', 'expire_time'], name='users_freeitem_status_exp_idx')]
+
     def get_status(self):
         return self.status
 
     @classmethod
-    def filter_by_day(self, day):
-        return FreeItem.objects.filter(expire_time__day=day.day, expire_time__month=day.month,
-                                       expire_time__year=day.year)
+    def filter_by_day(cls, day):
+        # A half-open range over the local day, so the (status, expire_time) index can be used
+        if isinstance(day, timezone.datetime):
+            day = timezone.localtime(day).date() if timezone.is_aware(day) else day.date()
+        start = timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+        return cls.objects.filter(expire_time__gte=start, expire_time__lt=start + timezone.timedelta(days=1))
 
 
 class InvitedUser(models.Model):
@@ -406,21 +544,127 @@ class InvitedUser(models.Model):
 
 def news_create_handler(sender, instance, **kwargs):
     if kwargs['created']:
-        project_tasks.send_news_notifications.delay(news_id=instance.id)
+        # The fan-out task reads the news row, so it must not start before the row is committed
+        transaction.on_commit(lambda: project_tasks.send_news_notifications.delay(news_id=instance.id))
 
 
 post_save.connect(receiver=news_create_handler, sender=News)
 
 
+def week_time_change_handler(sender, instance, **kwargs):
+    # Covers the cafe week time page, the admin inlines and any other WeekTime write
+    if instance.cafe_id:
+        rebuild_open_intervals(instance.cafe_id)
+
+
+post_save.connect(receiver=week_time_change_handler, sender=WeekTime)
+post_delete.connect(receiver=week_time_change_handler, sender=WeekTime)
+
+
+def update_cafe_review_counters(cafe_id, is_rating, rate, sign):
+    counters = {'reviews_count': F('reviews_count') + sign}
+    if is_rating:
+        counters.update({
+            'rating_sum': F('rating_sum') + sign * rate,
+            'rating_count': F('rating_count') + sign,
+            'likes_count': F('likes_count') + sign * int(rate == 1),
+            'dislikes_count': F('dislikes_count') + sign * int(rate == -1),
+        })
+    Cafe.objects.filter(pk=cafe_id).update(**counters)
+
+
+def update_review_vote_counters(review_id, rate, sign):
+    if rate in (1, -1):
+        counter = 'likes_count' if rate == 1 else 'dislikes_count'
+        Review.objects.filter(pk=review_id).update(**{counter: F(counter) + sign})
+
+
+def review_pre_save_handler(sender, instance, **kwargs):
+    # Remember the stored state, so post_save can move the counters from the old values to the new ones
+    instance._stored_counter_state = None
+    if instance.pk:
+        instance._stored_counter_state = sender.objects.filter(pk=instance.pk).values(
+            'cafe_id', 'parent_id', 'rate').first()
+
+
+def review_post_save_handler(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_counter_state', None)
+    if stored == {'cafe_id': instance.cafe_id, 'parent_id': instance.parent_id, 'rate': instance.rate}:
+        return
+    if stored and stored['cafe_id']:
+        update_cafe_review_counters(stored['cafe_id'], stored['parent_id'] is None, stored['rate'], -1)
+    if instance.cafe_id:
+        update_cafe_review_counters(instance.cafe_id, instance.parent_id is None, instance.rate, 1)
+
+
+def review_post_delete_handler(sender, instance, **kwargs):
+    if instance.cafe_id:
+        update_cafe_review_counters(instance.cafe_id, instance.parent_id is None, instance.rate, -1)
+
+
+def review_vote_pre_save_handler(sender, instance, **kwargs):
+    instance._stored_counter_state = None
+    if instance.pk:
+        instance._stored_counter_state = sender.objects.filter(pk=instance.pk).values('review_id', 'rate').first()
+
+
+def review_vote_post_save_handler(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_counter_state', None)
+    if stored == {'review_id': instance.review_id, 'rate': instance.rate}:
+        return
+    if stored:
+        update_review_vote_counters(stored['review_id'], stored['rate'], -1)
+    update_review_vote_counters(instance.review_id, instance.rate, 1)
+
+
+def review_vote_post_delete_handler(sender, instance, **kwargs):
+    update_review_vote_counters(instance.review_id, instance.rate, -1)
+
+
+pre_save.connect(receiver=review_pre_save_handler, sender=Review)
+post_save.connect(receiver=review_post_save_handler, sender=Review)
+post_delete.connect(receiver=review_post_delete_handler, sender=Review)
+pre_save.connect(receiver=review_vote_pre_save_handler, sender=ReviewLikeDislike)
+post_save.connect(receiver=review_vote_post_save_handler, sender=ReviewLikeDislike)
+post_delete.connect(receiver=review_vote_post_delete_handler, sender=ReviewLikeDislike)
+
+
 def point_create_handler(sender, instance, **kwargs):
     if kwargs['created']:
-        phone = instance.owner.phone
-        sent = project_modules.send_push_for_topic(phone=phone, message='You have new point', tag='points')
-        import os
-        from django.conf import settings
-        file = open('/mnt/python/projects/landskap/sent_data.txt', 'a+')
-        file.write(f"{sent}\n")
-        file.close()
-        print(f"{sent}")
+        project_modules.send_push_for_topic(phone=instance.owner.phone, message='You have new point', tag='points')
 
 post_save.connect(receiver=point_create_handler, sender=Point)
+
+
+def user_identity_handler(sender, instance, **kwargs):
+    user_identity.forget_user(instance.pk)
+
+
+def token_delete_handler(sender, instance, **kwargs):
+    user_identity.forget_token(instance.key)
+
+
+post_save.connect(receiver=user_identity_handler, sender=User)
+post_delete.connect(receiver=user_identity_handler, sender=User)
+post_delete.connect(receiver=token_delete_handler, sender='authtoken.Token')
+
+
+CAFE_SEARCH_FIELDS = {'cafe_name', 'category', 'address', 'description'}
+
+
+def cafe_search_handler(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not CAFE_SEARCH_FIELDS.intersection(update_fields):
+        return
+    project_search.update_search_vectors(Cafe.objects.filter(pk=instance.pk), project_search.CAFE_DOCUMENT)
+
+
+def category_search_handler(sender, instance, **kwargs):
+    # Cafe documents include the category name
+    if not kwargs['created']:
+        project_search.update_search_vectors(Cafe.objects.filter(category_id=instance.pk),
+                                             project_search.CAFE_DOCUMENT)
+
+
+post_save.connect(receiver=cafe_search_handler, sender=Cafe)
+post_save.connect(receiver=category_search_handler, sender=Category)
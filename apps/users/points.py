@@ -0,0 +1,72 @@
+"""
+Loyalty point ledger.
+
+A customer's balance at a cafe is one Point row, changed only through `add_points`: the row is locked,
+updated with F() expressions and every change is appended to PointEntry, so the entries of a Point always
+add up to its balance. Each time the balance reaches the cafe's `exchangeable_point` it is exchanged for
+a FreeItem, as many times as it fits.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from apps.users import models as user_models
+
+BALANCE_CACHE_KEY = 'point_balance:{}:{}'
+BALANCE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_balance_cache_key(customer_id, cafe_owner_id):
+    return BALANCE_CACHE_KEY.format(customer_id, cafe_owner_id)
+
+
+def get_balance(customer_id, cafe_owner_id):
+    """
+    Points the customer has at the cafes of `cafe_owner_id`, cached until the balance changes.
+    """
+    key = get_balance_cache_key(customer_id, cafe_owner_id)
+    balance = cache.get(key)
+    if balance is None:
+        balance = user_models.Point.objects.filter(
+            owner_id=customer_id, root_cafe__owner_id=cafe_owner_id,
+        ).aggregate(total=Sum('point_count'))['total'] or 0
+        cache.set(key, balance, BALANCE_CACHE_TIMEOUT)
+    return balance
+
+
+def add_points(root_cafe, customer, count, order=None):
+    """
+    Add `count` points to the customer's balance at `root_cafe` and issue the free items it pays for.
+    Returns the updated Point.
+    """
+    with transaction.atomic():
+        point, created = user_models.Point.objects.get_or_create(root_cafe=root_cafe, owner_id=customer.id,
+                                                                 defaults={'point_count': 0})
+        # Concurrent orders of the same customer queue up here instead of overwriting each other
+        balance = user_models.Point.objects.select_for_update().values_list(
+            'point_count', flat=True).get(pk=point.pk) + count
+
+        free_items_count = balance // root_cafe.exchangeable_point if root_cafe.exchangeable_point > 0 else 0
+        spent = free_items_count * root_cafe.exchangeable_point
+        user_models.Point.objects.filter(pk=point.pk).update(point_count=F('point_count') + count - spent)
+
+        entries = [user_models.PointEntry(point=point, delta=count, balance=balance,
+                                          reason=user_models.PointEntry.EARNED, order=order)]
+        if free_items_count:
+            expire_time = timezone.now() + timezone.timedelta(days=root_cafe.expiration_days)
+            user_models.FreeItem.objects.bulk_create([
+                user_models.FreeItem(owner_id=customer.id, root_cafe_id=root_cafe.id,
+                                     point_count=root_cafe.exchangeable_point, expire_time=expire_time)
+                for _ in range(free_items_count)
+            ])
+            entries.append(user_models.PointEntry(point=point, delta=-spent, balance=balance - spent,
+                                                  reason=user_models.PointEntry.EXCHANGED, order=order,
+                                                  free_items_count=free_items_count))
+        user_models.PointEntry.objects.bulk_create(entries)
+
+        key = get_balance_cache_key(customer.id, root_cafe.owner_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    point.refresh_from_db()
+    return point
@@ -1,6 +1,314 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from pyfcm.errors import FCMServerError
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from project import modules as project_modules
+from project import tasks as project_tasks
+from apps.users import models as user_models
+from apps.users import points as user_points
+from apps.users import identity as user_identity
+from apps.restapp.authentication import CachedTokenAuthentication
+
+
+class PointLedgerTest(TransactionTestCase):
+    THREADS = 8
+    POINTS_PER_ORDER = 3
+
+    def setUp(self):
+        cache.clear()
+        self.owner = user_models.User.objects.create_user(phone='100000001', password='secret',
+                                                          user_type=user_models.User.OWNER)
+        self.root_cafe = user_models.CafeGeneralSettings.objects.create(owner=self.owner, cafe_name='Owner settings',
+                                                                        exchangeable_point=10)
+        self.customer = user_models.User.objects.create_user(phone='100000003', password='secret')
+        patcher = mock.patch.object(project_modules, 'send_push_for_topic')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertLedgerMatches(self, total_points):
+        point = user_models.Point.objects.get(owner=self.customer, root_cafe=self.root_cafe)
+        free_items = user_models.FreeItem.objects.filter(owner=self.customer, root_cafe=self.root_cafe).count()
+        self.assertEqual((free_items, point.point_count), divmod(total_points, self.root_cafe.exchangeable_point))
+        self.assertEqual(point.entries.aggregate(total=Sum('delta'))['total'], point.point_count)
+        self.assertEqual(user_points.get_balance(self.customer.id, self.owner.id), point.point_count)
+
+    def test_points_crossing_the_threshold_twice_issue_two_free_items(self):
+        self.assertEqual(user_points.get_balance(self.customer.id, self.owner.id), 0)
+        point = user_points.add_points(self.root_cafe, self.customer, 25)
+        self.assertEqual(point.point_count, 5)
+        self.assertLedgerMatches(25)
+
+    def test_parallel_orders_do_not_lose_points(self):
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def add_points():
+            try:
+                barrier.wait()
+                user_points.add_points(self.root_cafe, self.customer, self.POINTS_PER_ORDER)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_points) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLedgerMatches(self.THREADS * self.POINTS_PER_ORDER)
+
+
+class PushOutboxTest(TestCase):
+
+    def setUp(self):
+        self.user = user_models.User.objects.create_user(phone='100000003', password='secret')
+        self.push_client = project_modules.StubFCMNotification()
+        patcher = mock.patch.object(project_modules, 'push_service', self.push_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_push_is_stored_and_sent_by_the_worker(self):
+        project_modules.send_push_for_topic(self.user.phone, 'Your order is ready', tag='order_ready')
+        self.assertEqual(self.push_client.requests, [])
+
+        self.assertEqual(project_tasks.send_queued_pushes(), 1)
+        push = user_models.PushOutbox.objects.get()
+        self.assertEqual((push.status, push.attempts), (user_models.PushOutbox.SENT, 1))
+        self.assertEqual(self.push_client.requests, [self.user.phone])
+        self.assertEqual(project_tasks.send_queued_pushes(), 0)
+
+    def test_failed_push_waits_before_a_retry(self):
+        project_modules.queue_push(self.user.phone, 'You have new point', tag='points')
+        with mock.patch.object(self.push_client, 'notify_topic_subscribers', side_effect=FCMServerError('down')):
+            self.assertEqual(project_tasks.send_queued_pushes(), 0)
+
+        push = user_models.PushOutbox.objects.get()
+        self.assertEqual((push.status, push.attempts), (user_models.PushOutbox.PENDING, 1))
+        self.assertGreater(push.available_at, timezone.now())
+        self.assertEqual(project_tasks.send_queued_pushes(), 0)
+
+    def test_unexpected_error_fails_only_that_push(self):
+        broken = project_modules.queue_push(self.user.phone, 'Broken', tag='points')
+        project_modules.queue_push(self.user.phone, 'Your order is ready', tag='order_ready')
+        deliver_push = project_modules.deliver_push
+
+        def deliver_or_break(push, push_client=None):
+            if push.pk == broken.pk:
+                raise ValueError('Malformed push')
+            return deliver_push(push, push_client)
+
+        with mock.patch.object(project_modules, 'deliver_push', side_effect=deliver_or_break):
+            self.assertEqual(project_tasks.send_queued_pushes(), 1)
+        statuses = dict(user_models.PushOutbox.objects.values_list('message', 'status'))
+        self.assertEqual(statuses, {'Broken': user_models.PushOutbox.FAILED,
+                                    'Your order is ready': user_models.PushOutbox.SENT})
+
+    def test_push_claimed_too_often_is_failed(self):
+        # The worker died during the last allowed attempt and the claim has run out
+        push = project_modules.queue_push(self.user.phone, 'You have new point', tag='points')
+        user_models.PushOutbox.objects.filter(pk=push.pk).update(
+            status=user_models.PushOutbox.SENDING, attempts=project_tasks.PUSH_OUTBOX_MAX_ATTEMPTS,
+            available_at=timezone.now() - timezone.timedelta(seconds=1))
+
+        self.assertEqual(project_tasks.send_queued_pushes(), 0)
+        self.assertEqual(user_models.PushOutbox.objects.get().status, user_models.PushOutbox.FAILED)
+        self.assertEqual(self.push_client.requests, [])
+
+
+class FreeItemExpiryTest(TestCase):
+
+    def setUp(self):
+        self.user = user_models.User.objects.create_user(phone='100000003', password='secret')
+
+    def create_free_item(self, expire_time, status=user_models.FreeItem.VALID):
+        return user_models.FreeItem.objects.create(owner=self.user, expire_time=expire_time, status=status)
+
+    def test_overdue_items_are_expired_in_batches(self):
+        now = timezone.now()
+        overdue = [self.create_free_item(now - timezone.timedelta(hours=hours)) for hours in range(1, 6)]
+        upcoming = self.create_free_item(now + timezone.timedelta(hours=1))
+        redeemed = self.create_free_item(now - timezone.timedelta(hours=1), status=user_models.FreeItem.REDEEMED)
+
+        self.assertEqual(project_tasks.expire_free_items(batch_size=2), len(overdue))
+        statuses = dict(user_models.FreeItem.objects.values_list('pk', 'status'))
+        self.assertEqual({statuses[item.pk] for item in overdue}, {user_models.FreeItem.EXPIRED})
+        self.assertEqual(statuses[upcoming.pk], user_models.FreeItem.VALID)
+        self.assertEqual(statuses[redeemed.pk], user_models.FreeItem.REDEEMED)
+
+    def test_filter_by_day_covers_the_whole_local_day(self):
+        day = timezone.localdate() + timezone.timedelta(days=2)
+        start = timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+        inside = [self.create_free_item(start), self.create_free_item(start + timezone.timedelta(hours=23))]
+        self.create_free_item(start - timezone.timedelta(seconds=1))
+        self.create_free_item(start + timezone.timedelta(days=1))
+
+        self.assertEqual(sorted(user_models.FreeItem.filter_by_day(day).values_list('pk', flat=True)),
+                         sorted(item.pk for item in inside))
+
+
+class IdentityCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = user_models.User.objects.create_user(phone='100000003', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = CachedTokenAuthentication()
+
+    def test_warm_lookups_cost_no_queries(self):
+        user_identity.get_user_by_phone(self.user.phone)
+        self.authentication.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_identity.get_user_by_phone(self.user.phone), self.user)
+            user, auth = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual((user, auth), (self.user, self.token.key))
+
+    def test_phone_change_and_token_rotation_are_picked_up(self):
+        user_identity.get_user_by_phone(self.user.phone)
+        self.authentication.authenticate_credentials(self.token.key)
+
+        old_phone = self.user.phone
+        self.user.phone = '100000004'
+        self.user.save()
+        self.assertEqual(user_identity.get_user_by_phone('100000004'), self.user)
+        with self.assertRaises(user_models.User.DoesNotExist):
+            user_identity.get_user_by_phone(old_phone)
+
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+
+class CafeCounterFieldsTest(TestCase):
+
+    def setUp(self):
+        owner = user_models.User.objects.create_user(phone='100000005', password='secret',
+                                                     user_type=user_models.User.OWNER)
+        self.author = user_models.User.objects.create_user(phone='100000006', password='secret')
+        category = user_models.Category.objects.create(name='Coffee')
+        self.cafe = user_models.Cafe.objects.create(user=owner, cafe_name='Cafe', category=category, description='',
+                                                    call_center='1', status=user_models.Cafe.ACTIVE, tax_rate=0)
+
+    def test_saving_a_loaded_cafe_keeps_counters_updated_since(self):
+        cafe = user_models.Cafe.objects.get(pk=self.cafe.pk)
+        user_models.Review.objects.create(author=self.author, cafe=self.cafe, comment='Good', rate=1)
+        cafe.cafe_name = 'Renamed cafe'
+        cafe.save()
+
+        cafe.refresh_from_db()
+        self.assertEqual(cafe.cafe_name, 'Renamed cafe')
+        self.assertEqual((cafe.reviews_count, cafe.rating_count, cafe.likes_count), (1, 1, 1))
+
+    def test_saving_a_loaded_review_keeps_its_votes(self):
+        review = user_models.Review.objects.create(author=self.author, cafe=self.cafe, comment='Good', rate=1)
+        user_models.ReviewLikeDislike.objects.create(like_dislike_user=self.author, review=review, rate=1)
+        review.comment = 'Very good'
+        review.save()
+
+        review.refresh_from_db()
+        self.assertEqual((review.comment, review.likes_count), ('Very good', 1))
+
+
+class NotificationsTest(TestCase):
+
+    def setUp(self):
+        self.sender = user_models.User.objects.create_user(phone='100000007', password='secret')
+        self.user_ids = [user_models.User.objects.create_user(phone='10000010{}'.format(index), password='secret').pk
+                         for index in range(5)]
+
+    def test_notifications_are_inserted_in_batches(self):
+        progress = []
+        with self.assertNumQueries(3):
+            created = project_modules.create_notifications(iter(self.user_ids), title='Hello', text='Hi',
+                                                           batch_size=2, progress=progress.append)
+        self.assertEqual((created, progress), (5, [2, 4, 5]))
+        self.assertEqual(sorted(user_models.Notifications.objects.values_list('user_id', flat=True)), self.user_ids)
+
+    def test_exact_batches_leave_no_empty_insert(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(project_modules.create_notifications(self.user_ids[:4], title='Hello', text='Hi',
+                                                                  batch_size=2), 4)
+        self.assertEqual(project_modules.create_notifications([], title='Hello', text='Hi'), 0)
+
+    def test_admin_broadcast_task(self):
+        self.assertEqual(project_tasks.send_admin_notifications.apply(
+            args=(self.user_ids, 'Hi', self.sender.pk)).get(), 5)
+        self.assertEqual(user_models.Notifications.objects.filter(notification_sender=self.sender,
+                                                                  title='Notifications from Administrator').count(), 5)
+
+
+class FailingFCMNotification(project_modules.StubFCMNotification):
+    """
+    Fails the `fail_at`-th request with a server error, once.
+    """
+
+    def __init__(self, fail_at):
+        super().__init__()
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def notify_topic_subscribers(self, topic_name=None, condition=None, **kwargs):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise FCMServerError('Internal Server Error')
+        return super().notify_topic_subscribers(topic_name=topic_name, condition=condition, **kwargs)
+
+
+class NewsPushTest(TestCase):
+
+    def setUp(self):
+        owner = user_models.User.objects.create_user(phone='100000008', password='secret')
+        self.news = user_models.News.objects.create(owner=owner, title='New menu', content='')
+        self.phones = [owner.phone] + [
+            user_models.User.objects.create_user(phone='10000020{}'.format(index), password='secret').phone
+            for index in range(11)
+        ]
+
+    def test_user_phones_are_read_in_keyset_chunks(self):
+        with self.assertNumQueries(4):
+            chunks = list(project_tasks.iterate_user_phones(5))
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 2])
+        self.assertEqual([phone for chunk in chunks for phone in chunk], self.phones)
+
+    def test_fan_out_queues_one_task_per_chunk(self):
+        with mock.patch.object(project_tasks, 'NEWS_PUSH_CHUNK_SIZE', 5), \
+                mock.patch.object(project_tasks.send_news_notifications_chunk, 'delay') as delay:
+            self.assertEqual(project_tasks.send_news_notifications(self.news.pk), 3)
+        self.assertEqual([call[1]['phones'] for call in delay.call_args_list],
+                         [self.phones[:5], self.phones[5:10], self.phones[10:]])
+
+    def test_topics_are_sent_five_per_condition(self):
+        push_client = project_modules.StubFCMNotification()
+        groups = list(project_modules.notify_topics(self.phones[:11], 'Hello', push_client=push_client))
+        self.assertEqual(groups, [self.phones[:5], self.phones[5:10], self.phones[10:11]])
+        self.assertEqual(push_client.requests, [
+            project_modules.get_topics_condition(self.phones[:5]),
+            project_modules.get_topics_condition(self.phones[5:10]),
+            # A single topic is addressed by name, conditions need two topics at least
+            self.phones[10],
+        ])
+        self.assertEqual(push_client.requests[0].count(' in topics'), 5)
+
+    def test_chunk_retry_resends_only_the_phones_not_reached(self):
+        push_client = FailingFCMNotification(fail_at=2)
+        with mock.patch.object(project_modules, 'push_service', push_client):
+            project_tasks.send_news_notifications_chunk.apply(kwargs={'news_id': self.news.pk,
+                                                                      'phones': self.phones})
+        self.assertEqual(push_client.requests, [
+            project_modules.get_topics_condition(self.phones[:5]),
+            project_modules.get_topics_condition(self.phones[5:10]),
+            project_modules.get_topics_condition(self.phones[10:]),
+        ])
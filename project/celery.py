@@ -1,6 +1,7 @@
 
 import os
 from celery import Celery
+from celery.schedules import crontab
 
 from django.conf import settings
 
@@ -16,4 +17,24 @@ app.conf.update(
     CELERY_TASK_SERIALIZER='json',
     CELERY_RESULT_SERIALIZER='json',
     CELERY_TIMEZONE='Asia/Tashkent',
+    CELERYBEAT_SCHEDULE={
+        # Picks up pushes whose send failed or whose worker died; new pushes are queued right after commit
+        'send-queued-pushes': {
+            'task': 'project.tasks.send_queued_pushes',
+            'schedule': 60,
+        },
+        # Captures whose worker died; each one is claimed again and reconciled through its idempotency key
+        'requeue-stale-payments': {
+            'task': 'apps.payment.tasks.requeue_stale_payments',
+            'schedule': 60,
+        },
+        'expire-free-items': {
+            'task': 'project.tasks.expire_free_items',
+            'schedule': crontab(minute=0),
+        },
+        'send-free-item-expire-notifications': {
+            'task': 'project.tasks.send_free_item_expire_notifications',
+            'schedule': crontab(hour=10, minute=0),
+        },
+    },
 )
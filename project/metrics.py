@@ -0,0 +1,215 @@
+"""
+Per-view request metrics: SQL query count and time, repeated queries, serializer time, response size
+and latency.
+
+QueryMetricsMiddleware (add 'project.metrics.QueryMetricsMiddleware' to MIDDLEWARE) records every
+request under the name of the view it resolved to. Serializer time is recorded by views that use
+SerializerMetricsMixin. Values are aggregated into histograms in the memory of the process and served
+in the Prometheus text format by `metrics_view`, to staff users or to scrapers that send METRICS_TOKEN
+as a bearer token, so every worker process is scraped on its own. Queries that run more than once in
+a request with the same shape, the usual trace of an N+1, are counted by fingerprint.
+"""
+import hmac
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from django.test.utils import CaptureQueriesContext
+
+QUERY_METRICS_ENABLED = getattr(settings, 'QUERY_METRICS_ENABLED', True)
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+METRICS_VIEW_NAME = 'metrics'
+# Fingerprints kept per view; the least repeated ones are dropped first
+MAX_FINGERPRINTS_PER_VIEW = 20
+
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = (
+    ('api_sql_queries', 'SQL queries per request.', QUERY_BUCKETS),
+    ('api_sql_seconds', 'Time spent in SQL per request.', SECONDS_BUCKETS),
+    ('api_serializer_seconds', 'Time spent in serializer.data per request, for views that time it.',
+     SECONDS_BUCKETS),
+    ('api_response_bytes', 'Size of the response body.', BYTES_BUCKETS),
+    ('api_request_seconds', 'Time to build the response.', SECONDS_BUCKETS),
+)
+
+# Literals are replaced so that queries differing only in their parameters share a fingerprint
+FINGERPRINT_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)'), '(...)'),
+)
+
+
+def get_fingerprint(sql):
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def get_duplicate_queries(queries):
+    """
+    {fingerprint: executions} of the captured queries that ran more than once.
+    """
+    fingerprints = Counter(get_fingerprint(query['sql']) for query in queries)
+    return {fingerprint: count for fingerprint, count in fingerprints.items() if count > 1}
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsStore(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.duplicates = {}
+
+    def record(self, view_name, values, duplicates):
+        with self.lock:
+            for name, help_text, buckets in HISTOGRAMS:
+                key = (name, view_name)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(buckets)
+                self.histograms[key].observe(values[name])
+            if duplicates:
+                view_duplicates = self.duplicates.setdefault(view_name, Counter())
+                view_duplicates.update({fingerprint: count - 1 for fingerprint, count in duplicates.items()})
+                if len(view_duplicates) > MAX_FINGERPRINTS_PER_VIEW:
+                    self.duplicates[view_name] = Counter(dict(view_duplicates.most_common(MAX_FINGERPRINTS_PER_VIEW)))
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.duplicates.clear()
+
+    def render(self):
+        pid = os.getpid()
+        lines = []
+        with self.lock:
+            for name, help_text, buckets in HISTOGRAMS:
+                lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} histogram'.format(name)]
+                for (metric, view_name), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    labels = 'view="{}",pid="{}"'.format(escape_label(view_name), pid)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, count))
+                    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, histogram.count))
+                    lines.append('{}_sum{{{}}} {}'.format(name, labels, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(name, labels, histogram.count))
+            lines += ['# HELP api_duplicate_queries_total Repeated executions of a query shape within a request.',
+                      '# TYPE api_duplicate_queries_total counter']
+            for view_name, view_duplicates in sorted(self.duplicates.items()):
+                for fingerprint, count in view_duplicates.most_common():
+                    lines.append('api_duplicate_queries_total{{view="{}",pid="{}",query="{}"}} {}'.format(
+                        escape_label(view_name), pid, escape_label(fingerprint), count))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+store = MetricsStore()
+
+
+class RequestMetrics(object):
+
+    def __init__(self):
+        self.serializer_time = 0
+
+
+class TimedSerializer(object):
+    """
+    Stands in for a serializer and adds the time spent in its `data` to the request's serializer time.
+    """
+
+    def __init__(self, serializer, request_metrics):
+        self._serializer = serializer
+        self._request_metrics = request_metrics
+
+    def __getattr__(self, name):
+        return getattr(self._serializer, name)
+
+    @property
+    def data(self):
+        started = time.perf_counter()
+        try:
+            return self._serializer.data
+        finally:
+            self._request_metrics.serializer_time += time.perf_counter() - started
+
+
+class SerializerMetricsMixin(object):
+    """
+    For generic views: records the time spent in `data` of the serializers built by get_serializer().
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        request_metrics = getattr(self.request, 'query_metrics', None)
+        if request_metrics is None:
+            return serializer
+        return TimedSerializer(serializer, request_metrics)
+
+
+class QueryMetricsMiddleware(object):
+
+    def __init__(self, get_response):
+        if not QUERY_METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = request.query_metrics = RequestMetrics()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match is not None and match.url_name != METRICS_VIEW_NAME:
+            queries = context.captured_queries
+            store.record(match.view_name, {
+                'api_sql_queries': len(queries),
+                'api_sql_seconds': sum(float(query['time']) for query in queries),
+                'api_serializer_seconds': request_metrics.serializer_time,
+                'api_response_bytes': len(response.content) if not response.streaming else 0,
+                'api_request_seconds': elapsed,
+            }, get_duplicate_queries(queries))
+        return response
+
+
+def has_metrics_token(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not METRICS_TOKEN or not authorization.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(authorization[len('Bearer '):].encode(), METRICS_TOKEN.encode())
+
+
+def metrics_view(request):
+    if not (request.user.is_staff or has_metrics_token(request)):
+        return HttpResponseForbidden()
+    return HttpResponse(store.render(), content_type='text/plain; version=0.0.4')
@@ -1,16 +1,62 @@
-from django.utils import timezone
+import time
+
 from django.conf import settings
+from django.db import transaction
+from project import tasks as project_tasks
 from apps.users import models as user_models
+from apps.users import points as user_points
+from apps.users import identity as user_identity
 
 from pyfcm import FCMNotification
 
 push_service = FCMNotification(api_key=settings.FCM_API_KEY)
 
+# FCM accepts at most five topics in one condition expression
+TOPICS_PER_CONDITION = 5
+NOTIFICATIONS_BATCH_SIZE = getattr(settings, 'NOTIFICATIONS_BATCH_SIZE', 1000)
+
+
+class StubFCMNotification(object):
+    """
+    Offline stand-in for FCMNotification. Every request waits `latency` seconds and is recorded,
+    so push throughput can be measured without talking to Firebase.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = []
+
+    def notify_topic_subscribers(self, topic_name=None, condition=None, **kwargs):
+        time.sleep(self.latency)
+        self.requests.append(condition or topic_name)
+        return {'multicast_ids': [], 'success': 1, 'failure': 0, 'canonical_ids': 0, 'results': [],
+                'topic_message_id': len(self.requests)}
+
+
+def get_topics_condition(topics):
+    return ' || '.join("'{}' in topics".format(topic) for topic in topics)
+
+
+def notify_topics(topics, message, push_client=None, **kwargs):
+    """
+    Send one message to many topics with one condition request per five topics.
+    Yields the topics of every group once it has been sent, so callers can resume after a failure.
+    """
+    push_client = push_client or push_service
+    for index in range(0, len(topics), TOPICS_PER_CONDITION):
+        group = topics[index:index + TOPICS_PER_CONDITION]
+        if len(group) == 1:
+            push_client.notify_topic_subscribers(topic_name=group[0], message_body=message, **kwargs)
+        else:
+            push_client.notify_topic_subscribers(condition=get_topics_condition(group), message_body=message,
+                                                 **kwargs)
+        yield group
+
 
 def send_push_for_topic(phone, message, tag='simple_notification', **kwargs):
-    receiver = user_models.User.objects.get(phone=phone)
+    receiver = user_identity.get_user_by_phone(phone)
     if kwargs.get('notification_sender'):
-        notification_sender = user_models.User.objects.get(id=kwargs.get('notification_sender'))
+        notification_sender = user_identity.get_user(kwargs.get('notification_sender'))
     else:
         notification_sender = None
     user_models.Notifications.objects.create(**{
@@ -19,34 +65,53 @@ def send_push_for_topic(phone, message, tag='simple_notification', **kwargs):
         'notification_sender': notification_sender,
         'text': message,
         })
-    return push_service.notify_topic_subscribers(topic_name=phone, message_body=message, sound="Default", tag=tag)
+    return queue_push(phone, message, tag=tag)
+
+
+def queue_push(phone, message, tag='simple_notification'):
+    """
+    Store the push in the outbox of the current transaction; a worker sends it once the transaction commits.
+    """
+    push = user_models.PushOutbox.objects.create(phone=phone, message=message, tag=tag)
+    transaction.on_commit(lambda: project_tasks.send_queued_pushes.delay())
+    return push
+
 
+def deliver_push(push, push_client=None):
+    push_client = push_client or push_service
+    return push_client.notify_topic_subscribers(topic_name=push.phone, message_body=push.message, sound="Default",
+                                                tag=push.tag)
 
-def point_free_item_calculation(cafe, client, count):
-    # Here point calculation
+
+def create_notifications(user_ids, title, text, notification_sender=None, batch_size=NOTIFICATIONS_BATCH_SIZE,
+                         progress=None):
+    """
+    Store the same notification for every user in `user_ids` with one INSERT per batch.
+    `progress` is called with the running total after every batch. Returns the number of rows created.
+    """
+    created = 0
+    batch = []
+    for user_id in user_ids:
+        batch.append(user_models.Notifications(title=title, text=text, user_id=user_id,
+                                               notification_sender=notification_sender))
+        if len(batch) == batch_size:
+            user_models.Notifications.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+            if progress:
+                progress(created)
+    if batch:
+        user_models.Notifications.objects.bulk_create(batch)
+        created += len(batch)
+        if progress:
+            progress(created)
+    return created
+
+
+def point_free_item_calculation(cafe, client, count, order=None):
     root_cafe, cafes_root_created = user_models.CafeGeneralSettings.objects.get_or_create(owner=cafe.user,
                                                                                           defaults={
                                                                                               'cafe_name': 'Not given'
                                                                                           })
-
-    point, point_created = user_models.Point.objects.get_or_create(root_cafe=root_cafe,
-                                                                   owner_id=client.id,
-                                                                   defaults={'point_count': count
-                                                                             })
-    if not point_created:
-        # Todo: Calculate total point
-        point.point_count += count
-        point.save()
-    if point.point_count >= root_cafe.exchangeable_point:
-        # Todo: Create new free item and subtract point
-        expire_datetime = timezone.now() + timezone.timedelta(days=root_cafe.expiration_days)
-        user_models.FreeItem.objects.create(
-            owner_id=client.id,
-            root_cafe_id=root_cafe.id,
-            point_count=root_cafe.exchangeable_point,
-            expire_time=expire_datetime
-        )
-        point.point_count -= root_cafe.exchangeable_point
-        point.save()
-    return point
+    return user_points.add_points(root_cafe, client, count, order=order)
 
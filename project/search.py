@@ -0,0 +1,66 @@
+"""
+PostgreSQL full-text search over cafes and products.
+
+Searchable models keep a `search_vector` tsvector column built from weighted document columns, with
+rich-text HTML stripped, and a GIN index on it. Names also have a pg_trgm GIN index, so a misspelt
+name still matches by trigram similarity. Vectors are rebuilt by queryset updates from the model
+signal handlers; the migrations that add the columns build them with inlined SQL.
+"""
+from django.conf import settings
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
+from django.db.models import CharField, F, FloatField, Q, TextField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = getattr(settings, 'SEARCH_CONFIG', 'english')
+
+# Tags and entities of rich text are replaced by spaces before the text is indexed
+STRIP_HTML_SQL = "regexp_replace(regexp_replace({}, '<[^>]*>', ' ', 'g'), '&[#a-zA-Z0-9]+;', ' ', 'g')"
+
+# (weight, SQL) pairs of the documents, {table} is the table of the searched model
+CAFE_DOCUMENT = (
+    ('A', '{table}.cafe_name'),
+    ('B', '(SELECT name FROM users_category WHERE users_category.id = {table}.category_id)'),
+    ('C', '{table}.address'),
+    ('D', STRIP_HTML_SQL.format('{table}.description')),
+)
+PRODUCT_DOCUMENT = (
+    ('A', '{table}.title'),
+    ('B', '(SELECT name FROM products_productcategory WHERE products_productcategory.id = {table}.category_id)'),
+    ('D', STRIP_HTML_SQL.format('{table}.description')),
+)
+
+# The `trigram_similar` lookup, registered as django.contrib.postgres does when it is an installed app
+CharField.register_lookup(TrigramSimilar)
+TextField.register_lookup(TrigramSimilar)
+
+
+def get_search_vector(model, document):
+    table = model._meta.db_table
+    sql = ' || '.join(
+        "setweight(to_tsvector(%s::regconfig, coalesce({}, '')), '{}')".format(column.format(table=table), weight)
+        for weight, column in document
+    )
+    return RawSQL(sql, [SEARCH_CONFIG] * len(document), output_field=SearchVectorField())
+
+
+def update_search_vectors(queryset, document):
+    """
+    Rebuild `search_vector` of every row of the queryset in one UPDATE.
+    """
+    return queryset.update(search_vector=get_search_vector(queryset.model, document))
+
+
+def search(queryset, text, name_field):
+    """
+    Rows matching every word of `text`, or whose `name_field` is similar to it, annotated with `search_rank`.
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG)
+    rank = SearchRank(F('search_vector'), query) + TrigramSimilarity(name_field, text)
+    # ts_rank and similarity are real; as double precision a rank read back from a cursor compares
+    # equal to the row it came from, so cursor pages neither repeat nor skip rows
+    return queryset.filter(
+        Q(search_vector=query) | Q(**{'{}__trigram_similar'.format(name_field): text})
+    ).annotate(search_rank=Cast(rank, FloatField()))
+
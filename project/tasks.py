@@ -1,9 +1,29 @@
+import json
+import logging
+
 from celery import shared_task
+from pyfcm.errors import FCMError, FCMServerError
+from requests import RequestException
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from apps.users import models as user_models
 from project import modules as project_modules
 
+# Users per fan-out subtask; each subtask sends one FCM request per five of them
+NEWS_PUSH_CHUNK_SIZE = getattr(settings, 'NEWS_PUSH_CHUNK_SIZE', 500)
+NEWS_PUSH_RATE_LIMIT = getattr(settings, 'NEWS_PUSH_RATE_LIMIT', '60/m')
+FREE_ITEM_EXPIRY_BATCH_SIZE = getattr(settings, 'FREE_ITEM_EXPIRY_BATCH_SIZE', 1000)
+PUSH_OUTBOX_BATCH_SIZE = getattr(settings, 'PUSH_OUTBOX_BATCH_SIZE', 100)
+PUSH_OUTBOX_MAX_ATTEMPTS = 5
+PUSH_OUTBOX_RETRY_DELAY = 30
+# A claimed push that is not finished within this time is picked up again, e.g. after a worker crash
+PUSH_OUTBOX_CLAIM_TIMEOUT = timezone.timedelta(minutes=5)
+
+logger = logging.getLogger(__name__)
+
 
 @shared_task
 def test():
@@ -13,29 +33,149 @@ def test():
     print('task finished')
 
 
+@shared_task
+def expire_free_items(batch_size=FREE_ITEM_EXPIRY_BATCH_SIZE):
+    """
+    Mark the valid free items whose expire time has passed as expired, in UPDATE batches of `batch_size` rows
+    so no statement holds many row locks at once.
+    """
+    FreeItem = user_models.FreeItem
+    now = timezone.now()
+    expired = 0
+    overdue = FreeItem.objects.filter(status=FreeItem.VALID, expire_time__lte=now).order_by('expire_time')
+    while True:
+        ids = list(overdue.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        # A batch whose rows were all expired concurrently updates nothing, but later batches may still be due
+        expired += FreeItem.objects.filter(pk__in=ids, status=FreeItem.VALID).update(status=FreeItem.EXPIRED)
+
+    logger.info('Free items expired: %s', expired)
+    return expired
+
+
 @shared_task
 def send_free_item_expire_notifications():
-    day_after_tomorrow = timezone.datetime.today() + timezone.timedelta(2)
-    free_items = user_models.FreeItem.filter_by_day(day=day_after_tomorrow).select_related('owner')
+    day_after_tomorrow = timezone.localdate() + timezone.timedelta(2)
+    # One notification and one push per owner, however many of their free items expire that day
+    owners = list(user_models.FreeItem.filter_by_day(day=day_after_tomorrow)
+                  .filter(status=user_models.FreeItem.VALID).order_by()
+                  .values_list('owner_id', 'owner__phone').distinct())
+    message = 'You have free item(s) which expires after 2 days'
 
-    for free_item in free_items:
-        user = free_item.owner
-        message = 'You have free item(s) which expires after 2 days'
-        result = project_modules.push_service.notify_topic_subscribers(topic_name=user.phone, message_body=message,
-                                                                       sound="Default", tag='free_item_expire_tag')
-        user_models.Notifications.objects.create(title='Free item expires', text=message, user_id=user.id)
+    created = project_modules.create_notifications((owner_id for owner_id, phone in owners),
+                                                   title='Free item expires', text=message)
+    pushed = 0
+    for topics in project_modules.notify_topics([phone for owner_id, phone in owners], message, sound="Default",
+                                                tag='free_item_expire_tag'):
+        pushed += len(topics)
 
-    print('task finished')
+    logger.info('Free item expire notifications: %s stored, %s owners pushed', created, pushed)
+    return created
+
+
+@shared_task
+def send_admin_notifications(user_ids, text, sender_id):
+    """
+    Store the notification an administrator broadcast from the admin site for every receiver.
+    """
+    return project_modules.create_notifications(user_ids, title='Notifications from Administrator', text=text,
+                                                notification_sender=user_models.User.objects.get(pk=sender_id))
+
+
+def iterate_user_phones(chunk_size):
+    # Keyset pagination on the primary key, so every chunk is one indexed range scan
+    last_id = 0
+    while True:
+        rows = list(user_models.User.objects.filter(pk__gt=last_id).exclude(phone='')
+                    .order_by('pk').values_list('pk', 'phone')[:chunk_size])
+        if not rows:
+            break
+        yield [phone for pk, phone in rows]
+        last_id = rows[-1][0]
 
 
 @shared_task
 def send_news_notifications(news_id):
-    news_intance = user_models.News.objects.get(pk=news_id)
-    users = user_models.User.objects.all()
+    chunks = 0
+    for phones in iterate_user_phones(NEWS_PUSH_CHUNK_SIZE):
+        send_news_notifications_chunk.delay(news_id=news_id, phones=phones)
+        chunks += 1
+    return chunks
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=30, rate_limit=NEWS_PUSH_RATE_LIMIT)
+def send_news_notifications_chunk(self, news_id, phones):
+    news_intance = user_models.News.objects.filter(pk=news_id).only('title').first()
+    if news_intance is None:
+        return 0
     data_message = {
         'id': news_id
     }
-    for user in users:
-        result = project_modules.push_service.notify_topic_subscribers(topic_name=user.phone, message_body=news_intance.title,
-                                                                       sound="Default", tag='news_tag', data_message=data_message)
-        print(result)
+    sent = 0
+    try:
+        for topics in project_modules.notify_topics(phones, news_intance.title, sound="Default", tag='news_tag',
+                                                    data_message=data_message):
+            sent += len(topics)
+    except (FCMServerError, RequestException) as exc:
+        # Only the phones that were not reached yet are retried, so nobody gets the news twice
+        raise self.retry(kwargs={'news_id': news_id, 'phones': phones[sent:]}, exc=exc,
+                         countdown=self.default_retry_delay * 2 ** self.request.retries)
+    return sent
+
+
+def claim_pushes(batch_size):
+    PushOutbox = user_models.PushOutbox
+    now = timezone.now()
+    with transaction.atomic():
+        # Pushes whose claim ran out after their last allowed attempt, e.g. because the worker kept crashing
+        PushOutbox.objects.filter(status=PushOutbox.SENDING, available_at__lte=now,
+                                  attempts__gte=PUSH_OUTBOX_MAX_ATTEMPTS).update(
+            status=PushOutbox.FAILED, response='Gave up after {} attempts'.format(PUSH_OUTBOX_MAX_ATTEMPTS))
+        # SKIP LOCKED lets several workers drain the outbox without waiting on each other's batches
+        ids = list(PushOutbox.objects.select_for_update(skip_locked=True).filter(
+            status__in=(PushOutbox.PENDING, PushOutbox.SENDING), available_at__lte=now,
+            attempts__lt=PUSH_OUTBOX_MAX_ATTEMPTS,
+        ).order_by('available_at').values_list('pk', flat=True)[:batch_size])
+        PushOutbox.objects.filter(pk__in=ids).update(status=PushOutbox.SENDING, attempts=F('attempts') + 1,
+                                                     available_at=now + PUSH_OUTBOX_CLAIM_TIMEOUT)
+    return list(PushOutbox.objects.filter(pk__in=ids).order_by('pk'))
+
+
+def record_push_failure(push, error):
+    PushOutbox = user_models.PushOutbox
+    fields = {'status': PushOutbox.FAILED, 'response': str(error)}
+    if isinstance(error, (FCMServerError, RequestException)) and push.attempts < PUSH_OUTBOX_MAX_ATTEMPTS:
+        fields['status'] = PushOutbox.PENDING
+        fields['available_at'] = timezone.now() + timezone.timedelta(
+            seconds=PUSH_OUTBOX_RETRY_DELAY * 2 ** (push.attempts - 1))
+    PushOutbox.objects.filter(pk=push.pk).update(**fields)
+
+
+@shared_task
+def send_queued_pushes(batch_size=PUSH_OUTBOX_BATCH_SIZE):
+    """
+    Send the pushes waiting in the outbox, batch by batch, and record every FCM response.
+    Queued after each commit that adds pushes; the beat schedule runs it as well to pick up retries.
+    """
+    PushOutbox = user_models.PushOutbox
+    sent = 0
+    while True:
+        pushes = claim_pushes(batch_size)
+        if not pushes:
+            break
+        for push in pushes:
+            try:
+                result = project_modules.deliver_push(push)
+            except (FCMError, RequestException) as e:
+                record_push_failure(push, e)
+                continue
+            except Exception as e:
+                # One broken push must not leave the rest of the batch claimed until the timeout
+                logger.exception('Push %s failed', push.pk)
+                record_push_failure(push, e)
+                continue
+            PushOutbox.objects.filter(pk=push.pk).update(status=PushOutbox.SENT, response=json.dumps(result, default=str),
+                                                         sent_at=timezone.now())
+            sent += 1
+    return sent
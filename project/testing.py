@@ -0,0 +1,39 @@
+"""
+Test helpers shared by the apps' test suites.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from project import metrics as project_metrics
+
+
+class QueryCountAssertionsMixin(object):
+    """
+    For TestCase classes: catches endpoints whose number of queries grows with the rows they return.
+    """
+
+    def count_queries(self, get_response):
+        with CaptureQueriesContext(connection) as context:
+            response = get_response()
+            if hasattr(response, 'render'):
+                response.render()
+        self.assertEqual(response.status_code, 200)
+        return context.captured_queries
+
+    def assertQueryCountDoesNotGrow(self, get_response, create_rows, first_rows=2, more_rows=8):
+        """
+        Fail if `get_response()` runs more queries after `create_rows(more_rows)` than after
+        `create_rows(first_rows)`, naming the queries that repeat per row.
+        """
+        create_rows(first_rows)
+        few_rows_queries = self.count_queries(get_response)
+        create_rows(more_rows)
+        more_rows_queries = self.count_queries(get_response)
+        if len(more_rows_queries) > len(few_rows_queries):
+            repeated = '\n'.join(
+                '{} x {}'.format(count, fingerprint)
+                for fingerprint, count in sorted(project_metrics.get_duplicate_queries(more_rows_queries).items(),
+                                                 key=lambda item: -item[1])
+            )
+            self.fail('{} queries for {} rows, {} for {} rows. Repeated queries:\n{}'.format(
+                len(few_rows_queries), first_rows, len(more_rows_queries), first_rows + more_rows, repeated))
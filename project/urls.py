@@ -8,6 +8,7 @@ from rest_framework.authtoken import views
 from rest_framework_swagger.views import get_swagger_view
 
 from apps.restapp.urls import urlpatterns as rest_urlpatterns
+from project import metrics as project_metrics
 
 api_title = 'Landskap API documentation'
 schema_view = get_swagger_view(title=api_title, patterns=rest_urlpatterns, url='/api/v1/')
@@ -21,6 +22,7 @@ urlpatterns = [
 urlpatterns += [
     url('^$', RedirectView.as_view(url='/cafe/',)),
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics/$', project_metrics.metrics_view, name=project_metrics.METRICS_VIEW_NAME),
     url(r'', include('apps.main.urls', namespace='main')),
     url(r'', include('apps.users.urls', namespace='users')),
     url(r'', include('apps.products.urls', namespace='products')),